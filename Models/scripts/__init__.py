@@ -22,6 +22,7 @@ import yaml
 from huggingface_hub import snapshot_download
 
 from .base import CometModel
+from .inference_engine import InferenceEngine
 from .multitask.unified_metric import UnifiedMetric
 from .multitask.xcomet_metric import XCOMETMetric
 from .ranking.ranking_metric import RankingMetric
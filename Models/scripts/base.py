@@ -19,9 +19,12 @@ CometModel
     Extend this class to create new model and metrics within COMET.
 """
 import abc
+import hashlib
 import logging
 import os
+import threading
 import warnings
+from contextlib import nullcontext
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
@@ -32,26 +35,49 @@ from torch.utils.data import DataLoader, RandomSampler, SequentialSampler, Subse
 from comet.encoders import str2encoder
 from comet.modules import LayerwiseAttention
 
-from .lru_cache import tensor_lru_cache
-from .pooling_utils import average_pooling, max_pooling
+from .embedding_cache import (
+    DiskEmbeddingStore,
+    SentenceEmbeddingCache,
+    parse_cache_size,
+    sentence_digest,
+    sentence_keys,
+)
+from .pooling_utils import masked_average_pooling, masked_max_pooling
 from .predict_pbar import PredictProgressBar
 from .predict_writer import CustomWriter
 from .utils import (
     OrderedSampler,
     Prediction,
     Target,
-    flatten_metadata,
-    restore_list_order,
+    gather_predictions,
+    token_budget_batches,
 )
 
-if "COMET_EMBEDDINGS_CACHE" in os.environ:
-    CACHE_SIZE = int(os.environ["COMET_EMBEDDINGS_CACHE"])
-else:
-    CACHE_SIZE = 1024
+# COMET_EMBEDDINGS_CACHE accepts a number of sentences (e.g: 100000) or a memory
+# budget in bytes with a unit suffix (e.g: 512MB, 2GiB).
+CACHE_ENTRIES, CACHE_BYTES = parse_cache_size(
+    os.environ.get("COMET_EMBEDDINGS_CACHE", "512MB")
+)
+# Optional folder of a persistent on-disk embedding store shared across runs.
+EMBEDDINGS_STORE = os.environ.get("COMET_EMBEDDINGS_STORE")
 
 
 logger = logging.getLogger(__name__)
 
+# Number of stacked copies of each sample in the batch being scored by the current
+# thread (batched MC Dropout). Thread local so that concurrent forwards don't mix.
+_mcd_replicas = threading.local()
+
+
+def _flag_stacked_encoder_pass(module, args, kwargs) -> None:
+    """Encoder forward pre-hook that flags encoder passes over a whole stacked batched
+    MC Dropout batch, i.e: models that do not encode through `get_sentence_embedding`.
+    """
+    rows = getattr(_mcd_replicas, "rows", 0)
+    input_ids = args[0] if args else kwargs.get("input_ids")
+    if rows and torch.is_tensor(input_ids) and input_ids.size(0) >= rows:
+        _mcd_replicas.stacked_encoder_pass = True
+
 
 class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
     """CometModel: Base class for all COMET models.
@@ -118,6 +144,9 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         self.encoder = str2encoder[self.hparams.encoder_model].from_pretrained(
             self.hparams.pretrained_model, load_pretrained_weights
         )
+        self.encoder.register_forward_pre_hook(
+            _flag_stacked_encoder_pass, with_kwargs=True
+        )
 
         self.epoch_nr = 0
         if self.hparams.layer == "mix":
@@ -141,18 +170,29 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
 
         self.nr_frozen_epochs = self.hparams.nr_frozen_epochs
         self.mc_dropout = False  # Flag used to control usage of MC Dropout
+        self.mc_dropout_batched = False  # Share encoder pass across MCD runs
+        self._mcd_shares_encoder = True  # False if batched MCD re-runs the encoder
         self.caching = False  # Flag used to control Embedding Caching
+        self.embedding_cache = None  # Sentence level embedding store
+        self.embedding_store = None  # Optional on-disk embedding store
+        self.stage_timer = None  # Optional StageTimer used to profile inference
 
         # If not defined here, metrics will not live in the same device as our model.
         self.init_metrics()
 
-    def set_mc_dropout(self, value: int):
+    def set_mc_dropout(self, value: int, batched: bool = False):
         """Sets Monte Carlo Dropout runs per sample.
 
         Args:
             value (int): number of runs per sample.
+            batched (bool): If True, sentence embeddings are computed once and only
+                the layers on top of them are replicated, running all the MCD runs
+                in a single stacked forward pass (see `batched_mc_dropout_step`).
+                Only models that encode through `get_sentence_embedding` benefit from
+                it. Defaults to False.
         """
         self.mc_dropout = value
+        self.mc_dropout_batched = batched
 
     @abc.abstractmethod
     def read_training_data(self) -> List[dict]:
@@ -247,9 +287,85 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
             self.unfreeze_encoder()
             self._frozen = False
 
-    def set_embedding_cache(self):
-        """Function that when called turns embedding caching on."""
+    def time_stage(self, stage: str):
+        """Context manager that records the time spent in an inference stage when a
+        `stage_timer` is set (e.g: by the `InferenceEngine`).
+        """
+        if self.stage_timer is None:
+            return nullcontext()
+        return self.stage_timer(stage)
+
+    def set_embedding_cache(
+        self,
+        store_path: Optional[str] = EMBEDDINGS_STORE,
+        read_only: bool = False,
+        max_store_bytes: Optional[int] = None,
+        checkpoint: Optional[str] = None,
+    ):
+        """Function that when called turns embedding caching on.
+
+        Args:
+            store_path (Optional[str]): Folder of a persistent embedding store shared
+                across processes and runs. Defaults to `COMET_EMBEDDINGS_STORE` env
+                variable (in-memory caching only if not set).
+            read_only (bool): Open the store in read-only mode (e.g: for worker
+                processes). Defaults to False.
+            max_store_bytes (Optional[int]): Size cap of the store. Least recently
+                used embeddings are dropped above it. Defaults to None.
+            checkpoint (Optional[str]): Identifier of the model checkpoint used to
+                key the store. Defaults to a fingerprint of the model weights.
+        """
         self.caching = True
+        if self.embedding_cache is None:
+            self.embedding_cache = SentenceEmbeddingCache(
+                max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES
+            )
+        if store_path is not None:
+            self.embedding_store = DiskEmbeddingStore(
+                store_path,
+                namespace=self.embedding_store_namespace(checkpoint),
+                hidden_size=self.encoder.output_units,
+                max_bytes=max_store_bytes,
+                read_only=read_only,
+            )
+
+    def embedding_store_namespace(self, checkpoint: Optional[str] = None) -> str:
+        """Identifier of the settings that produce the sentence embeddings: model
+        checkpoint, encoder layer and pooling.
+
+        Args:
+            checkpoint (Optional[str]): Checkpoint identifier. If None, a fingerprint
+                of the encoder (and layerwise attention) weights is used.
+
+        Return:
+            str: hexadecimal digest.
+        """
+        if checkpoint is None:
+            modules = [self.encoder]
+            if self.layerwise_attention:
+                modules.append(self.layerwise_attention)
+            checkpoint = repr(
+                torch.stack(
+                    [
+                        tensor.detach().double().sum().cpu()
+                        for module in modules
+                        for tensor in module.state_dict().values()
+                        if tensor.is_floating_point()
+                    ]
+                ).tolist()
+            )
+        config = repr(
+            (
+                checkpoint,
+                self.hparams.encoder_model,
+                self.hparams.pretrained_model,
+                self.hparams.layer,
+                self.hparams.layer_transformation,
+                self.hparams.layer_norm,
+                self.hparams.pool,
+            )
+        )
+        return hashlib.blake2b(config.encode(), digest_size=16).hexdigest()
 
     def get_sentence_embedding(
         self,
@@ -269,32 +385,81 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         Returns:
             torch.Tensor [batch_size x hidden_size] with sentence embeddings.
         """
+        replicas = getattr(_mcd_replicas, "value", 1)
+        if replicas > 1:
+            # Batched MC Dropout: the batch stacks `replicas` copies of the same
+            # samples. Embeddings are computed for the first copy and replicated.
+            size = input_ids.size(0) // replicas
+            input_ids, attention_mask = input_ids[:size], attention_mask[:size]
+            if token_type_ids is not None:
+                token_type_ids = token_type_ids[:size]
+
         if self.caching:
-            return self.retrieve_sentence_embedding(
+            sentemb = self.retrieve_sentence_embedding(
                 input_ids=input_ids,
                 attention_mask=attention_mask,
                 token_type_ids=token_type_ids,
             )
         else:
-            return self.compute_sentence_embedding(
+            sentemb = self.compute_sentence_embedding(
                 input_ids,
                 attention_mask,
                 token_type_ids=token_type_ids,
             )
+        return sentemb.repeat(replicas, 1) if replicas > 1 else sentemb
 
-    @tensor_lru_cache(maxsize=CACHE_SIZE)
     def retrieve_sentence_embedding(
         self,
         input_ids: torch.Tensor,
         attention_mask: torch.Tensor,
         token_type_ids: Optional[torch.Tensor] = None,
     ) -> torch.Tensor:
-        """Wrapper for `get_sentence_embedding` function that caches results."""
-        return self.compute_sentence_embedding(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            token_type_ids=token_type_ids,
-        )
+        """Wrapper for `get_sentence_embedding` function that caches results.
+
+        Embeddings are cached per sentence (keyed by the unpadded token ids). Cached
+        rows are gathered from the cache (and from the on-disk store if enabled), the
+        encoder runs only on the missing rows and the results are scattered back
+        into batch order.
+        """
+        if self.embedding_cache is None:
+            self.set_embedding_cache()
+
+        keys = sentence_keys(input_ids, attention_mask, token_type_ids)
+        cached = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+
+        digests = None
+        if missing and self.embedding_store is not None:
+            digests = {i: sentence_digest(keys[i]) for i in missing}
+            stored = self.embedding_store.get([digests[i] for i in missing])
+            for i, embedding in zip(missing, stored):
+                if embedding is not None:
+                    cached[i] = embedding.to(device=input_ids.device, dtype=self.dtype)
+                    self.embedding_cache.put(keys[i], cached[i])
+            missing = [i for i in missing if cached[i] is None]
+
+        if missing:
+            index = torch.tensor(missing, device=input_ids.device)
+            mask = attention_mask.index_select(0, index)
+            # Drop the columns that are padding for all the missing rows.
+            seq_len = int(mask.any(dim=0).nonzero().max()) + 1
+            computed = self.compute_sentence_embedding(
+                input_ids=input_ids.index_select(0, index)[:, :seq_len],
+                attention_mask=mask[:, :seq_len],
+                token_type_ids=token_type_ids.index_select(0, index)[:, :seq_len]
+                if token_type_ids is not None
+                else None,
+            )
+            for i, embedding in zip(missing, computed):
+                cached[i] = embedding
+                self.embedding_cache.put(keys[i], embedding)
+            if digests is not None:
+                self.embedding_store.put([digests[i] for i in missing], computed)
+
+            if len(missing) == len(keys):
+                return computed
+
+        return torch.stack([embedding.to(input_ids.device) for embedding in cached])
 
     def compute_sentence_embedding(
         self,
@@ -314,41 +479,47 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         Returns:
             torch.Tensor [batch_size x hidden_size] with sentence embeddings.
         """
-        encoder_out = self.encoder(
-            input_ids, attention_mask, token_type_ids=token_type_ids
-        )
-        if self.layerwise_attention:
-            embeddings = self.layerwise_attention(
-                encoder_out["all_layers"], attention_mask
+        with self.time_stage("encoding"):
+            encoder_out = self.encoder(
+                input_ids, attention_mask, token_type_ids=token_type_ids
             )
 
-        elif self.hparams.layer >= 0 and self.hparams.layer < self.encoder.num_layers:
-            embeddings = encoder_out["all_layers"][self.hparams.layer]
+        with self.time_stage("pooling"):
+            if self.layerwise_attention:
+                embeddings = self.layerwise_attention(
+                    encoder_out["all_layers"], attention_mask
+                )
 
-        else:
-            raise Exception("Invalid model layer {}.".format(self.hparams.layer))
+            elif (
+                self.hparams.layer >= 0
+                and self.hparams.layer < self.encoder.num_layers
+            ):
+                embeddings = encoder_out["all_layers"][self.hparams.layer]
 
-        if self.hparams.pool == "default":
-            sentemb = encoder_out["sentemb"]
+            else:
+                raise Exception("Invalid model layer {}.".format(self.hparams.layer))
 
-        elif self.hparams.pool == "max":
-            sentemb = max_pooling(
-                input_ids, embeddings, self.encoder.tokenizer.pad_token_id
-            )
+            if self.hparams.pool == "default":
+                sentemb = encoder_out["sentemb"]
 
-        elif self.hparams.pool == "avg":
-            sentemb = average_pooling(
-                input_ids,
-                embeddings,
-                attention_mask,
-                self.encoder.tokenizer.pad_token_id,
-            )
+            elif self.hparams.pool == "max":
+                sentemb = masked_max_pooling(
+                    input_ids, embeddings, self.encoder.tokenizer.pad_token_id
+                )
 
-        elif self.hparams.pool == "cls":
-            sentemb = embeddings[:, 0, :]
+            elif self.hparams.pool == "avg":
+                sentemb = masked_average_pooling(
+                    input_ids,
+                    embeddings,
+                    attention_mask,
+                    self.encoder.tokenizer.pad_token_id,
+                )
 
-        else:
-            raise Exception("Invalid pooling technique.")
+            elif self.hparams.pool == "cls":
+                sentemb = embeddings[:, 0, :]
+
+            else:
+                raise Exception("Invalid pooling technique.")
 
         return sentemb
 
@@ -435,6 +606,14 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         Return:
             Predicion object
         """
+        if (
+            self.mc_dropout
+            and self.mc_dropout_batched
+            and self._mcd_shares_encoder
+            and all(torch.is_tensor(v) for v in batch.values())
+        ):
+            return self.batched_mc_dropout_step(batch)
+
         model_outputs = Prediction(scores=self(**batch).score)
         if self.mc_dropout:
             mcd_outputs = torch.stack(
@@ -446,6 +625,53 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
             )
         return model_outputs
 
+    def batched_mc_dropout_step(self, batch: Dict[str, torch.Tensor]) -> Prediction:
+        """Monte Carlo Dropout with a single encoder pass. The batch is stacked
+        `mc_dropout + 1` times, sentence embeddings are computed once (see
+        `get_sentence_embedding`) and the layers on top of them run over all copies
+        in one forward pass, each copy with its own dropout mask. Dropout inside the
+        encoder is sampled once and shared by all the runs.
+
+        Models that override `get_sentence_embedding` (without calling it) or call
+        the encoder directly run the encoder over the whole stacked batch, which is
+        slower than the sequential runs. This is detected on the first batch: its
+        results are still valid, but a warning is logged and the following batches
+        of the model use the sequential runs.
+
+        Args:
+            batch (Dict[str, torch.Tensor]): The output of your `prepare_sample` method.
+
+        Return:
+            Predicion object with `mcd_scores` and `mcd_std` metadata.
+        """
+        replicas = self.mc_dropout + 1
+        stacked_batch = {
+            k: v.repeat(replicas, *[1] * (v.dim() - 1)) for k, v in batch.items()
+        }
+        _mcd_replicas.value = replicas
+        _mcd_replicas.rows = replicas * len(next(iter(batch.values())))
+        _mcd_replicas.stacked_encoder_pass = False
+        try:
+            scores = self(**stacked_batch).score.view(replicas, -1)
+        finally:
+            _mcd_replicas.value, _mcd_replicas.rows = 1, 0
+
+        if _mcd_replicas.stacked_encoder_pass:
+            logger.warning(
+                "{} does not encode through `get_sentence_embedding` so batched MC "
+                "Dropout replicates the encoder pass. Falling back to sequential MC "
+                "Dropout runs.".format(type(self).__name__)
+            )
+            self._mcd_shares_encoder = False
+
+        mcd_outputs = scores[1:]
+        model_outputs = Prediction(scores=scores[0])
+        model_outputs["metadata"] = Prediction(
+            mcd_scores=mcd_outputs.mean(dim=0),
+            mcd_std=mcd_outputs.std(dim=0),
+        )
+        return model_outputs
+
     def on_validation_epoch_end(self, *args, **kwargs) -> None:
         """Computes and logs metrics."""
         self.log_dict(self.train_metrics.compute(), prog_bar=False)
@@ -535,6 +761,33 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         """
         return self.prepare_sample(sample, stage="predict")
 
+    def prepare_batch_for_inference(self, batch):
+        """Collate function used when the dataset is already split into batches
+        (e.g: with token-budget batching). Receives a list with a single batch.
+        """
+        return self.prepare_sample(batch[0], stage="predict")
+
+    def token_lengths(self, samples: List[Dict[str, str]]) -> List[int]:
+        """Number of tokens of each sample summed over its input segments.
+
+        Args:
+            samples (List[Dict[str, str]]): List with dictionaries with source,
+                translations and/or references.
+
+        Return:
+            List[int]: tokenized length of each sample.
+        """
+        lengths = np.zeros(len(samples), dtype=np.int64)
+        for segment in ("src", "mt", "ref"):
+            if segment in samples[0]:
+                input_ids = self.encoder.tokenizer(
+                    [str(sample[segment]) for sample in samples],
+                    truncation=True,
+                    max_length=self.encoder.max_positions - 2,
+                )["input_ids"]
+                lengths += np.array([len(ids) for ids in input_ids], dtype=np.int64)
+        return lengths.tolist()
+
     def predict(
         self,
         samples: List[Dict[str, str]],
@@ -542,10 +795,13 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         gpus: int = 1,
         devices: Union[List[int], str, int] = None,
         mc_dropout: int = 0,
+        mc_dropout_batched: bool = False,
         progress_bar: bool = True,
         accelerator: str = "auto",
         num_workers: int = None,
         length_batching: bool = True,
+        max_tokens: Optional[int] = None,
+        return_numpy: bool = False,
     ) -> Prediction:
         """Method that receives a list of samples (dictionaries with translations,
         sources and/or references) and returns segment-level scores, system level score
@@ -559,6 +815,10 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
             devices (Optional[List[int]]): A sequence of device indices to be used.
                 Default: None.
             mc_dropout (int): Number of inference steps to run using MCD. Defaults to 0
+            mc_dropout_batched (bool): Compute sentence embeddings once and run all MCD
+                steps in a single stacked forward pass. Only applies to models that
+                encode through `get_sentence_embedding`, others fall back to the
+                sequential MCD steps. Defaults to False.
             progress_bar (bool): Flag that turns on and off the predict progress bar.
                 Defaults to True
             accelarator (str): Pytorch Lightning accelerator (e.g: 'cpu', 'cuda', 'hpu'
@@ -567,13 +827,18 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
                 data. Defaults to None
             length_batching (bool): If set to true, reduces padding by sorting samples
                 by sequence length. Defaults to True.
+            max_tokens (Optional[int]): If set, samples are sorted by tokenized length
+                and packed into batches with at most `max_tokens` padded tokens
+                (`batch_size` is ignored). Works with multiple GPUs. Defaults to None.
+            return_numpy (bool): Return scores and metadata as NumPy arrays instead of
+                Python lists. Defaults to False.
 
         Return:
             Prediction object with `scores`, `system_score` and any metadata returned
                 by the model.
         """
         if mc_dropout > 0:
-            self.set_mc_dropout(mc_dropout)
+            self.set_mc_dropout(mc_dropout, batched=mc_dropout_batched)
 
         if gpus > 0 and devices is not None:
             assert len(devices) == gpus, AssertionError(
@@ -584,28 +849,42 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
         else: # gpu = 0
             devices = "auto"
 
-        sampler = SequentialSampler(samples)
-        if length_batching and gpus < 2:
-            try:
-                sort_ids = np.argsort([len(sample["src"]) for sample in samples])
-            except KeyError:
-                sort_ids = np.argsort([len(sample["ref"]) for sample in samples])
-            sampler = OrderedSampler(sort_ids)
-
         if num_workers is None:
             # Guideline for workers that typically works well.
             num_workers = 2 * gpus
 
         self.eval()
-        dataloader = DataLoader(
-            dataset=samples,
-            batch_size=batch_size,
-            sampler=sampler,
-            collate_fn=self.prepare_for_inference,
-            num_workers=num_workers,
-        )
+        batches = None
+        if max_tokens is not None:
+            # Each dataset item is a whole batch. Lightning reports batch positions
+            # as indices which are mapped back to samples through `batches`.
+            batches = token_budget_batches(self.token_lengths(samples), max_tokens)
+            sort_ids = [i for batch in batches for i in batch]
+            dataloader = DataLoader(
+                dataset=[[samples[i] for i in batch] for batch in batches],
+                batch_size=1,
+                sampler=SequentialSampler(batches),
+                collate_fn=self.prepare_batch_for_inference,
+                num_workers=num_workers,
+            )
+        else:
+            sampler = SequentialSampler(samples)
+            if length_batching and gpus < 2:
+                try:
+                    sort_ids = np.argsort([len(sample["src"]) for sample in samples])
+                except KeyError:
+                    sort_ids = np.argsort([len(sample["ref"]) for sample in samples])
+                sampler = OrderedSampler(sort_ids)
+
+            dataloader = DataLoader(
+                dataset=samples,
+                batch_size=batch_size,
+                sampler=sampler,
+                collate_fn=self.prepare_for_inference,
+                num_workers=num_workers,
+            )
         if gpus > 1:
-            pred_writer = CustomWriter()
+            pred_writer = CustomWriter(batch_ids=batches, num_samples=len(samples))
             callbacks = [
                 pred_writer,
             ]
@@ -640,7 +919,7 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
 
         # If we are in the GLOBAL RANK we need to gather all predictions
         if gpus > 1 and trainer.is_global_zero:
-            predictions = pred_writer.gather_all_predictions()
+            predictions = pred_writer.gather_all_predictions(return_numpy)
             # Delete Temp folder.
             pred_writer.cleanup()
             return predictions
@@ -649,25 +928,7 @@ class CometModel(ptl.LightningModule, metaclass=abc.ABCMeta):
             # If we are not in the GLOBAL RANK we will return None
             exit()
 
-        scores = torch.cat([pred.scores for pred in predictions], dim=0).tolist()
-        if "metadata" in predictions[0]:
-            metadata = flatten_metadata([pred.metadata for pred in predictions])
-        else:
-            metadata = []
-
-        output = Prediction(scores=scores, system_score=sum(scores) / len(scores))
-
         # Restore order of samples!
-        if length_batching and gpus < 2:
-            output["scores"] = restore_list_order(scores, sort_ids)
-            if metadata:
-                output["metadata"] = Prediction(
-                    **{k: restore_list_order(v, sort_ids) for k, v in metadata.items()}
-                )
-            return output
-        else:
-            # Add metadata to output
-            if metadata:
-                output["metadata"] = metadata
-
-            return output
+        if max_tokens is None and not (length_batching and gpus < 2):
+            sort_ids = None
+        return gather_predictions(predictions, sort_ids, return_numpy)
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Unbabel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""
+Embedding Cache
+===============
+    Sentence level embedding cache. Instead of caching the embeddings of a whole
+    batch, each sentence is keyed by its unpadded token ids. Batches that share
+    sentences with previous batches only run the encoder for the missing rows.
+
+    Optionally, embeddings can also be persisted in a memory-mapped store on disk
+    that is shared across processes and runs.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from threading import RLock
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .lru_cache import TensorKey, tensor_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not guarded across processes.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "entries", "nbytes", "max_bytes"])
+
+_SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "k": 1024,
+    "kb": 1024,
+    "kib": 1024,
+    "m": 1024**2,
+    "mb": 1024**2,
+    "mib": 1024**2,
+    "g": 1024**3,
+    "gb": 1024**3,
+    "gib": 1024**3,
+}
+
+
+def parse_cache_size(value: Union[str, int]) -> Tuple[Optional[int], Optional[int]]:
+    """Parses the value of `COMET_EMBEDDINGS_CACHE`.
+
+    A plain integer is interpreted as the maximum number of cached sentences (the
+    legacy behaviour). A value with a size unit (e.g: '512MB', '2GiB', '1000000B')
+    is interpreted as a memory budget in bytes.
+
+    Args:
+        value (Union[str, int]): Environment variable value.
+
+    Return:
+        Tuple[Optional[int], Optional[int]]: max number of entries and max bytes.
+    """
+    if isinstance(value, int):
+        return value, None
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*", value)
+    if match is None or match.group(2).lower() not in _SIZE_UNITS:
+        raise ValueError("Invalid COMET_EMBEDDINGS_CACHE value: {}".format(value))
+
+    number, unit = match.groups()
+    if not unit:
+        return int(float(number)), None
+    return None, int(float(number) * _SIZE_UNITS[unit.lower()])
+
+
+def sentence_keys(
+    input_ids: torch.Tensor,
+    attention_mask: torch.Tensor,
+    token_type_ids: Optional[torch.Tensor] = None,
+) -> List[TensorKey]:
+    """Builds one cache key per sentence using its unpadded token ids.
+
+    Args:
+        input_ids (torch.Tensor): sequences [batch_size x seq_len].
+        attention_mask (torch.Tensor): attention_mask [batch_size x seq_len].
+        token_type_ids (torch.Tensor): Model token_type_ids [batch_size x seq_len].
+            Optional
+
+    Return:
+        List[TensorKey]: list with batch_size keys.
+    """
+    mask = attention_mask.bool().cpu()
+    input_ids = input_ids.cpu()
+    if token_type_ids is None:
+        return [TensorKey(ids[m]) for ids, m in zip(input_ids, mask)]
+
+    # token type ids are appended to the key to distinguish segment layouts.
+    token_type_ids = token_type_ids.cpu()
+    return [
+        TensorKey(torch.cat([ids[m], types[m]]))
+        for ids, types, m in zip(input_ids, token_type_ids, mask)
+    ]
+
+
+class SentenceEmbeddingCache:
+    """LRU store of sentence embeddings bounded by number of entries and/or memory.
+
+    Args:
+        max_entries (Optional[int]): Maximum number of sentences kept. Defaults to
+            None (no limit).
+        max_bytes (Optional[int]): Maximum memory (in bytes) used by the cached
+            embeddings. Defaults to None (no limit).
+    """
+
+    def __init__(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self._store = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, key: TensorKey) -> bool:
+        return key in self._store
+
+    def get(self, key: TensorKey) -> Optional[torch.Tensor]:
+        """Returns the cached embedding (marking it as recently used) or None."""
+        with self._lock:
+            embedding = self._store.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._store.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key: TensorKey, embedding: torch.Tensor) -> None:
+        """Stores an embedding and evicts least recently used entries if needed.
+
+        The embedding is copied so that a row of a batch does not keep the storage of
+        the whole batch alive (which would make `nbytes` under-count the memory used).
+        """
+        size = embedding.element_size() * embedding.nelement()
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        embedding = embedding.detach().clone(memory_format=torch.contiguous_format)
+
+        with self._lock:
+            old = self._store.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.element_size() * old.nelement()
+            self._store[key] = embedding
+            self.nbytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._store and (
+            (self.max_entries is not None and len(self._store) > self.max_entries)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, old = self._store.popitem(last=False)
+            self.nbytes -= old.element_size() * old.nelement()
+
+    def cache_info(self) -> CacheInfo:
+        """Report cache statistics"""
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, len(self._store), self.nbytes, self.max_bytes
+            )
+
+    def cache_clear(self) -> None:
+        """Clear the cache and cache statistics"""
+        with self._lock:
+            self._store.clear()
+            self.nbytes = 0
+            self.hits = self.misses = 0
+
+
+def sentence_digest(key: TensorKey) -> bytes:
+    """16 bytes digest of the sentence token ids used to index the on-disk store."""
+    return hashlib.blake2b(tensor_bytes(key.tensor), digest_size=16).digest()
+
+
+class DiskEmbeddingStore:
+    """Persistent, memory-mapped and append-only store of sentence embeddings.
+
+    Embeddings are kept in a single file of fixed size records (16 bytes sentence
+    digest followed by the float32 embedding) inside `path/namespace`, where the
+    namespace identifies the model checkpoint, layer and pooling settings. Several
+    processes (e.g: DDP ranks or consecutive scoring jobs) can share the same store.
+    Appends are serialized with a file lock and readers pick up new records lazily.
+
+    When the store grows above `max_bytes`, the least recently used records are
+    dropped by rewriting the store (compaction).
+
+    Args:
+        path (str): Root folder of the store.
+        namespace (str): Identifier of the model/layer/pooling configuration.
+        hidden_size (int): Embedding size.
+        max_bytes (Optional[int]): Size cap of the store. Defaults to None (no cap).
+        read_only (bool): If True the store is never modified. Use it for worker
+            processes that only consume embeddings. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        hidden_size: int,
+        max_bytes: Optional[int] = None,
+        read_only: bool = False,
+    ) -> None:
+        self.folder = os.path.join(path, namespace)
+        self.hidden_size = hidden_size
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.record = np.dtype([("key", "V16"), ("embedding", "<f4", (hidden_size,))])
+        self.data_file = os.path.join(self.folder, "embeddings.bin")
+        self.atime_file = os.path.join(self.folder, "atime.bin")
+        self.lock_file = os.path.join(self.folder, "lock")
+        if not read_only:
+            os.makedirs(self.folder, exist_ok=True)
+
+        self._index = {}
+        self._records = None
+        self._stat = None
+        self._lock = RLock()
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive inter-process lock used for appends and compaction."""
+        with open(self.lock_file, "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """(Re)maps the store file after appends or compactions by other processes."""
+        try:
+            stat = os.stat(self.data_file)
+        except FileNotFoundError:
+            self._index, self._records, self._stat = {}, None, None
+            return
+
+        n_records = stat.st_size // self.record.itemsize
+        if self._stat is not None and self._stat == (stat.st_ino, n_records):
+            return
+
+        start = 0
+        if self._stat is not None and self._stat[0] == stat.st_ino:
+            start = self._stat[1]  # Same file, only index the appended records.
+        else:
+            self._index = {}
+
+        if n_records == 0:
+            self._records = None
+        else:
+            self._records = np.memmap(
+                self.data_file, dtype=self.record, mode="r", shape=(n_records,)
+            )
+            for row, key in enumerate(self._records["key"][start:], start=start):
+                self._index[key.tobytes()] = row
+        self._stat = (stat.st_ino, n_records)
+
+    def _touch(self, rows: List[int]) -> None:
+        """Updates the last access time of the given records (used for LRU).
+
+        The rows come from this process' index. If another process compacted the
+        store since it was mapped, they no longer match the files on disk and the
+        update is skipped.
+        """
+        if self.read_only or not rows or self._stat is None:
+            return
+        with self._file_lock():
+            try:
+                if os.stat(self.data_file).st_ino != self._stat[0]:
+                    return
+                n_times = os.path.getsize(self.atime_file) // 8
+            except FileNotFoundError:
+                return
+            rows = [row for row in rows if row < n_times]
+            if rows:
+                atime = np.memmap(
+                    self.atime_file, dtype="<f8", mode="r+", shape=(n_times,)
+                )
+                atime[rows] = time.time()
+                atime.flush()
+
+    def get(self, digests: List[bytes]) -> List[Optional[torch.Tensor]]:
+        """Looks up a list of sentence digests.
+
+        Return:
+            List[Optional[torch.Tensor]]: float32 embeddings (None for misses).
+        """
+        with self._lock:
+            if any(digest not in self._index for digest in digests):
+                self._refresh()
+            rows = [self._index.get(digest) for digest in digests]
+            found = [row for row in rows if row is not None]
+            if not found:
+                return [None] * len(digests)
+            embeddings = torch.from_numpy(np.array(self._records["embedding"][found]))
+            self._touch(found)
+
+        embeddings = iter(embeddings)
+        return [next(embeddings) if row is not None else None for row in rows]
+
+    def put(self, digests: List[bytes], embeddings: torch.Tensor) -> None:
+        """Appends new embeddings [len(digests) x hidden_size] to the store."""
+        if self.read_only or not digests:
+            return
+
+        embeddings = embeddings.detach().float().cpu().numpy()
+        with self._lock, self._file_lock():
+            self._refresh()
+            new = {}
+            for digest, embedding in zip(digests, embeddings):
+                if digest not in self._index:
+                    new[digest] = embedding
+            if not new:
+                return
+
+            records = np.empty(len(new), dtype=self.record)
+            records["key"] = [np.void(digest) for digest in new]
+            records["embedding"] = np.stack(list(new.values()))
+            # Embeddings are written before access times so that readers never
+            # index a record that is not fully available.
+            with open(self.data_file, "ab") as fh:
+                fh.write(records.tobytes())
+            with open(self.atime_file, "ab") as fh:
+                fh.write(np.full(len(new), time.time(), dtype="<f8").tobytes())
+            self._refresh()
+
+            if self.max_bytes is not None and self.nbytes > self.max_bytes:
+                self._compact()
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the store in bytes."""
+        return 0 if self._stat is None else self._stat[1] * self.record.itemsize
+
+    def compact(self) -> None:
+        """Drops least recently used records until the store fits in `max_bytes`."""
+        if self.read_only:
+            raise Exception("Cannot compact a read-only embedding store.")
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._compact()
+
+    def _compact(self) -> None:
+        if self._records is None:
+            return
+        n_records = len(self._records)
+        # Compact to 75% of the cap to avoid rewriting the store on every append.
+        target = n_records
+        if self.max_bytes is not None:
+            target = min(n_records, int(0.75 * self.max_bytes) // self.record.itemsize)
+
+        atime = np.zeros(n_records, dtype="<f8")
+        if os.path.exists(self.atime_file):
+            stored = np.fromfile(self.atime_file, dtype="<f8")[:n_records]
+            atime[: len(stored)] = stored
+
+        # Duplicated keys (appended concurrently) only keep their indexed copy.
+        indexed = np.zeros(n_records, dtype=bool)
+        indexed[list(self._index.values())] = True
+        atime[~indexed] = -np.inf
+        keep = np.argsort(-atime, kind="stable")[:target]
+        keep = np.sort(keep[indexed[keep]])
+
+        for filename, data in (
+            (self.data_file, self._records[keep]),
+            (self.atime_file, atime[keep]),
+        ):
+            tmp_file = filename + ".tmp"
+            data.tofile(tmp_file)
+            os.replace(tmp_file, filename)
+
+        logger.info(
+            "Compacted embedding store {}: {} -> {} records.".format(
+                self.folder, n_records, len(keep)
+            )
+        )
+        self._stat = None
+        self._refresh()
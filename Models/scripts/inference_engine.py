@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Unbabel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""
+Inference Engine
+================
+    Lightweight in-process inference for CometModel. The model stays resident and
+    batches are scored directly by a pool of worker threads, skipping the Lightning
+    Trainer, DataLoader and callbacks setup done by `CometModel.predict`. Intended
+    for CPU servers scoring many small requests.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from pytorch_lightning.utilities import move_data_to_device
+
+from .base import CometModel
+from .utils import Prediction, gather_predictions, token_budget_batches
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Accumulates the time spent in each inference stage across worker threads."""
+
+    def __init__(self) -> None:
+        self.timings = defaultdict(float)
+        self._lock = Lock()
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[stage] += elapsed
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timings.clear()
+
+
+class InferenceEngine:
+    """Runs CometModel inference without a Lightning Trainer.
+
+    Length sorted batches are sharded across a pool of worker threads. PyTorch
+    releases the GIL inside its kernels, so the workers run their forward passes
+    concurrently.
+
+    The number of intra-op threads is a process-wide PyTorch setting
+    (`torch.set_num_threads`), not a per-worker one: while the engine is open it
+    applies to all the workers and to any other thread of the process. `close()`
+    restores the previous value.
+
+    Args:
+        model (CometModel): COMET model. It is kept resident in evaluation mode.
+        num_workers (int): Number of worker threads. Defaults to 1.
+        intra_op_threads (Optional[int]): Process-wide number of PyTorch intra-op
+            threads while the engine is open. Defaults to the number of CPUs divided
+            by `num_workers`.
+    """
+
+    def __init__(
+        self,
+        model: CometModel,
+        num_workers: int = 1,
+        intra_op_threads: Optional[int] = None,
+    ) -> None:
+        self.model = model.eval()
+        self.num_workers = max(1, num_workers)
+        if intra_op_threads is None:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        # Process-wide settings changed by the engine, restored by `close`.
+        self._num_threads = torch.get_num_threads()
+        self._stage_timer = self.model.stage_timer
+        torch.set_num_threads(intra_op_threads)
+
+        self.timer = StageTimer()
+        self.model.stage_timer = self.timer
+        self.pool = (
+            ThreadPoolExecutor(max_workers=self.num_workers)
+            if self.num_workers > 1
+            else None
+        )
+        self.timings = {}
+
+    def _predict_batch(self, samples: List[Dict[str, str]]) -> Prediction:
+        with self.timer("tokenization"):
+            batch = self.model.prepare_sample(samples, stage="predict")
+            batch = move_data_to_device(batch, self.model.device)
+
+        with self.timer("forward"), torch.inference_mode():
+            return self.model.predict_step(batch)
+
+    def predict(
+        self,
+        samples: List[Dict[str, str]],
+        batch_size: int = 16,
+        mc_dropout: int = 0,
+        mc_dropout_batched: bool = False,
+        length_batching: bool = True,
+        max_tokens: Optional[int] = None,
+        return_numpy: bool = False,
+    ) -> Prediction:
+        """Scores a list of samples. Same interface and output as
+        `CometModel.predict`.
+
+        Args:
+            samples (List[Dict[str, str]]): List with dictionaries with source,
+                translations and/or references.
+            batch_size (int): Batch size used during inference. Defaults to 16
+            mc_dropout (int): Number of inference steps to run using MCD. Defaults to 0
+            mc_dropout_batched (bool): Run all MCD steps in a single stacked forward
+                pass over shared sentence embeddings. Only applies to models that
+                encode through `get_sentence_embedding` (see
+                `CometModel.batched_mc_dropout_step`). Defaults to False.
+            length_batching (bool): If set to true, reduces padding by sorting samples
+                by sequence length. Defaults to True.
+            max_tokens (Optional[int]): If set, batches are packed by number of
+                padded tokens instead of `batch_size`. Defaults to None.
+            return_numpy (bool): Return NumPy arrays instead of Python lists. Defaults
+                to False.
+
+        Return:
+            Prediction object with `scores`, `system_score` and any metadata returned
+                by the model. Per-stage timings (in seconds, summed over workers) of
+                the call are stored in `self.timings`.
+        """
+        start = time.perf_counter()
+        self.timer.reset()
+        if mc_dropout > 0:
+            self.model.set_mc_dropout(mc_dropout, batched=mc_dropout_batched)
+        self.model.on_predict_start()
+
+        if max_tokens is not None:
+            with self.timer("tokenization"):
+                lengths = self.model.token_lengths(samples)
+            batches = token_budget_batches(lengths, max_tokens)
+        else:
+            if length_batching:
+                field = "src" if "src" in samples[0] else "ref"
+                sort_ids = np.argsort([len(sample[field]) for sample in samples])
+            else:
+                sort_ids = np.arange(len(samples))
+            batches = [
+                sort_ids[i : i + batch_size].tolist()
+                for i in range(0, len(samples), batch_size)
+            ]
+
+        batch_samples = [[samples[i] for i in batch] for batch in batches]
+        if self.pool is not None:
+            predictions = list(self.pool.map(self._predict_batch, batch_samples))
+        else:
+            predictions = [self._predict_batch(batch) for batch in batch_samples]
+
+        output = gather_predictions(
+            predictions, [i for b in batches for i in b], return_numpy
+        )
+
+        timings = dict(self.timer.timings)
+        forward = timings.pop("forward", 0.0)
+        timings["estimation"] = max(
+            0.0, forward - timings.get("encoding", 0.0) - timings.get("pooling", 0.0)
+        )
+        timings["total"] = time.perf_counter() - start
+        self.timings = timings
+        logger.debug("Inference timings: {}".format(timings))
+        return output
+
+    def close(self) -> None:
+        """Shuts down the worker pool, restores the model timer and the number of
+        PyTorch intra-op threads that were set before the engine was created.
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self._num_threads is not None:
+            self.model.stage_timer = self._stage_timer
+            torch.set_num_threads(self._num_threads)
+            self._num_threads = None
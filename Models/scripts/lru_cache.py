@@ -20,12 +20,76 @@ LRU Cache function decorator modified to work with tensor arguments.
 Original implementation: https://github.com/python/cpython/blob/3.10/Lib/functools.py
 Our modification modifies the _make_key function to use tensor str representation
 intead of the object reference. Other than that we use the original implementation
+
+`TensorKey` wraps a tensor into a key hashed from its raw bytes (together with dtype
+and shape) for caches that need exact, content-based tensor lookups.
 """
 from _thread import RLock
 from functools import _CacheInfo, _HashedSeq, update_wrapper
 
 import torch
 
+try:
+    import xxhash
+
+    def _hash_bytes(buffer) -> int:
+        return xxhash.xxh3_64_intdigest(buffer)
+
+except ImportError:
+
+    def _hash_bytes(buffer) -> int:
+        return hash(bytes(buffer))
+
+
+def tensor_bytes(x: torch.Tensor) -> memoryview:
+    """Returns a view over the raw bytes of a tensor (copied to CPU if needed).
+
+    Args:
+        x (torch.Tensor): Tensor of any dtype and shape.
+
+    Return:
+        memoryview: Raw contiguous storage of the tensor.
+    """
+    x = x.detach().cpu().contiguous().reshape(-1)
+    if x.dtype != torch.uint8:
+        x = x.view(torch.uint8)
+    return memoryview(x.numpy())
+
+
+class TensorKey:
+    """Hashable wrapper around a tensor used as cache key.
+
+    The hash is computed from the tensor dtype, shape and raw bytes. Equality falls
+    back to an exact element-wise comparison so that colliding hashes never produce
+    a cache hit for a different tensor.
+
+    Args:
+        x (torch.Tensor): Tensor to wrap.
+    """
+
+    __slots__ = ("tensor", "hashvalue")
+
+    def __init__(self, x: torch.Tensor) -> None:
+        self.tensor = x.detach()
+        self.hashvalue = hash(
+            (str(x.dtype), tuple(x.shape), _hash_bytes(tensor_bytes(x)))
+        )
+
+    def __hash__(self) -> int:
+        return self.hashvalue
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, TensorKey) or self.hashvalue != other.hashvalue:
+            return False
+        a, b = self.tensor, other.tensor
+        if a.dtype != b.dtype or a.shape != b.shape:
+            return False
+        if a.device != b.device:
+            b = b.to(a.device)
+        return torch.equal(a, b)
+
 
 def _make_key(
     args,
@@ -19,6 +19,7 @@ Metrics
     Regression and Ranking metrics to be used during training to measure
     correlations with human judgements
 """
+from functools import partial
 from itertools import combinations
 from typing import Any, Callable, List, Optional
 
@@ -66,6 +67,90 @@ def system_accuracy(y_hat: List[float], y: List[float], system: List[str]) -> fl
     return float(accuracy)
 
 
+def pearson_corrcoef(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Pearson correlation between two 1D tensors (computed in float64)."""
+    x, y = x.double(), y.double()
+    x, y = x - x.mean(), y - y.mean()
+    return (x * y).sum() / torch.sqrt((x * x).sum() * (y * y).sum())
+
+
+def average_ranks(x: torch.Tensor) -> torch.Tensor:
+    """Ranks (starting at 1) of a 1D tensor where ties get their average rank."""
+    sorted_x, order = torch.sort(x)
+    _, inverse, counts = torch.unique_consecutive(
+        sorted_x, return_inverse=True, return_counts=True
+    )
+    ends = counts.cumsum(0).double()
+    ranks = torch.empty(x.numel(), dtype=torch.float64, device=x.device)
+    ranks[order] = ((ends - counts + 1 + ends) / 2)[inverse]
+    return ranks
+
+
+def spearman_corrcoef(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Spearman correlation between two 1D tensors."""
+    return pearson_corrcoef(average_ranks(x), average_ranks(y))
+
+
+def count_inversions(y: torch.Tensor) -> int:
+    """Number of pairs i < j with y[i] > y[j], counted with a bottom-up merge sort
+    where every level merges all blocks at once with `searchsorted`.
+    """
+    n = y.numel()
+    size = 1 << max(n - 1, 0).bit_length()
+    # Padding (at the end and larger than any value) adds no inversions.
+    blocks = torch.full((size,), int(y.max()) + 1, dtype=y.dtype, device=y.device)
+    blocks[:n] = y
+    blocks = blocks.view(-1, 1)
+
+    inversions, width = 0, 1
+    while blocks.size(0) > 1:
+        pairs = blocks.view(-1, 2, width)
+        left, right = pairs[:, 0].contiguous(), pairs[:, 1].contiguous()
+        # Elements of the left block greater than each element of the right block.
+        right_pos = torch.searchsorted(left, right, right=True)
+        inversions += int((width - right_pos).sum())
+        # Stable merge: scatter each element into its position in the merged block.
+        offsets = torch.arange(width, device=y.device).expand_as(left)
+        left_pos = torch.searchsorted(right, left, right=False)
+        blocks = torch.empty_like(pairs.view(-1, 2 * width))
+        blocks.scatter_(1, offsets + left_pos, left)
+        blocks.scatter_(1, offsets + right_pos, right)
+        width *= 2
+    return inversions
+
+
+def _tied_pairs(ranks: torch.Tensor) -> int:
+    """Number of pairs of tied elements given dense ranks."""
+    counts = torch.bincount(ranks)
+    return int((counts * (counts - 1) // 2).sum())
+
+
+def kendall_tau(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Kendall tau-b between two 1D tensors (same as `scipy.stats.kendalltau`)
+    computed in O(n log n) with Knight's algorithm.
+    """
+    n = x.numel()
+    x = torch.unique(x, return_inverse=True)[1]
+    y = torch.unique(y, return_inverse=True)[1]
+    # Sort by x breaking ties by y.
+    order = torch.argsort(x * (int(y.max()) + 1) + y)
+    x, y = x[order], y[order]
+
+    discordant = count_inversions(y)
+    boundaries = torch.ones(n + 1, dtype=torch.bool, device=x.device)
+    boundaries[1:-1] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+    counts = torch.diff(torch.nonzero(boundaries).flatten())
+    joint_ties = int((counts * (counts - 1) // 2).sum())
+    x_ties, y_ties = _tied_pairs(x), _tied_pairs(y)
+
+    total = n * (n - 1) // 2
+    concordant_minus_discordant = total - x_ties - y_ties + joint_ties - 2 * discordant
+    denominator = (total - x_ties) ** 0.5 * (total - y_ties) ** 0.5
+    if denominator == 0:  # constant input
+        return torch.tensor(float("nan"), dtype=torch.float64)
+    return torch.tensor(concordant_minus_discordant / denominator, dtype=torch.float64)
+
+
 class MCCMetric(MulticlassMatthewsCorrCoef):
     def __init__(self, prefix: str = "", **kwargs) -> None:
         super().__init__(**kwargs)
@@ -78,6 +163,15 @@ class MCCMetric(MulticlassMatthewsCorrCoef):
 
 
 class RegressionMetrics(Metric):
+    """Kendall, Spearman and Pearson correlations (and system accuracy).
+
+    Args:
+        prefix (str): Prefix of the reported metrics.
+        backend (str): 'scipy' computes correlations with SciPy. 'torch' computes
+            them on tensors (Kendall in O(n log n)) without converting the
+            predictions into Python lists. Defaults to 'scipy'.
+    """
+
     is_differentiable = False
     higher_is_better = True
     full_state_update = False
@@ -90,6 +184,7 @@ class RegressionMetrics(Metric):
         dist_sync_on_step: bool = False,
         process_group: Optional[Any] = None,
         dist_sync_fn: Optional[Callable] = None,
+        backend: str = "scipy",
     ) -> None:
         super().__init__(
             dist_sync_on_step=dist_sync_on_step,
@@ -100,6 +195,9 @@ class RegressionMetrics(Metric):
         self.add_state("target", default=[], dist_reduce_fx="cat")
         self.add_state("systems", default=[], dist_reduce_fx=None)
         self.prefix = prefix
+        if backend not in ("scipy", "torch"):
+            raise ValueError("Invalid backend {}.".format(backend))
+        self.backend = backend
 
     def update(
         self,
@@ -127,9 +225,15 @@ class RegressionMetrics(Metric):
         except TypeError:
             preds = self.preds
             target = self.target
-        kendall, _ = stats.kendalltau(preds.tolist(), target.tolist())
-        spearman, _ = stats.spearmanr(preds.tolist(), target.tolist())
-        pearson, _ = stats.pearsonr(preds.tolist(), target.tolist())
+        if self.backend == "torch":
+            preds, target = preds.flatten(), target.flatten()
+            kendall = kendall_tau(preds, target).item()
+            spearman = spearman_corrcoef(preds, target).item()
+            pearson = pearson_corrcoef(preds, target).item()
+        else:
+            kendall, _ = stats.kendalltau(preds.tolist(), target.tolist())
+            spearman, _ = stats.spearmanr(preds.tolist(), target.tolist())
+            pearson, _ = stats.pearsonr(preds.tolist(), target.tolist())
         report = {
             self.prefix + "_kendall": kendall,
             self.prefix + "_spearman": spearman,
@@ -145,6 +249,106 @@ class RegressionMetrics(Metric):
         return report
 
 
+def _merge_samples(samples: torch.Tensor, sample_size: int) -> torch.Tensor:
+    """Merges bottom-k samples ([..., sample_size, 3] rows of key, pred, target)
+    keeping the `sample_size` rows with the smallest keys.
+    """
+    samples = samples.reshape(-1, 3)
+    keep = torch.topk(samples[:, 0], sample_size, largest=False, sorted=False).indices
+    return samples[keep]
+
+
+class StreamingRegressionMetrics(Metric):
+    """Bounded memory version of `RegressionMetrics`.
+
+    Pearson is computed exactly from running sums. Kendall and Spearman are computed
+    over a uniform random sample of `sample_size` (pred, target) pairs kept with
+    bottom-k sampling: each pair gets a random key and the pairs with the smallest
+    keys are kept. This sample can be merged across DDP ranks, so every state has a
+    fixed size regardless of the number of validation samples.
+
+    System accuracy is not supported (it requires all the segment scores).
+
+    Args:
+        prefix (str): Prefix of the reported metrics.
+        sample_size (int): Number of pairs used for the rank correlations. Defaults
+            to 10000.
+    """
+
+    is_differentiable = False
+    higher_is_better = True
+    full_state_update = False
+
+    def __init__(
+        self,
+        prefix: str = "",
+        sample_size: int = 10000,
+        dist_sync_on_step: bool = False,
+        process_group: Optional[Any] = None,
+        dist_sync_fn: Optional[Callable] = None,
+    ) -> None:
+        super().__init__(
+            dist_sync_on_step=dist_sync_on_step,
+            process_group=process_group,
+            dist_sync_fn=dist_sync_fn,
+        )
+        for name in ("n", "sum_x", "sum_y", "sum_xx", "sum_yy", "sum_xy"):
+            self.add_state(
+                name, default=torch.tensor(0, dtype=torch.float64), dist_reduce_fx="sum"
+            )
+        self.add_state(
+            "sample",
+            default=torch.full((sample_size, 3), float("inf"), dtype=torch.float64),
+            dist_reduce_fx=partial(_merge_samples, sample_size=sample_size),
+        )
+        self.prefix = prefix
+        self.sample_size = sample_size
+
+    def update(
+        self,
+        preds: torch.Tensor,
+        target: torch.Tensor,
+        systems: Optional[List[str]] = None,
+    ) -> None:  # type: ignore
+        """Update state with predictions and targets.
+
+        Args:
+            preds (torch.Tensor): Predictions from model
+            target (torch.Tensor): Ground truth values
+            systems (Optional[List[str]]): Ignored (see class docstring).
+        """
+        x = preds.detach().flatten().double()
+        y = target.detach().flatten().to(x)
+        self.n += x.numel()
+        self.sum_x += x.sum()
+        self.sum_y += y.sum()
+        self.sum_xx += (x * x).sum()
+        self.sum_yy += (y * y).sum()
+        self.sum_xy += (x * y).sum()
+
+        keys = torch.rand(x.numel(), dtype=torch.float64, device=x.device)
+        self.sample = _merge_samples(
+            torch.cat([self.sample, torch.stack([keys, x, y], dim=1)]),
+            self.sample_size,
+        )
+
+    def compute(self) -> torch.Tensor:
+        """Computes Pearson (exact) and Kendall/Spearman (sampled) correlations."""
+        cov = self.sum_xy - self.sum_x * self.sum_y / self.n
+        var_x = self.sum_xx - self.sum_x**2 / self.n
+        var_y = self.sum_yy - self.sum_y**2 / self.n
+        pearson = cov / torch.sqrt(var_x * var_y)
+
+        sample = self.sample[torch.isfinite(self.sample[:, 0])]
+        return {
+            self.prefix + "_kendall": kendall_tau(sample[:, 1], sample[:, 2]).item(),
+            self.prefix + "_spearman": spearman_corrcoef(
+                sample[:, 1], sample[:, 2]
+            ).item(),
+            self.prefix + "_pearson": pearson.item(),
+        }
+
+
 class WMTKendall(Metric):
     full_state_update = True
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Unbabel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""
+Pooling Benchmark
+=================
+    Micro-benchmark comparing the pooling functions in `pooling_utils` across
+    sequence lengths and dtypes.
+
+    python -m comet.models.pooling_benchmark
+"""
+import time
+from typing import Callable, Dict, List
+
+import torch
+
+from .pooling_utils import (
+    average_pooling,
+    masked_average_pooling,
+    masked_max_pooling,
+    max_pooling,
+    scripted,
+)
+
+PAD = 1
+
+AVG_FUNCTIONS = {
+    "average_pooling": average_pooling,
+    "masked_average_pooling": masked_average_pooling,
+    "scripted_average_pooling": scripted(masked_average_pooling),
+}
+
+MAX_FUNCTIONS = {
+    "max_pooling": max_pooling,
+    "masked_max_pooling": masked_max_pooling,
+    "scripted_max_pooling": scripted(masked_max_pooling),
+}
+
+
+def _timeit(fn: Callable, repeats: int) -> float:
+    """Median run time (in milliseconds) of `fn`."""
+    fn()  # warmup (and TorchScript profiling run)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def benchmark_pooling(
+    batch_size: int = 16,
+    hidden_size: int = 1024,
+    seq_lengths: List[int] = [32, 128, 512],
+    dtypes: List[torch.dtype] = [torch.float32, torch.bfloat16],
+    device: str = "cpu",
+    repeats: int = 20,
+) -> List[Dict]:
+    """Times every pooling function for each sequence length and dtype.
+
+    Return:
+        List[Dict]: one row per (function, dtype, seq_length) with the median time
+            in ms and the max absolute difference w.r.t the original function.
+    """
+    results = []
+    for dtype in dtypes:
+        for seq_length in seq_lengths:
+            embeddings = torch.randn(
+                batch_size, seq_length, hidden_size, device=device
+            ).to(dtype)
+            lengths = torch.randint(1, seq_length + 1, (batch_size,), device=device)
+            mask = torch.arange(seq_length, device=device)[None, :] < lengths[:, None]
+            tokens = torch.where(mask, 5, PAD)
+            mask = mask.long()
+
+            for functions, args in (
+                (AVG_FUNCTIONS, (tokens, embeddings, mask, PAD)),
+                (MAX_FUNCTIONS, (tokens, embeddings, PAD)),
+            ):
+                reference = None
+                for name, fn in functions.items():
+                    with torch.inference_mode():
+                        output = fn(*args)
+                        elapsed = _timeit(lambda: fn(*args), repeats)
+                    if reference is None:
+                        reference = output.float()
+                    results.append(
+                        {
+                            "function": name,
+                            "dtype": str(dtype).replace("torch.", ""),
+                            "seq_length": seq_length,
+                            "ms": elapsed,
+                            "max_abs_diff": (output.float() - reference)
+                            .abs()
+                            .max()
+                            .item(),
+                        }
+                    )
+    return results
+
+
+if __name__ == "__main__":
+    for row in benchmark_pooling():
+        print(
+            "{function:<26} {dtype:<9} seq_len={seq_length:<4} {ms:8.3f} ms "
+            "max_abs_diff={max_abs_diff:.2e}".format(**row)
+        )
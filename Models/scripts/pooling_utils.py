@@ -12,6 +12,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from functools import lru_cache
+from typing import Callable
+
 import torch
 
 
@@ -76,3 +79,58 @@ def mask_fill(
     """
     padding_mask = tokens.eq(padding_index).unsqueeze(-1)
     return embeddings.float().masked_fill_(padding_mask, fill_value).type_as(embeddings)
+
+
+def masked_average_pooling(
+    tokens: torch.Tensor,
+    embeddings: torch.Tensor,
+    mask: torch.Tensor,
+    padding_index: int,
+) -> torch.Tensor:
+    """Average pooling computed as a batched matmul between the padding mask and
+    the embeddings. Unlike `average_pooling` it does not copy the embeddings (or
+    expand the mask) to [batch_size x seq_length x hidden_size].
+
+    Args:
+        tokens (torch.Tensor): Word ids [batch_size x seq_length]
+        embeddings (torch.Tensor): Word embeddings [batch_size x seq_length x
+            hidden_size]
+        mask (torch.Tensor): Padding mask [batch_size x seq_length]
+        padding_index (torch.Tensor): Padding value.
+
+    Return:
+        torch.Tensor: Sentence embedding
+    """
+    weights = tokens.ne(padding_index).to(embeddings.dtype).unsqueeze(1)
+    sentemb = torch.bmm(weights, embeddings).squeeze(1)
+    return sentemb / mask.sum(1, keepdim=True).float()
+
+
+def masked_max_pooling(
+    tokens: torch.Tensor, embeddings: torch.Tensor, padding_index: int
+) -> torch.Tensor:
+    """Max pooling that avoids the float round-trip of `max_pooling` for reduced
+    precision embeddings: it does a single out-of-place masked fill in their dtype
+    (`max_pooling` converts to float, fills and converts back). Full precision
+    embeddings go through `max_pooling`, whose in-place fill is faster there (and,
+    as before, overwrites the padded positions of `embeddings`).
+
+    Args:
+        tokens (torch.Tensor): Word ids [batch_size x seq_length]
+        embeddings (torch.Tensor): Word embeddings [batch_size x seq_length x
+            hidden_size]
+        padding_index (int):Padding value.
+
+    Return:
+        torch.Tensor: Sentence embedding
+    """
+    if embeddings.dtype == torch.float32 or embeddings.dtype == torch.float64:
+        return max_pooling(tokens, embeddings, padding_index)
+    padding_mask = tokens.eq(padding_index).unsqueeze(-1)
+    return embeddings.masked_fill(padding_mask, float("-inf")).max(dim=1)[0]
+
+
+@lru_cache(maxsize=None)
+def scripted(pooling_function: Callable) -> Callable:
+    """TorchScript compiled variant of a pooling function (compiled on first use)."""
+    return torch.jit.script(pooling_function)
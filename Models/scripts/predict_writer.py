@@ -16,36 +16,80 @@ import logging
 import os
 import shutil
 import tempfile
+from collections import defaultdict
+from typing import List, Optional
 
+import numpy as np
 import torch
 from pytorch_lightning.callbacks import BasePredictionWriter
 
-from .utils import Prediction, flatten_metadata, restore_list_order
+from .utils import Prediction, flatten_metadata, restore_list_order, to_output
 
 logger = logging.getLogger(__name__)
 
+# Shared memory backed filesystem used by the "mmap" backend when available.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
 
 class CustomWriter(BasePredictionWriter):
     """Pytorch Lightning Callback that saves predictions and the corresponding batch
     indices in a temporary folder when using multigpu inference.
 
+    Two backends are available:
+        - 'file': every rank pickles its predictions and batch indices at the end of
+            the epoch and the global rank reloads and reorders them.
+        - 'mmap': every rank writes scores (and per-sample tensor metadata) after each
+            batch directly into preallocated memory-mapped arrays, indexed by dataset
+            position, in shared memory. No pickling or reordering is needed to gather
+            them. Metadata that is not a per-sample tensor (e.g: word tags) still
+            goes through the 'file' path.
+
     Args:
         write_interval (str): When to perform write operations. Defaults to 'epoch'
+            (the 'mmap' backend always writes on batch and epoch end).
+        batch_ids (Optional[List[List[int]]]): When each dataset item is a whole batch
+            (e.g: token-budget batching), the sample ids of each batch. Indices
+            reported by Lightning are then batch positions. Defaults to None.
+        backend (str): 'file', 'mmap' or 'auto' ('mmap' if `num_samples` is given).
+            Defaults to 'auto'.
+        num_samples (Optional[int]): Number of samples being scored. Required by the
+            'mmap' backend to preallocate the arrays. Defaults to None.
     """
 
-    def __init__(self, write_interval="epoch") -> None:
-        super().__init__(write_interval)
+    def __init__(
+        self,
+        write_interval="epoch",
+        batch_ids: Optional[List[List[int]]] = None,
+        backend: str = "auto",
+        num_samples: Optional[int] = None,
+    ) -> None:
+        if backend == "auto":
+            backend = "mmap" if num_samples is not None else "file"
+        if backend not in ("file", "mmap"):
+            raise ValueError("Invalid CustomWriter backend: {}".format(backend))
+        if backend == "mmap" and num_samples is None:
+            raise ValueError("The 'mmap' backend requires `num_samples`.")
+        if backend == "mmap":
+            write_interval = "batch_and_epoch"
 
-    def write_on_epoch_end(self, trainer, pl_module, predictions, batch_indices):
-        """Saves predictions after running inference on all samples."""
+        super().__init__(write_interval)
+        self.batch_ids = batch_ids
+        self.backend = backend
+        self.num_samples = num_samples
+        self.output_dir = None
+        self._arrays = {}
+        self._objects = defaultdict(list)
+        self._object_indices = defaultdict(list)
 
+    def _create_shared_folder(self, trainer, dir: Optional[str] = None) -> str:
+        """Creates a temporary folder in the global rank and shares it with all ranks."""
         # We need to save predictions in the most secure manner possible to avoid
         # multiple users and processes writing to the same folder.
         # For that we will create a tmp folder that will be shared only across
         # the DDP processes that were created
         if trainer.is_global_zero:
             output_dir = [
-                tempfile.mkdtemp(),
+                tempfile.mkdtemp(dir=dir),
             ]
             logger.info(
                 "Created temporary folder to store predictions: {}.".format(
@@ -61,9 +105,72 @@ class CustomWriter(BasePredictionWriter):
 
         # Make sure every process received the output_dir from RANK=0
         torch.distributed.barrier()
+        return output_dir[0]
+
+    def _sample_ids(self, batch_indices: List[int]) -> List[int]:
+        """Maps the indices reported by Lightning to sample ids."""
+        if self.batch_ids is None:
+            return list(batch_indices)
+        return [i for position in batch_indices for i in self.batch_ids[position]]
+
+    def setup(self, trainer, pl_module, stage: str) -> None:
+        """Creates the shared folder before predict starts ('mmap' backend)."""
+        if self.backend == "mmap" and stage == "predict":
+            self.output_dir = self._create_shared_folder(trainer, dir=SHM_DIR)
+
+    def _array(self, name: str) -> np.memmap:
+        """Opens (creating it if needed) the shared array of a given field."""
+        if name not in self._arrays:
+            path = os.path.join(self.output_dir, name + ".f64")
+            nbytes = self.num_samples * np.dtype("<f8").itemsize
+            # All ranks may create the file concurrently. Extending a file to the
+            # same size is idempotent so no further synchronization is needed.
+            with open(path, "ab") as fh:
+                if fh.tell() < nbytes:
+                    fh.truncate(nbytes)
+            self._arrays[name] = np.memmap(
+                path, dtype="<f8", mode="r+", shape=(self.num_samples,)
+            )
+        return self._arrays[name]
+
+    def write_on_batch_end(
+        self,
+        trainer,
+        pl_module,
+        prediction,
+        batch_indices,
+        batch,
+        batch_idx,
+        dataloader_idx,
+    ):
+        """Writes batch predictions into the shared arrays ('mmap' backend)."""
+        indices = self._sample_ids(batch_indices)
+        self._array("scores")[indices] = prediction.scores.double().cpu().numpy()
+        if "metadata" not in prediction:
+            return
+
+        for k, v in prediction.metadata.items():
+            if torch.is_tensor(v) and v.dim() == 1 and len(v) == len(indices):
+                self._array("metadata." + k)[indices] = v.double().cpu().numpy()
+            else:
+                self._objects[k].append(v)
+                self._object_indices[k].append(indices)
+
+    def write_on_epoch_end(self, trainer, pl_module, predictions, batch_indices):
+        """Saves predictions after running inference on all samples."""
+        if self.backend == "mmap":
+            for array in self._arrays.values():
+                array.flush()
+            if self._objects:
+                torch.save(
+                    (dict(self._objects), dict(self._object_indices)),
+                    os.path.join(self.output_dir, f"objects_{trainer.global_rank}.pt"),
+                )
+            return
+
         # Now that we have a single output_dir shared across processes we can save
         # prediction along with their indices.
-        self.output_dir = output_dir[0]
+        self.output_dir = self._create_shared_folder(trainer)
         # this will create N (num processes) files in `output_dir` each containing
         # the predictions of it's respective rank
         torch.save(
@@ -76,10 +183,16 @@ class CustomWriter(BasePredictionWriter):
             os.path.join(self.output_dir, f"batch_indices_{trainer.global_rank}.pt"),
         )
 
-    def gather_all_predictions(self):
+    def gather_all_predictions(self, return_numpy: bool = False):
         """Reads all saves predictions from the self.output_dir into one single
         Prediciton object respecting the original order of the samples.
+
+        Args:
+            return_numpy (bool): Return NumPy arrays instead of Python lists.
+                Defaults to False.
         """
+        if self.backend == "mmap":
+            return self._gather_shared_predictions(return_numpy)
 
         def flatten(list):
             return [item for sublist in list for item in sublist]
@@ -90,7 +203,7 @@ class CustomWriter(BasePredictionWriter):
             )
             if "metadata" in predictions[0]:
                 flatten_pred["metadata"] = flatten_metadata(
-                    [pred.metadata for pred in predictions]
+                    [pred.metadata for pred in predictions], to_list=False
                 )
             return flatten_pred
 
@@ -109,17 +222,55 @@ class CustomWriter(BasePredictionWriter):
                 if "batch_indices" in f
             ]
         )
+        if self.batch_ids is not None:
+            indices = flatten([self.batch_ids[i] for i in indices])
+        scores = restore_list_order(pred.scores, indices)
         output = Prediction(
-            scores=restore_list_order(pred.scores.tolist(), indices),
-            system_score=sum(pred.scores.tolist()) / len(pred.scores),
+            scores=to_output(scores, return_numpy),
+            system_score=scores.double().mean().item(),
         )
         if "metadata" in pred:
             output["metadata"] = Prediction(
-                **{k: restore_list_order(v, indices) for k, v in pred.metadata.items()}
+                **{
+                    k: to_output(restore_list_order(v, indices), return_numpy)
+                    for k, v in pred.metadata.items()
+                }
             )
         return output
 
+    def _gather_shared_predictions(self, return_numpy: bool = False):
+        """Reads the shared arrays written by all ranks ('mmap' backend). Arrays are
+        already in the original order of the samples.
+        """
+        files = sorted(os.listdir(self.output_dir))
+        scores = np.fromfile(os.path.join(self.output_dir, "scores.f64"), dtype="<f8")
+        output = Prediction(
+            scores=to_output(scores, return_numpy), system_score=float(scores.mean())
+        )
+
+        metadata = {}
+        for f in files:
+            if f.startswith("metadata.") and f.endswith(".f64"):
+                array = np.fromfile(os.path.join(self.output_dir, f), dtype="<f8")
+                metadata[f[len("metadata.") : -len(".f64")]] = to_output(
+                    array, return_numpy
+                )
+
+            elif f.startswith("objects_"):
+                objects, object_indices = torch.load(os.path.join(self.output_dir, f))
+                for k, values in objects.items():
+                    values = flatten_metadata([{k: v} for v in values])[k]
+                    indices = [i for ids in object_indices[k] for i in ids]
+                    column = metadata.setdefault(k, [None] * self.num_samples)
+                    for i, value in zip(indices, values):
+                        column[i] = value
+
+        if metadata:
+            output["metadata"] = Prediction(**metadata)
+        return output
+
     def cleanup(self):
         """Cleans temporary files."""
+        self._arrays.clear()
         logger.info("Cleanup temporary folder: {}.".format(self.output_dir))
         shutil.rmtree(self.output_dir)
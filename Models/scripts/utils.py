@@ -15,6 +15,7 @@
 import itertools
 from typing import List, Tuple, Any
 
+import numpy as np
 import torch
 from torch.utils.data import Sampler
 from collections import OrderedDict
@@ -162,15 +163,47 @@ class OrderedSampler(Sampler[int]):
         return len(self.indices)
 
 
-def flatten_metadata(metadata):
+def token_budget_batches(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """Sorts samples by length and packs them into batches such that the number of
+    padded tokens in each batch (batch size x longest sample) is at most `max_tokens`.
+    Samples longer than `max_tokens` end up alone in their own batch.
+
+    Args:
+        lengths (List[int]): Number of tokens of each sample.
+        max_tokens (int): Maximum number of padded tokens per batch.
+
+    Return:
+        List[List[int]]: Sample ids of each batch.
+    """
+    batches, batch, batch_length = [], [], 0
+    for i in np.argsort(lengths, kind="stable").tolist():
+        length = max(batch_length, lengths[i])
+        if batch and length * (len(batch) + 1) > max_tokens:
+            batches.append(batch)
+            batch, length = [], lengths[i]
+        batch.append(i)
+        batch_length = length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def flatten_metadata(metadata, to_list: bool = True):
     """Metadata from the model output can be in various forms and this function
     will gather all metadata and flatten everything.
+
+    Args:
+        metadata (List[Prediction]): metadata of each batch.
+        to_list (bool): If False, tensor metadata is kept as a single concatenated
+            tensor instead of being converted into a list. Defaults to True.
     """
     metadata = Prediction(**{k: [dic[k] for dic in metadata] for k in metadata[0]})
     for k, v in metadata.items():
         if torch.is_tensor(v[0]):
             # If we have tensors we can use cat to flatten them.
-            metadata[k] = torch.cat(v, dim=0).tolist()
+            metadata[k] = torch.cat(v, dim=0)
+            if to_list:
+                metadata[k] = metadata[k].tolist()
         else:
             # for other predictions such as word tags we have to flatten the list.
             metadata[k] = [item for sublist in v for item in sublist]
@@ -178,8 +211,83 @@ def flatten_metadata(metadata):
 
 
 def restore_list_order(sorted_list, sort_ids):
-    """Restores the original ids of a given list."""
+    """Restores the original ids of a given list.
+
+    Tensors and NumPy arrays are reordered with a single scatter and keep their
+    type. If `sort_ids` has repeated ids (e.g: samples padded by a distributed
+    sampler) the output only has `max(sort_ids) + 1` rows.
+    """
+    if torch.is_tensor(sorted_list):
+        sort_ids = torch.as_tensor(
+            sort_ids, dtype=torch.long, device=sorted_list.device
+        )
+        size = int(sort_ids.max()) + 1 if len(sort_ids) else 0
+        unsorted = sorted_list.new_empty((size,) + tuple(sorted_list.shape[1:]))
+        unsorted[sort_ids] = sorted_list
+        return unsorted
+
+    if isinstance(sorted_list, np.ndarray):
+        sort_ids = np.asarray(sort_ids, dtype=np.int64)
+        size = int(sort_ids.max()) + 1 if len(sort_ids) else 0
+        unsorted = np.empty((size,) + sorted_list.shape[1:], dtype=sorted_list.dtype)
+        unsorted[sort_ids] = sorted_list
+        return unsorted
+
     unsorted_list = [None for _ in range(len(sorted_list))]
     for i, s in zip(sort_ids, sorted_list):
         unsorted_list[i] = s
     return unsorted_list
+
+
+def to_output(values, return_numpy: bool = False):
+    """Converts tensors into the type returned by the API: Python lists (default)
+    or NumPy arrays.
+    """
+    if torch.is_tensor(values):
+        values = values.detach().cpu()
+        return values.numpy() if return_numpy else values.tolist()
+    if isinstance(values, np.ndarray) and not return_numpy:
+        return values.tolist()
+    return values
+
+
+def gather_predictions(
+    predictions: List[Prediction], sort_ids=None, return_numpy: bool = False
+) -> Prediction:
+    """Concatenates the Prediction of each batch into a single Prediction with
+    segment-level `scores`, `system_score` and flattened metadata.
+
+    Scores and tensor metadata stay tensors (reordered with a single scatter) until
+    they are converted at the end.
+
+    Args:
+        predictions (List[Prediction]): Batch predictions.
+        sort_ids (Optional[List[int]]): Original position of each sample. If given,
+            the original order of the samples is restored. Defaults to None.
+        return_numpy (bool): Return NumPy arrays instead of Python lists. Defaults
+            to False.
+
+    Return:
+        Prediction object with `scores`, `system_score` and metadata.
+    """
+    scores = torch.cat([pred.scores for pred in predictions], dim=0).detach().cpu()
+    if "metadata" in predictions[0]:
+        metadata = flatten_metadata(
+            [pred.metadata for pred in predictions], to_list=False
+        )
+    else:
+        metadata = {}
+
+    if sort_ids is not None:
+        scores = restore_list_order(scores, sort_ids)
+        metadata = {k: restore_list_order(v, sort_ids) for k, v in metadata.items()}
+
+    output = Prediction(
+        scores=to_output(scores, return_numpy),
+        system_score=scores.double().mean().item(),
+    )
+    if metadata:
+        output["metadata"] = Prediction(
+            **{k: to_output(v, return_numpy) for k, v in metadata.items()}
+        )
+    return output
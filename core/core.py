@@ -55,6 +55,39 @@ _all_ = ["show_batch", "show_results"]
 # %% ../../nbs/03_data.core.ipynb 13
 _batch_tfms = ('after_item','before_batch','after_batch')
 
+class _FusedAffine(Transform):
+    "Consecutive `tfms` with an `affine` method, applied to a `TensorImage` as a single `x*scale+shift`"
+    def __init__(self, tfms): self.tfms,self.order = tfms,tfms[0].order
+    def encodes(self, x:TensorImage):
+        coeffs = [f.affine() for f in self.tfms]
+        if any(c is None for c in coeffs): return compose_tfms(x, self.tfms)
+        scale,shift = 1.,0.
+        for s,b in coeffs: scale,shift = scale*s,shift*s+b
+        # One copy to float, then in place: the uint8 batch is read once and no other full-size tensor is allocated
+        return x.to(torch.float32, copy=True).mul_(scale).add_(shift)
+    def encodes(self, x): return compose_tfms(x, self.tfms)
+    def __repr__(self): return f'{self.__class__.__name__}({self.tfms})'
+
+def _fuse_affine(fs):
+    "Replace each run of transforms of `fs` that have an `affine` method, and no `split_idx`, by a `_FusedAffine`"
+    res,run = [],[]
+    for f in [*fs, None]:
+        if f is not None and hasattr(f, 'affine') and f.split_idx is None:
+            run.append(f)
+            continue
+        if len(run)>1: res.append(_FusedAffine(run))
+        else:          res += run
+        run = []
+        if f is not None: res.append(f)
+    return res
+
+class _FusedPipeline(Pipeline):
+    "A `Pipeline` that encodes with its affine transforms fused, but decodes and shows its original transforms"
+    def __call__(self, o):
+        key = tuple(map(id, self.fs))
+        if getattr(self, '_fused_key', None)!=key: self._fused,self._fused_key = _fuse_affine(self.fs),key
+        return compose_tfms(o, tfms=self._fused, split_idx=self.split_idx)
+
 # %% ../../nbs/03_data.core.ipynb 14
 class TfmdDL(DataLoader):
     "Transformed `DataLoader`"
@@ -66,10 +99,13 @@ class TfmdDL(DataLoader):
         num_workers:int=None, # Number of CPU cores to use in parallel (default: All available up to 16)
         verbose:bool=False, # Whether to print verbose logs
         do_setup:bool=True, # Whether to run `setup()` for batch transform(s)
+        fuse_tfms:bool=True, # Whether to fuse consecutive affine `after_batch` transforms into one op
         **kwargs
     ):
         if num_workers is None: num_workers = min(16, defaults.cpus)
         for nm in _batch_tfms: kwargs[nm] = Pipeline(kwargs.get(nm,None))
+        if fuse_tfms: kwargs['after_batch'] = _FusedPipeline(kwargs['after_batch'])
+        self.fuse_tfms = fuse_tfms
         super().__init__(dataset, bs=bs, shuffle=shuffle, num_workers=num_workers, **kwargs)
         if do_setup:
             for nm in _batch_tfms:
@@ -93,6 +129,7 @@ class TfmdDL(DataLoader):
         cls=None, # Class of the newly created `DataLoader` object
         **kwargs
     ):
+        if cls is None or issubclass(cls, TfmdDL): kwargs.setdefault('fuse_tfms', self.fuse_tfms)
         res = super().new(dataset, cls, do_setup=False, **kwargs)
         if not hasattr(self, '_n_inp') or not hasattr(self, '_types'):
             try:
@@ -331,6 +368,20 @@ class FilteredBase:
 
 FilteredBase.train,FilteredBase.valid = add_props(lambda i,x: x.subset(i))
 
+def _is_deterministic(f):
+    "Whether the transform `f`, or the function it wraps, declares itself `deterministic`"
+    if getattr(f, 'deterministic', False): return True
+    enc = getattr(f, 'encodes', None)
+    return type(f) in (Transform, ItemTransform) and getattr(getattr(enc, 'first', noop)(), 'deterministic', False)
+
+def _tfms_hash(fs, items):
+    "Hash of the transforms `fs` with their state, and of `items`"
+    h = hashlib.md5()
+    for o in (*fs, items):
+        try:              h.update(pickle.dumps(o))
+        except Exception: h.update(repr(o).encode())
+    return h.hexdigest()
+
 # %% ../../nbs/03_data.core.ipynb 52
 class TfmdLists(FilteredBase, L, GetAttr):
     "A `Pipeline` of `tfms` applied to a collection of `items`"
@@ -345,7 +396,8 @@ class TfmdLists(FilteredBase, L, GetAttr):
         splits:list=None, # Indices for training and validation sets
         types=None, # Types of data in `items`
         verbose:bool=False, # Print verbose output
-        dl_type:TfmdDL=None # Type of `DataLoader`
+        dl_type:TfmdDL=None, # Type of `DataLoader`
+        cache:bool|Path=None # Cache the results of the `deterministic` `tfms` at the start of the pipeline, in RAM if `True` or in a memory-mapped file in this folder
     ):
         super().__init__(items, use_list=use_list)
         if dl_type is not None: self._dl_type = dl_type
@@ -354,9 +406,11 @@ class TfmdLists(FilteredBase, L, GetAttr):
         if isinstance(tfms,Pipeline): do_setup=False
         self.tfms = Pipeline(tfms, split_idx=split_idx)
         store_attr('types,split_idx')
+        self._cache,self._cache_type,self.n_cached = None,None,0
         if do_setup:
             pv(f"Setting up {self.tfms}", verbose)
             self.setup(train_setup=train_setup)
+        if cache: self.materialize(None if cache is True else cache)
 
     def _new(self, items, split_idx=None, **kwargs):
         split_idx = ifnone(split_idx,self.split_idx)
@@ -364,8 +418,14 @@ class TfmdLists(FilteredBase, L, GetAttr):
         except IndexError as e:
             e.args = [f"Tried to grab subset {i} in the Dataset, but it contained no items.\n\t{e.args[0]}"]
             raise
-    def subset(self, i): return self._new(self._get(self.splits[i]), split_idx=i)
-    def _after_item(self, o): return self.tfms(o)
+    def subset(self, i):
+        res = self._new(self._get(self.splits[i]), split_idx=i)
+        if self._cache is not None: res._cache,res._cache_type,res.n_cached = self._cache[self.splits[i]],self._cache_type,self.n_cached
+        return res
+    def _after_item(self, o):
+        if not self.n_cached: return self.tfms(o)
+        if self._cache_type is not None: o = torch.from_numpy(np.asarray(o)).as_subclass(self._cache_type)
+        return compose_tfms(o, tfms=self.tfms.fs[self.n_cached:], split_idx=self.tfms.split_idx)
     def __repr__(self): return f"{self.__class__.__name__}: {self.items}\ntfms - {self.tfms.fs}"
     def __iter__(self): return (self[i] for i in range(len(self)))
     def show(self, o, **kwargs): return self.tfms.show(o, **kwargs)
@@ -388,6 +448,36 @@ class TfmdLists(FilteredBase, L, GetAttr):
         types = L(t if is_listy(t) else [t] for t in self.types).concat().unique()
         self.pretty_types = '\n'.join([f'  - {t}' for t in types])
 
+    def materialize(self, 
+        path:Path=None # Folder of the memory-mapped cache, keep the results in RAM if `None`
+    ):
+        n = 0
+        while n<len(self.tfms.fs) and _is_deterministic(self.tfms.fs[n]): n += 1
+        self._cache,self._cache_type,self.n_cached = None,None,0
+        if n==0 or len(self)==0: return self
+        fs,split_idx,get = self.tfms.fs[:n],self.tfms.split_idx,super().__getitem__
+        _prefix = lambda i: compose_tfms(get(i), tfms=fs, split_idx=split_idx)
+        if path is None: cache = L([_prefix(i) for i in range(len(self))])
+        else:
+            x = _prefix(0)
+            if not isinstance(x, (Tensor,ndarray)):
+                warnings.warn(f"Only tensors or arrays can be cached on disk, got {type(x)}: the tfms are not cached")
+                return self
+            fn = Path(path)/f'{_tfms_hash(fs, self.items)}.bin'
+            if not fn.exists():
+                fn.parent.mkdir(parents=True, exist_ok=True)
+                tmp = fn.with_name(f'{fn.name}.{os.getpid()}.tmp')
+                store = ArrayStore(tmp, compress=False)
+                _row = lambda i: x if i==0 else _prefix(i)
+                for i in range(0, len(self), 1024):
+                    store.append(np.stack([to_np(o) if isinstance(o,Tensor) else o for o in map(_row, range(i, min(i+1024, len(self))))]))
+                os.replace(store._meta_path, fn.with_name(f'{fn.name}.json'))
+                os.replace(tmp, fn)
+            cache = L(ArrayStore(fn, compress=False), use_list=None)
+            if isinstance(x, Tensor): self._cache_type = type(x)
+        self._cache,self.n_cached = cache,n
+        return self
+
     def infer_idx(self, x):
         # TODO: check if we really need this, or can simplify
         idx = 0
@@ -403,7 +493,7 @@ class TfmdLists(FilteredBase, L, GetAttr):
         return compose_tfms(x, tfms=self.tfms.fs[self.infer_idx(x):], split_idx=self.split_idx)
 
     def __getitem__(self, idx):
-        res = super().__getitem__(idx)
+        res = super().__getitem__(idx) if self._cache is None else self._cache[idx]
         if self._after_item is None: return res
         return self._after_item(res) if is_indexer(idx) else res.map(self._after_item)
 
@@ -416,6 +506,7 @@ add_docs(TfmdLists,
          subset="New `TfmdLists` with same tfms that only includes items in `i`th split",
          infer_idx="Finds the index where `self.tfms` can be applied to `x`, depending on the type of `x`",
          infer="Apply `self.tfms` to `x` starting at the right tfm depending on the type of `x`",
+         materialize="Run the `deterministic` tfms at the start of `self.tfms` once on all items and replay only the others on access",
          new_empty="A new version of `self` but with no items")
 
 # %% ../../nbs/03_data.core.ipynb 54
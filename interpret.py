@@ -7,6 +7,7 @@ from __future__ import annotations
 from .data.all import *
 from .optimizer import *
 from .learner import *
+from .learner import _ConstantFunc
 from .tabular.core import *
 import sklearn.metrics as skm
 
@@ -28,19 +29,32 @@ class Interpretation():
         learn:Learner,
         dl:DataLoader, # `DataLoader` to run inference over
         losses:TensorBase, # Losses calculated from `dl`
-        act=None # Activation function for prediction
+        act=None, # Activation function for prediction
+        preds:TensorBase=None, # Cached predictions on `dl`, computed on first use if None
+        targs:TensorBase=None, # Cached targets on `dl`
+        decoded:TensorBase=None # Cached decoded predictions on `dl`
     ): 
         store_attr()
 
+    def all_preds(self):
+        "Predictions, targets and decoded outputs on `dl`, from a single cached inference pass"
+        if self.preds is None:
+            self.preds,self.targs,self.decoded = self.learn.get_preds(dl=self.dl, with_decoded=True, act=self.act)
+        return self.preds,self.targs,self.decoded
+
+    def _inputs(self, idxs):
+        "Model inputs of the items at `idxs`, rebuilt from `dl` without running inference"
+        dl = self.dl.new(get_idxs=_ConstantFunc(idxs), bs=len(idxs), shuffle=False, drop_last=False)
+        b = dl.one_batch()
+        i = getattr(self.dl, 'n_inp', 1 if len(b)==1 else len(b)-1)
+        return detuplify(to_detach(b[:i]))
+
     def __getitem__(self, idxs):
         "Return inputs, preds, targs, decoded outputs, and losses at `idxs`"
         if isinstance(idxs, Tensor): idxs = idxs.tolist()
         if not is_listy(idxs): idxs = [idxs]
-        items = getattr(self.dl.items, 'iloc', L(self.dl.items))[idxs]
-        tmp_dl = self.learn.dls.test_dl(items, with_labels=True, process=not isinstance(self.dl, TabDataLoader))
-        inps,preds,targs,decoded = self.learn.get_preds(dl=tmp_dl, with_input=True, with_loss=False, 
-                                                        with_decoded=True, act=self.act, reorder=False)
-        return inps, preds, targs, decoded, self.losses[idxs]
+        preds,targs,decoded = nested_reorder(self.all_preds(), idxs)
+        return self._inputs(idxs), preds, targs, decoded, self.losses[idxs]
 
     @classmethod
     def from_learner(cls,
@@ -51,9 +65,8 @@ class Interpretation():
     ):
         "Construct interpretation object from a learner"
         if dl is None: dl = learn.dls[ds_idx].new(shuffle=False, drop_last=False)
-        _,_,losses = learn.get_preds(dl=dl, with_input=False, with_loss=True, with_decoded=False,
-                                     with_preds=False, with_targs=False, act=act)
-        return cls(learn, dl, losses, act)
+        preds,targs,decoded,losses = learn.get_preds(dl=dl, with_input=False, with_loss=True, with_decoded=True, act=act)
+        return cls(learn, dl, losses, act, preds=preds, targs=targs, decoded=decoded)
 
     def top_losses(self,
         k:int|None=None, # Return `k` losses, defaults to all
@@ -104,19 +117,21 @@ class ClassificationInterpretation(Interpretation):
         learn:Learner, 
         dl:DataLoader, # `DataLoader` to run inference over
         losses:TensorBase, # Losses calculated from `dl`
-        act=None # Activation function for prediction
+        act=None, # Activation function for prediction
+        **kwargs # Cached `preds`, `targs` and `decoded` passed to `Interpretation`
     ):
-        super().__init__(learn, dl, losses, act)
+        super().__init__(learn, dl, losses, act, **kwargs)
         self.vocab = self.dl.vocab
         if is_listy(self.vocab): self.vocab = self.vocab[-1]
 
     def confusion_matrix(self):
         "Confusion matrix as an `np.ndarray`."
-        x = torch.arange(0, len(self.vocab))
-        _,targs,decoded = self.learn.get_preds(dl=self.dl, with_decoded=True, with_preds=True, 
-                                               with_targs=True, act=self.act)
+        n = len(self.vocab)
+        _,targs,decoded = self.all_preds()
         d,t = flatten_check(decoded, targs)
-        cm = ((d==x[:,None]) & (t==x[:,None,None])).long().sum(2)
+        d,t = d.long(),t.long()
+        valid = (d>=0) & (d<n) & (t>=0) & (t<n)
+        cm = torch.bincount(t[valid]*n + d[valid], minlength=n*n).view(n, n)
         return to_np(cm)
 
     def plot_confusion_matrix(self, 
@@ -162,8 +177,7 @@ class ClassificationInterpretation(Interpretation):
 
     def print_classification_report(self):
         "Print scikit-learn classification report"
-        _,targs,decoded = self.learn.get_preds(dl=self.dl, with_decoded=True, with_preds=True, 
-                                               with_targs=True, act=self.act)
+        _,targs,decoded = self.all_preds()
         d,t = flatten_check(decoded, targs)
         names = [str(v) for v in self.vocab]
         print(skm.classification_report(t, d, labels=list(self.vocab.o2i.values()), target_names=names))
@@ -7,11 +7,13 @@ from __future__ import annotations
 from .data.all import *
 from .optimizer import *
 from .callback.core import *
+from .callback.core import _inner_loop
 import pickle,threading
 from collections.abc import MutableSequence
 
 # %% auto 0
-__all__ = ['replacing_yield', 'mk_metric', 'save_model', 'load_model', 'SkipToEpoch', 'Learner', 'before_batch_cb',
+__all__ = ['replacing_yield', 'mk_metric', 'save_model', 'load_model', 'SkipToEpoch', 'Learner', 'MemmapPredsCallback',
+           'before_batch_cb',
            'load_learner', 'Metric', 'AvgMetric', 'AvgLoss', 'AvgSmoothLoss', 'ValueMetric', 'Recorder', 'CastToTensor',
            'CancelBackwardException', 'CancelStepException', 'CancelFitException', 'CancelEpochException',
            'CancelTrainException', 'CancelValidException', 'CancelBatchException']
@@ -66,6 +68,13 @@ def _try_concat(o):
     except: return sum([L(o_[i,:] for i in range_of(o_)) for o_ in o], L())
 
 # %% ../nbs/13a_learner.ipynb 20
+_cancel_excs = (CancelBatchException, CancelBackwardException, CancelEpochException, CancelFitException,
+                CancelStepException, CancelTrainException, CancelValidException)
+
+def _custom_call(cb):
+    "Whether `cb` overrides `Callback.__call__`, and so has to be called for every event"
+    return type(cb).__call__ is not Callback.__call__
+
 _before_epoch = [event.before_fit, event.before_epoch]
 _after_epoch  = [event.after_epoch, event.after_fit]
 
@@ -123,6 +132,8 @@ class Learner(GetAttr):
         self.dls,self.model = dls,model
         store_attr(but='dls,model,cbs')
         self.training,self.create_mbar,self.logger,self.opt,self.cbs = False,True,print,None,L()
+        self._cb_table,self.cb_times = {},None
+        self.plain_batch,self.batch_types = False,None
         if default_cbs: self.add_cbs(L(defaults.callbacks))
         self.add_cbs(cbs)
         self.lock = threading.Lock()
@@ -148,6 +159,7 @@ class Learner(GetAttr):
         cb.learn = self
         setattr(self, cb.name, cb)
         self.cbs.append(cb)
+        self._cb_table = {}
         return self
 
     def remove_cb(self, cb):
@@ -156,6 +168,7 @@ class Learner(GetAttr):
             cb.learn = None
             if hasattr(self, cb.name): delattr(self, cb.name)
             if cb in self.cbs: self.cbs.remove(cb)
+            self._cb_table = {}
         return self
 
     @contextmanager
@@ -170,12 +183,42 @@ class Learner(GetAttr):
         try: yield self
         finally: self.add_cbs(cbs)
 
+    @contextmanager
+    def profiled_cbs(self):
+        self.cb_times = defaultdict(float)
+        try: yield self.cb_times
+        finally: self.cb_times = None
+
     def ordered_cbs(self, event): return [cb for cb in self.cbs.sorted('order') if hasattr(cb, event)]
-    def __call__(self, event_name): L(event_name).map(self._call_one)
+    def __call__(self, event_name):
+        if isinstance(event_name, str): self._call_one(event_name)
+        else: L(event_name).map(self._call_one)
 
-    def _call_one(self, event_name):
+    def _event_handlers(self, event_name):
+        "Build the ordered `(cb, handler)` pairs called on `event_name`, cached until callbacks change"
         if not hasattr(event, event_name): raise Exception(f'missing {event_name}')
-        for cb in self.cbs.sorted('order'): cb(event_name)
+        cbs = self.cbs.sorted('order')
+        # Every callback is called on `after_fit` to reset its `run` flag
+        if event_name != 'after_fit': cbs = [cb for cb in cbs if _custom_call(cb) or hasattr(cb, event_name)]
+        res = self._cb_table[event_name] = (event_name in _inner_loop,
+                                            [(cb, None if _custom_call(cb) else getcallable(cb, event_name)) for cb in cbs])
+        return res
+
+    def _call_one(self, event_name):
+        inner,handlers = self._cb_table.get(event_name) or self._event_handlers(event_name)
+        times = self.cb_times
+        for cb,f in handlers:
+            if f is not None and not (cb.run and (not inner or (cb.run_train if self.training else cb.run_valid))): continue
+            if times is not None: start = time.perf_counter()
+            if f is None: cb(event_name)
+            else:
+                try: f()
+                except _cancel_excs: raise
+                except Exception as e: raise modify_exception(e, f'Exception occured in `{cb.__class__.__name__}` when calling event `{event_name}`:\n\t{e.args[0]}', replace=True)
+            if times is not None: times[(cb.name, event_name)] += time.perf_counter() - start
+        if event_name == 'after_fit':
+            for cb,f in handlers:
+                if f is not None: cb.run = True
 
     def _bn_bias_state(self, with_bias): return norm_bias_params(self.model, with_bias).map(self.opt.state)
 
@@ -215,6 +258,14 @@ class Learner(GetAttr):
         self.opt.zero_grad()
 
     def _do_one_batch(self):
+        if not self.plain_batch: return self._do_batch()
+        # Only the model, loss and step see plain tensors, `after_batch` callbacks get the typed `xb` and `yb` back
+        xb,yb = self.xb,self.yb
+        (self.xb,self.yb),self.batch_types = strip_types((xb,yb))
+        try: self._do_batch()
+        finally: self.xb,self.yb = xb,yb
+
+    def _do_batch(self):
         self.pred = self.model(*self.xb)
         self('after_pred')
         if len(self.yb):
@@ -265,7 +316,7 @@ class Learner(GetAttr):
             self.n_epoch = n_epoch
             self._with_events(self._do_fit, 'fit', CancelFitException, self._end_cleanup)
 
-    def _end_cleanup(self): self.dl,self.xb,self.yb,self.pred,self.loss = None,(None,),(None,),None,None
+    def _end_cleanup(self): self.dl,self.xb,self.yb,self.pred,self.loss,self.batch_types = None,(None,),(None,),None,None,None
     def __enter__(self): self(_before_epoch); return self
     def __exit__(self, exc_type, exc_value, tb): self(_after_epoch)
 
@@ -291,6 +342,7 @@ class Learner(GetAttr):
         inner:bool=False, # If False, create progress bar, show logger, use temporary `cbs`
         reorder:bool=True, # Reorder predictions on dataset indicies, if applicable
         cbs:Callback|MutableSequence|None=None, # Temporary `Callback`s to apply during prediction
+        memmap_dir:str|Path|None=None, # Stream results batch by batch to `.npy` memmaps in this folder
         **kwargs
     )-> tuple:
         if dl is None: dl = self.dls[ds_idx].new(shuffle=False, drop_last=False)
@@ -300,9 +352,22 @@ class Learner(GetAttr):
                 raise TypeError(f"`dl` is {type(dl)} and doesn't have len(dl)")
         if isinstance(dl, DataLoader):
             if dl.drop_last: dl = dl.new(shuffle=False, drop_last=False)
+        idxs = None
         if reorder and hasattr(dl, 'get_idxs'):
             idxs = dl.get_idxs()
             dl = dl.new(get_idxs = _ConstantFunc(idxs))
+        if memmap_dir is not None:
+            with_preds,with_targs = kwargs.pop('with_preds', True),kwargs.pop('with_targs', True)
+            if kwargs.get('concat_dim', 0) == 0: kwargs.pop('concat_dim', None)
+            if kwargs: raise ValueError(f"`get_preds` with `memmap_dir` doesn't support {', '.join(kwargs)}")
+            n = len(idxs) if idxs is not None else ifnone(getattr(dl, 'n', None), len(dl.dataset))
+            cb = MemmapPredsCallback(memmap_dir, n, idxs=idxs, with_input=with_input, with_preds=with_preds,
+                                     with_targs=with_targs, with_loss=with_loss, with_decoded=with_decoded, act=act)
+            ctx_mgrs = self.validation_context(cbs=L(cbs)+[cb], inner=inner)
+            if with_loss: ctx_mgrs.append(self.loss_not_reduced())
+            with ContextManagers(ctx_mgrs):
+                self._do_epoch_validate(dl=dl)
+                return cb.all_arrays()
         cb = GatherPredsCallback(with_input=with_input, with_loss=with_loss, **kwargs)
         ctx_mgrs = self.validation_context(cbs=L(cbs)+[cb], inner=inner)
         if with_loss: ctx_mgrs.append(self.loss_not_reduced())
@@ -346,6 +411,8 @@ class Learner(GetAttr):
     def no_logging(self): return replacing_yield(self, 'logger', noop)
     @contextmanager
     def no_mbar(self):    return replacing_yield(self, 'create_mbar', False)
+    @contextmanager
+    def plain_batches(self): return replacing_yield(self, 'plain_batch', True)
 
     @contextmanager
     def loss_not_reduced(self):
@@ -355,10 +422,12 @@ class Learner(GetAttr):
     def to_detach(self,b,cpu=True,gather=True):
         return self.dl.to_detach(b,cpu,gather) if hasattr(getattr(self,'dl',None),'to_detach') else to_detach(b,cpu,gather)
     
-    def __getstate__(self): return {k:v for k,v in self.__dict__.items() if k!='lock'}
+    def __getstate__(self): return {k:v for k,v in self.__dict__.items() if k not in ('lock','_cb_table')}
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self.lock = threading.Lock()
+        self.lock,self._cb_table = threading.Lock(),{}
+        for k,v in dict(cb_times=None, plain_batch=False, batch_types=None).items():
+            if k not in state: setattr(self, k, v)
 
 Learner.x,Learner.y = add_props(lambda i,x: detuplify((x.xb,x.yb)[i]))
 
@@ -370,24 +439,94 @@ add_docs(Learner, "Group together a `model`, some `dls` and a `loss_func` to han
     remove_cb="Add `cb` from the list of `Callback` and deregister `self` as their learner",
     added_cbs="Context manage that temporarily adds `cbs`",
     removed_cbs="Context manage that temporarily removes `cbs`",
+    profiled_cbs="Context manager recording the cumulative wall time of each callback for each event, in a dict keyed by `(cb.name, event_name)`",
     ordered_cbs="List of `Callback`s, in order, for an `event` in the training loop",
     create_opt="Create an optimizer with default hyper-parameters",
     one_batch="Train or evaluate `self.model` on batch `(xb,yb)`",
     all_batches="Train or evaluate `self.model` on all the batches of `self.dl`",
     fit="Fit `self.model` for `n_epoch` using `cbs`. Optionally `reset_opt`.",
     validate="Validate on `dl` with potential new `cbs`.",
-    get_preds="Get the predictions and targets on the `ds_idx`-th dbunchset or `dl`, optionally `with_input` and `with_loss`",
+    get_preds="Get the predictions and targets on the `ds_idx`-th dbunchset or `dl`, optionally `with_input` and `with_loss`. With `memmap_dir`, they are streamed to disk and returned as read-only memmaps",
     predict="Prediction on `item`, fully decoded, loss function decoded and probabilities",
     validation_context="A `ContextManagers` suitable for validation, with optional `cbs`",
     show_results="Show some predictions on `ds_idx`-th dataset or `dl`",
     show_training_loop="Show each step in the training loop",
     no_logging="Context manager to temporarily remove `logger`",
     no_mbar="Context manager to temporarily prevent the master progress bar from being created",
+    plain_batches="Context manager stripping `TensorBase` subclasses from `xb` and `yb` from the model call to the optimizer step, their types are kept in `batch_types` for `restore_types`",
     loss_not_reduced="A context manager to evaluate `loss_func` with reduction set to none.",
     to_detach="Calls `to_detach` if `self.dl` provides a `.to_detach` function otherwise calls global `to_detach`",
     __call__="Call `event_name` for all `Callback`s in `self.cbs`"
 )
 
+class MemmapPredsCallback(Callback):
+    "`Callback` that streams inputs, predictions, targets and losses to preallocated `.npy` memmaps in `path`"
+    def __init__(self,
+        path:str|Path, # Folder where the `.npy` files are written
+        n:int, # Number of items to predict
+        idxs:list|None=None, # Dataset indices in `DataLoader` order, to write each row at its reordered position
+        with_input:bool=False, # Whether to save inputs
+        with_preds:bool=True, # Whether to save predictions
+        with_targs:bool=True, # Whether to save targets
+        with_loss:bool=False, # Whether to save losses
+        with_decoded:bool=False, # Whether to save decoded predictions
+        act=None # Activation applied to each batch of predictions, defaults to `self.loss_func`'s activation
+    ):
+        store_attr('n,with_input,with_preds,with_targs,with_loss,with_decoded,act')
+        self.path = Path(path)
+        # Row `i` in `DataLoader` order goes to the rank of `idxs[i]`, like `nested_reorder(res, idxs.argsort())`
+        self.pos = np.arange(n) if idxs is None else np.argsort(np.argsort(np.asarray(idxs), kind='stable'), kind='stable')
+
+    def before_validate(self):
+        "Create `path` and reset the memmaps"
+        self.path.mkdir(parents=True, exist_ok=True)
+        if self.act is None: self.act = getcallable(self.loss_func, 'activation')
+        self.arrays,self.n_done = {},0
+
+    def _write(self, name, o):
+        "Write the tensors in `o` to the rows of the current batch in the `name` memmaps"
+        ts = list(o) if is_listy(o) else [o]
+        for t in ts:
+            if not isinstance(t, Tensor): raise TypeError(f"Can't write {name} of type {type(t)} to a memmap")
+        arrs = self.arrays.get(name)
+        if arrs is None:
+            arrs = self.arrays[name] = [np.lib.format.open_memmap(
+                self.path/(f'{name}.npy' if len(ts)==1 else f'{name}_{i}.npy'), mode='w+',
+                dtype=to_np(t[:0]).dtype, shape=(self.n,*t.shape[1:])) for i,t in enumerate(ts)]
+        for a,t in zip(arrs, ts): a[self.pos[self.n_done:self.n_done+len(t)]] = to_np(t)
+
+    def before_batch(self):
+        "If `with_input`, write batch inputs"
+        if self.with_input: self._write('inputs', self.learn.to_detach(self.xb))
+
+    def after_batch(self):
+        "Write predictions, targets and potentially decoded predictions and losses"
+        if not hasattr(self, 'pred'): return
+        preds = self.act(self.learn.to_detach(self.pred))
+        if self.with_preds: self._write('preds', preds)
+        if self.with_targs and len(self.yb): self._write('targs', self.learn.to_detach(self.yb))
+        if self.with_preds and self.with_decoded: self._write('decoded', getcallable(self.loss_func, 'decodes')(preds))
+        if self.with_loss:
+            bs = find_bs(self.yb)
+            loss = self.loss if self.loss.numel() == bs else self.loss.view(bs,-1).mean(1)
+            self._write('losses', self.learn.to_detach(loss))
+        self.n_done += find_bs(preds)
+
+    def after_validate(self):
+        "Flush the memmaps to disk"
+        for arrs in self.arrays.values():
+            for a in arrs: a.flush()
+        if self.n_done != self.n: warn(f"Wrote {self.n_done} rows but expected {self.n}")
+
+    def all_arrays(self) -> tuple:
+        "Read-only memmaps in the same order as `Learner.get_preds`: [inputs, preds, targets, decoded, losses], `None` if not saved"
+        def _load(name):
+            if name not in self.arrays: return None
+            return detuplify(tuple(np.load(a.filename, mmap_mode='r') for a in self.arrays[name]))
+        names = ['preds','targs'] + ['decoded']*(self.with_preds and self.with_decoded) + ['losses']*self.with_loss
+        if self.with_input: names = ['inputs'] + names
+        return tuple(_load(name) for name in names)
+
 # %% ../nbs/13a_learner.ipynb 33
 if not hasattr(defaults, 'callbacks'): defaults.callbacks = [TrainEvalCallback]
 
@@ -422,9 +561,64 @@ def load(self:Learner, file, device=None, **kwargs):
     load_model(file, self.model, self.opt, device=device, **kwargs)
     return self
 
+def _model_tensors(model):
+    "Every `(dict, key, tensor)` holding a parameter or buffer of `model`, and the unique tensors by their first name"
+    slots,named,seen = [],{},set()
+    for mn,m in model.named_modules(remove_duplicate=False):
+        for d in (m._parameters, m._buffers):
+            for k,t in d.items():
+                if t is None: continue
+                slots.append((d,k,t))
+                if id(t) not in seen: seen.add(id(t)); named[f'{mn}.{k}' if mn else k] = t
+    return slots,named
+
+def _replace_tensors(model, f):
+    "Replace each unique parameter and buffer `t` of `model` named `n` by `f(n,t)`, keeping shared tensors shared"
+    slots,named = _model_tensors(model)
+    new = {id(t):f(n,t) for n,t in named.items()}
+    for d,k,t in slots: d[k] = new[id(t)]
+    return slots
+
+def _as_param(w, t): return nn.Parameter(w, requires_grad=t.requires_grad) if isinstance(t, nn.Parameter) else w
+
+_weights_align = 64
+
+def _save_flat_weights(named, fname):
+    "Write the tensors in `named` to `fname` as a json index followed by their bytes, each aligned on `_weights_align` bytes"
+    def _align(n): return -(-n//_weights_align)*_weights_align
+    index,off = {},0
+    for n,t in named.items():
+        index[n] = [off, str(t.dtype).split('.')[-1], list(t.shape)]
+        off = _align(off + t.numel()*t.element_size())
+    header = json.dumps(index).encode()
+    start = _align(8+len(header))
+    with open(fname, 'wb') as f:
+        f.write(len(header).to_bytes(8, 'little') + header + bytes(start-8-len(header)))
+        for (o,_,_),t in zip(index.values(), named.values()):
+            f.seek(start+o)
+            f.write(to_np(t.detach().cpu().contiguous().reshape(-1).view(torch.uint8)).tobytes())
+        f.truncate(start+off)
+
+def _load_flat_weights(model, fname, mmap=True, device=None):
+    "Replace the parameters and buffers of `model` by those saved by `_save_flat_weights` in `fname`, memory-mapped if `mmap`"
+    with open(fname, 'rb') as f:
+        n = int.from_bytes(f.read(8), 'little')
+        index = json.loads(f.read(n))
+    start = -(-(8+n)//_weights_align)*_weights_align
+    # Private mapping: pages are shared with other processes reading `fname` until they are written to
+    buf = torch.from_file(str(fname), shared=False, size=os.path.getsize(fname), dtype=torch.uint8)
+    if not mmap: buf = buf.clone()
+    def _get(name, t):
+        o,dtype,shape = index[name]
+        dtype = getattr(torch, dtype)
+        w = buf[start+o:start+o+math.prod(shape)*dtype.itemsize].view(dtype).view(shape)
+        return _as_param(w if device is None else w.to(device), t)
+    _replace_tensors(model, _get)
+
 # %% ../nbs/13a_learner.ipynb 102
 @patch
-def export(self:Learner, fname='export.pkl', pickle_module=pickle, pickle_protocol=2):
+def export(self:Learner, fname='export.pkl', pickle_module=pickle, pickle_protocol=2,
+           separate_weights=False): # Save the model weights next to `fname`, in a `.weights` file `load_learner` can memory-map
     "Export the content of `self` without the items and the optimizer state for inference"
     if rank_distrib(): return # don't export if child proc
     self._end_cleanup()
@@ -432,16 +626,29 @@ def export(self:Learner, fname='export.pkl', pickle_module=pickle, pickle_protoc
     self.dls = self.dls.new_empty()
     state = self.opt.state_dict() if self.opt is not None else None
     self.opt = None
-    with warnings.catch_warnings():
-        #To avoid the warning that come from PyTorch about model not being checked
-        warnings.simplefilter("ignore")
-        torch.save(self, self.path/fname, pickle_module=pickle_module, pickle_protocol=pickle_protocol)
+    if separate_weights:
+        weights_fname = Path(fname).with_suffix('.weights')
+        _,named = _model_tensors(self.model)
+        _save_flat_weights(named, self.path/weights_fname)
+        # Only the structure of the model is pickled, as tensors on the meta device
+        slots = _replace_tensors(self.model, lambda n,t: _as_param(torch.empty_like(t.detach(), device='meta'), t))
+        self._weights_fname = weights_fname.name
+    try:
+        with warnings.catch_warnings():
+            #To avoid the warning that come from PyTorch about model not being checked
+            warnings.simplefilter("ignore")
+            torch.save(self, self.path/fname, pickle_module=pickle_module, pickle_protocol=pickle_protocol)
+    finally:
+        if separate_weights:
+            for d,k,t in slots: d[k] = t
+            del self._weights_fname
     self.create_opt()
     if state is not None: self.opt.load_state_dict(state)
     self.dls = old_dbunch
 
 # %% ../nbs/13a_learner.ipynb 104
-def load_learner(fname, cpu=True, pickle_module=pickle):
+def load_learner(fname, cpu=True, pickle_module=pickle,
+                 mmap=True): # Memory-map the weights of a `Learner` exported with `separate_weights`
     "Load a `Learner` object in `fname`, by default putting it on the `cpu`"
     distrib_barrier()
     map_loc = 'cpu' if cpu else default_device()
@@ -449,6 +656,9 @@ def load_learner(fname, cpu=True, pickle_module=pickle):
     except AttributeError as e: 
         e.args = [f"Custom classes or functions exported with your `Learner` not available in namespace. Re-declare/import before loading:\n\t{e.args[0]}"]
         raise
+    weights_fname = res.__dict__.pop('_weights_fname', None)
+    if weights_fname is not None:
+        _load_flat_weights(res.model, Path(fname).parent/weights_fname, mmap=mmap, device=None if cpu else map_loc)
     if cpu: 
         res.dls.cpu()
         if hasattr(res, 'channels_last'): res = res.to_contiguous(to_fp32=True)
@@ -460,6 +670,7 @@ def load_learner(fname, cpu=True, pickle_module=pickle):
 @docs
 class Metric():
     "Blueprint for defining a metric"
+    on_device = False # Keep running totals on the model device until `value` is read
     def reset(self): pass
     def accumulate(self, learn): pass
     @property
@@ -481,7 +692,7 @@ class AvgMetric(Metric):
     def reset(self):           self.total,self.count = 0.,0
     def accumulate(self, learn):
         bs = find_bs(learn.yb)
-        self.total += learn.to_detach(self.func(learn.pred, *learn.yb))*bs
+        self.total += learn.to_detach(self.func(learn.pred, *learn.yb), cpu=not self.on_device)*bs
         self.count += bs
     @property
     def value(self): return self.total/self.count if self.count != 0 else None
@@ -494,7 +705,7 @@ class AvgLoss(Metric):
     def reset(self):           self.total,self.count = 0.,0
     def accumulate(self, learn):
         bs = find_bs(learn.yb)
-        self.total += learn.to_detach(learn.loss.mean())*bs
+        self.total += learn.to_detach(learn.loss.mean(), cpu=not self.on_device)*bs
         self.count += bs
     @property
     def value(self): return self.total/self.count if self.count != 0 else None
@@ -508,7 +719,8 @@ class AvgSmoothLoss(Metric):
     def reset(self):               self.count,self.val = 0,tensor(0.)
     def accumulate(self, learn):
         self.count += 1
-        self.val = torch.lerp(to_detach(learn.loss.mean()), self.val, self.beta)
+        loss = to_detach(learn.loss.mean(), cpu=not self.on_device)
+        self.val = torch.lerp(loss, self.val.to(loss.device), self.beta)
     @property
     def value(self): return self.val/(1-self.beta**self.count)
 
@@ -538,8 +750,10 @@ class Recorder(Callback):
     _stateattrs=('lrs','iters','losses','values')
     remove_on_fetch,order = True,50
 
-    def __init__(self, add_time=True, train_metrics=False, valid_metrics=True, beta=0.98):
-        store_attr('add_time,train_metrics,valid_metrics')
+    def __init__(self, add_time=True, train_metrics=False, valid_metrics=True, beta=0.98,
+                 device_metrics=False, # Keep metric totals and smooth losses on the device, only syncs without a progress bar (`learn.no_bar()`)
+                 flush_every=256): # Number of steps between copies of the device smooth losses to `self.losses`
+        store_attr('add_time,train_metrics,valid_metrics,device_metrics,flush_every')
         self.loss,self.smooth_loss = AvgLoss(),AvgSmoothLoss(beta=beta)
 
     def before_fit(self):
@@ -554,6 +768,8 @@ class Recorder(Callback):
         if self.add_time: names.append('time')
         self.metric_names = 'epoch'+names
         self.smooth_loss.reset()
+        for met in L(self.loss,self.smooth_loss) + self.metrics: met.on_device = self.device_metrics
+        self._loss_buf,self._n_buf = None,0
 
     def after_batch(self):
         "Update all metrics and records lr and smooth loss in training"
@@ -562,8 +778,22 @@ class Recorder(Callback):
         for met in mets: met.accumulate(self.learn)
         if not self.training: return
         self.lrs.append(self.opt.hypers[-1]['lr'])
-        self.losses.append(self.smooth_loss.value)
-        self.learn.smooth_loss = self.smooth_loss.value
+        smooth_loss = self.smooth_loss.value
+        if self.device_metrics: self._buffer_loss(smooth_loss)
+        else: self.losses.append(smooth_loss)
+        self.learn.smooth_loss = smooth_loss
+
+    def _buffer_loss(self, loss):
+        "Write `loss` to a preallocated buffer on its device, flushed to `self.losses` every `flush_every` steps"
+        if self._loss_buf is None: self._loss_buf = loss.new_empty(self.flush_every)
+        self._loss_buf[self._n_buf] = loss
+        self._n_buf += 1
+        if self._n_buf == self.flush_every: self._flush_losses()
+
+    def _flush_losses(self):
+        if getattr(self, '_n_buf', 0) == 0: return
+        self.losses += list(self._loss_buf[:self._n_buf].to('cpu', copy=True))
+        self._n_buf = 0
 
     def before_epoch(self):
         "Set timer if `self.add_time=True`"
@@ -580,12 +810,15 @@ class Recorder(Callback):
 
     def after_epoch(self):
         "Store and log the loss/metric values"
+        self._flush_losses()
         self.learn.final_record = self.log[1:].copy()
         self.values.append(self.learn.final_record)
         if self.add_time: self.log.append(format_time(time.time() - self.start_epoch))
         self.logger(self.log)
         self.iters.append(self.smooth_loss.count)
 
+    def after_fit(self): self._flush_losses()
+
     @property
     def _train_mets(self):
         if getattr(self, 'cancel_train', False): return L()
@@ -619,6 +852,7 @@ class Recorder(Callback):
 # %% ../nbs/13a_learner.ipynb 136
 add_docs(Recorder,
          before_train = "Reset loss and metrics state",
+         after_fit = "Move the smooth losses still in the device buffer to `self.losses`",
          after_train = "Log loss and metric values on the training set (if `self.training_metrics=True`)",
          before_validate = "Reset loss and metrics state",
          after_validate = "Log loss and metric values on the validation set",
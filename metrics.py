@@ -352,26 +352,32 @@ class Dice(Metric):
 class DiceMulti(Metric):
     "Averaged Dice metric (Macro F1) for multiclass target in segmentation"
     def __init__(self, axis=1): self.axis = axis
-    def reset(self): self.inter,self.union = {},{}
+    def reset(self): self.inter,self.union = None,None
     def accumulate(self, learn):
+        n = learn.pred.shape[self.axis]
         pred,targ = flatten_check(learn.pred.argmax(dim=self.axis), learn.y)
-        for c in range(learn.pred.shape[self.axis]):
-            p = torch.where(pred == c, 1, 0)
-            t = torch.where(targ == c, 1, 0)
-            c_inter = (p*t).float().sum().item()
-            c_union = (p+t).float().sum().item()
-            if c in self.inter:
-                self.inter[c] += c_inter
-                self.union[c] += c_union
-            else:
-                self.inter[c] = c_inter
-                self.union[c] = c_union
+        pred,targ = pred.as_subclass(Tensor).long(),targ.as_subclass(Tensor).long()
+        # Targets outside of `range(n)` (like ignore indices) are counted in no class
+        valid = (targ >= 0) & (targ < n)
+        targ = torch.where(valid, targ, 0)
+        # `scatter_add_` over all classes at once, unlike `bincount` it doesn't sync with the host
+        counts = pred.new_zeros(3, n)
+        counts[0].scatter_add_(0, pred, ((pred == targ) & valid).long())
+        counts[1].scatter_add_(0, pred, torch.ones_like(pred))
+        counts[2].scatter_add_(0, targ, valid.long())
+        if self.inter is None: self.inter,self.union = counts.new_zeros(n),counts.new_zeros(n)
+        self.inter += counts[0]
+        self.union += counts[1] + counts[2]
+
+    def _counts(self):
+        "Per class intersections and unions as float arrays"
+        if self.inter is None: return np.array([]),np.array([])
+        return to_np(self.inter).astype(float),to_np(self.union).astype(float)
 
     @property
     def value(self):
-        binary_dice_scores = np.array([])
-        for c in self.inter:
-            binary_dice_scores = np.append(binary_dice_scores, 2.*self.inter[c]/self.union[c] if self.union[c] > 0 else np.nan)
+        inter,union = self._counts()
+        binary_dice_scores = np.divide(2.*inter, union, out=np.full(len(union), np.nan), where=union > 0)
         return np.nanmean(binary_dice_scores)
 
 # %% ../nbs/13b_metrics.ipynb 119
@@ -386,9 +392,8 @@ class JaccardCoeffMulti(DiceMulti):
     "Averaged Jaccard coefficient metric (mIoU) for multiclass target in segmentation"
     @property
     def value(self):
-        binary_jaccard_scores = np.array([])
-        for c in self.inter:
-            binary_jaccard_scores = np.append(binary_jaccard_scores, self.inter[c]/(self.union[c]-self.inter[c]) if self.union[c] > 0 else np.nan)
+        inter,union = self._counts()
+        binary_jaccard_scores = np.divide(inter, union-inter, out=np.full(len(union), np.nan), where=union > 0)
         return np.nanmean(binary_jaccard_scores)
 
 # %% ../nbs/13b_metrics.ipynb 124
@@ -417,22 +422,55 @@ class CorpusBLEUMetric(Metric):
         pred_cnt,targ_cnt = Counter(pred_grams),Counter(targ_grams)
         return sum([min(c, targ_cnt[g]) for g,c in pred_cnt.items()]),len(pred_grams)
 
+    def _ngram_ids(self, preds, targs, n, keys):
+        "Ids of the `n`-grams of `preds` and `targs` (equal ids for equal n-grams), from packed `keys` if not `None`"
+        if keys is not None: return np.unique(np.concatenate([keys[0].ravel(), keys[1].ravel()]), return_inverse=True)[1]
+        # Packed keys would overflow int64: compare the n-grams themselves
+        grams = [np.lib.stride_tricks.sliding_window_view(x, n, axis=1).reshape(-1, n) for x in (preds,targs)]
+        return np.unique(np.concatenate(grams), axis=0, return_inverse=True)[1].ravel()
+
+    def get_batch_correct_ngrams(self, preds, targs):
+        "Clipped n-gram matches and n-gram counts for each row of `preds` and `targs`, for n in 1..4"
+        lo = min(preds.min(initial=0), targs.min(initial=0))
+        preds,targs = preds.astype(np.int64)-lo,targs.astype(np.int64)-lo
+        base = max(self.vocab_sz, int(max(preds.max(initial=0), targs.max(initial=0)))+1)
+        packed = base**4 < 2**63
+        bs,lp,lt = len(preds),preds.shape[1],targs.shape[1]
+        corrects,counts = np.zeros((bs,4)),np.zeros(4, dtype=np.int64)
+        kp,kt = preds,targs
+        for i in range(4):
+            n = i+1
+            if lp < n or lt < n:
+                counts[i] = max(lp-n+1, 0)*bs
+                continue
+            # Rolling keys: the key of an n-gram is the key of its (n-1)-gram prefix plus its last token times base**(n-1)
+            if packed and i > 0: kp,kt = kp[:,:-1] + preds[:,i:]*base**i,kt[:,:-1] + targs[:,i:]*base**i
+            ids = self._ngram_ids(preds, targs, n, (kp,kt) if packed else None)
+            n_ids,mp = ids.max()+1,lp-n+1
+            rows = np.concatenate([np.repeat(np.arange(bs), mp), np.repeat(np.arange(bs), lt-n+1)])
+            sent_ids = rows*n_ids + ids
+            p_ids,p_cnt = np.unique(sent_ids[:bs*mp], return_counts=True)
+            t_ids,t_cnt = np.unique(sent_ids[bs*mp:], return_counts=True)
+            common,ip,it = np.intersect1d(p_ids, t_ids, assume_unique=True, return_indices=True)
+            corrects[:,i] = np.bincount(common//n_ids, weights=np.minimum(p_cnt[ip], t_cnt[it]), minlength=bs)
+            counts[i] = mp*bs
+        return corrects,counts
+
     def accumulate(self, learn):
         if learn.training: return None
         else:
-            last_output = learn.pred.argmax(dim=self.axis)
-            last_target = learn.y
-            for pred,targ in zip(last_output.cpu().numpy(),last_target.cpu().numpy()):
-                self.pred_len += len(pred)
-                self.targ_len += len(targ)
-                smooth_mteval = 1
-                for i in range(4):
-                    c,t = self.get_correct_ngrams(pred, targ, i+1, max_n=self.vocab_sz)
-                    if c == 0:
-                        smooth_mteval *= 2
-                        c = 1 / smooth_mteval    # exp smoothing, method 3 from http://acl2014.org/acl2014/W14-33/pdf/W14-3346.pdf
-                    self.corrects[i] += c
-                    self.counts[i]   += t
+            last_output = learn.pred.argmax(dim=self.axis).cpu().numpy()
+            last_target = learn.y.cpu().numpy()
+            self.pred_len += last_output.shape[1]*len(last_output)
+            self.targ_len += last_target.shape[1]*len(last_target)
+            corrects,counts = self.get_batch_correct_ngrams(last_output, last_target)
+            # exp smoothing, method 3 from http://acl2014.org/acl2014/W14-33/pdf/W14-3346.pdf
+            # Each zero count of a sentence is replaced by 1/2**k, k being its number of zero counts up to that n
+            zero = corrects == 0
+            corrects = np.where(zero, 1/2.**np.cumsum(zero, axis=1), corrects)
+            for i in range(4):
+                self.corrects[i] += corrects[:,i].sum().item()
+                self.counts[i]   += counts[i].item()
 
     @property
     def value(self):
@@ -459,7 +497,7 @@ class LossMetric(AvgMetric):
     def __init__(self, attr, nm=None): store_attr('attr,nm')
     def accumulate(self, learn):
         bs = find_bs(learn.yb)
-        self.total += learn.to_detach(getattr(learn.loss_func, self.attr, 0))*bs
+        self.total += learn.to_detach(getattr(learn.loss_func, self.attr, 0), cpu=not self.on_device)*bs
         self.count += bs
 
     @property
@@ -0,0 +1,52 @@
+"""Benchmark the vectorized `DiceMulti` accumulation against a per-class loop"""
+
+from __future__ import annotations
+from .torch_basics import *
+from .metrics import *
+
+__all__ = ['benchmark_dice_multi']
+
+def _loop_dice_counts(pred, targ, n_classes):
+    "Per-class intersections and unions with one pair of masks and two host syncs per class"
+    inter,union = {},{}
+    pred,targ = flatten_check(pred.argmax(dim=1), targ)
+    for c in range(n_classes):
+        p = torch.where(pred == c, 1, 0)
+        t = torch.where(targ == c, 1, 0)
+        inter[c] = (p*t).float().sum().item()
+        union[c] = (p+t).float().sum().item()
+    return inter,union
+
+def _timeit(f, n_iters, device):
+    f()
+    if device.type=='cuda': torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(n_iters): f()
+    if device.type=='cuda': torch.cuda.synchronize()
+    return (time.perf_counter()-start)/n_iters
+
+def benchmark_dice_multi(
+    n_classes:list=(2,8,32,128), # Class counts to benchmark
+    bs:int=4, # Batch size
+    size:int=128, # Height and width of the masks
+    n_iters:int=5, # Number of timed accumulations
+    device=None # Defaults to `default_device()`
+) -> pd.DataFrame:
+    "Time one `DiceMulti.accumulate` against the per-class loop for each of `n_classes`, checking both agree"
+    device = torch.device(ifnone(device, default_device()))
+    res = []
+    for n in n_classes:
+        pred = torch.randn(bs, n, size, size, device=device)
+        targ = torch.randint(0, n, (bs, size, size), device=device)
+        learn = SimpleNamespace(pred=pred, y=targ)
+        metric = DiceMulti()
+        def _vec(): metric.reset(); metric.accumulate(learn)
+        t_loop = _timeit(partial(_loop_dice_counts, pred, targ, n), n_iters, device)
+        t_vec = _timeit(_vec, n_iters, device)
+        inter,union = _loop_dice_counts(pred, targ, n)
+        match = (np.array(list(inter.values())) == to_np(metric.inter)).all() and \
+                (np.array(list(union.values())) == to_np(metric.union)).all()
+        res.append(dict(n_classes=n, loop_ms=t_loop*1e3, vectorized_ms=t_vec*1e3, speedup=t_loop/t_vec, match=match))
+    return pd.DataFrame(res)
+
+if __name__ == '__main__': print(benchmark_dice_multi())
@@ -9,8 +9,11 @@ from .torch_basics import *
 # %% auto 0
 __all__ = ['pytorch_hp_map', 'Optimizer', 'sgd_step', 'weight_decay', 'l2_reg', 'average_grad', 'average_sqr_grad',
            'momentum_step', 'SGD', 'rms_prop_step', 'RMSProp', 'step_stat', 'debias', 'adam_step', 'Adam', 'radam_step',
-           'RAdam', 'qhadam_step', 'QHAdam', 'larc_layer_lr', 'larc_step', 'Larc', 'lamb_step', 'Lamb', 'Lookahead',
-           'ranger', 'detuplify_pg', 'set_item_pg', 'OptimWrapper']
+           'RAdam', 'qhadam_step', 'QHAdam', 'larc_layer_lr', 'larc_step', 'Larc', 'lamb_step', 'Lamb',
+           'foreach_sgd_step', 'foreach_weight_decay', 'foreach_l2_reg', 'foreach_average_grad',
+           'foreach_average_sqr_grad', 'foreach_momentum_step', 'foreach_rms_prop_step', 'foreach_step_stat',
+           'foreach_adam_step', 'foreach_radam_step', 'foreach_qhadam_step', 'foreach_larc_layer_lr', 'foreach_larc_step',
+           'foreach_lamb_step', 'Lookahead', 'ranger', 'detuplify_pg', 'set_item_pg', 'OptimWrapper']
 
 # %% ../nbs/12_optimizer.ipynb 6
 class _BaseOptimizer():
@@ -89,6 +92,7 @@ class Optimizer(_BaseOptimizer):
     def __init__(self,
         params:Tensor|Iterable, # Model parameters
         cbs:callable|MutableSequence, # `Optimizer` step callbacks
+        foreach:bool=False, # Step whole lists of parameters with `torch._foreach_*` ops
         **defaults # Hyper parameters default values
     ):
         if 'train_bn' in defaults.keys():
@@ -101,6 +105,10 @@ class Optimizer(_BaseOptimizer):
         self.hypers = L({} for _ in range_of(self.param_lists))
         self.set_hypers(**defaults)
         self.frozen_idx = 0
+        self.foreach_cbs = self.cbs.map(_foreach_cb)
+        self.foreach = foreach and all(cb is not None for cb in self.foreach_cbs)
+        if foreach and not self.foreach:
+            warn('Some `Optimizer` callbacks have no foreach version, using the per-parameter step instead')
 
     def zero_grad(self):
         for p,*_ in self.all_params(with_grad=True):
@@ -109,10 +117,23 @@ class Optimizer(_BaseOptimizer):
 
     def step(self, closure=None):
         if closure is not None: raise NotImplementedError("fastai optimizers currently do not support closure")
+        if self.foreach: return self._foreach_step()
         for p,pg,state,hyper in self.all_params(with_grad=True):
             for cb in self.cbs: state = _update(state, cb(p, **{**state, **hyper}))
             self.state[p] = state
 
+    @torch.no_grad()
+    def _foreach_step(self):
+        "Run the foreach version of `cbs` on lists of parameters sharing param group, device and dtype"
+        for pg,hyper in zip(self.param_lists, self.hypers):
+            groups = defaultdict(list)
+            for p in pg:
+                if getattr(p, 'grad', None) is not None: groups[(p.device, p.dtype, p.grad.dtype)].append(p)
+            for ps in groups.values():
+                states = [self.state[p] for p in ps]
+                data,grads = [p.data for p in ps],[p.grad.data for p in ps]
+                for cb in self.foreach_cbs: cb(data, grads, states, **hyper)
+
     def clear_state(self):
         for p,pg,state,hyper in self.all_params():
             self.state[p] = {k: state[k] for k in self._keep_on_clear if k in state}
@@ -177,13 +198,14 @@ def SGD(
     lr:float|slice, # Default learning rate
     mom:float=0., # Gradient moving average (β1) coefficient
     wd:Real=0., # Optional weight decay (true or L2)
-    decouple_wd:bool=True # Apply true weight decay or L2 regularization (SGD)
+    decouple_wd:bool=True, # Apply true weight decay or L2 regularization (SGD)
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A SGD `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     if mom != 0: cbs.append(average_grad)
     cbs.append(sgd_step if mom==0 else momentum_step)
-    return Optimizer(params, cbs, lr=lr, mom=mom, wd=wd)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, wd=wd)
 
 # %% ../nbs/12_optimizer.ipynb 70
 def rms_prop_step(p, lr, sqr_avg, eps, grad_avg=None, **kwargs):
@@ -201,13 +223,14 @@ def RMSProp(
     sqr_mom:float=0.99, # Gradient squared moving average (β2) coefficient
     eps:float=1e-8, # Added for numerical stability
     wd:Real=0., # Optional weight decay (true or L2)
-    decouple_wd:bool=True # Apply true weight decay or L2 regularization (RMSProp)
+    decouple_wd:bool=True, # Apply true weight decay or L2 regularization (RMSProp)
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A RMSProp `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     cbs += ([average_sqr_grad] if mom==0. else [average_grad, average_sqr_grad])
     cbs.append(rms_prop_step)
-    return Optimizer(params, cbs, lr=lr, mom=mom, sqr_mom=sqr_mom, wd=wd)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, sqr_mom=sqr_mom, wd=wd)
 
 # %% ../nbs/12_optimizer.ipynb 76
 def step_stat(p, step=0, **kwargs):
@@ -236,12 +259,13 @@ def Adam(
     sqr_mom:float=0.99, # Gradient squared moving average (β2) coefficient
     eps:float=1e-5, # Added for numerical stability
     wd:Real=0.01, # Optional weight decay (true or L2)
-    decouple_wd:bool=True # Apply true weight decay (AdamW) or L2 regularization (Adam)
+    decouple_wd:bool=True, # Apply true weight decay (AdamW) or L2 regularization (Adam)
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A Adam/AdamW `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     cbs += [partial(average_grad, dampening=True), average_sqr_grad, step_stat, adam_step]
-    return Optimizer(params, cbs, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd)
 
 # %% ../nbs/12_optimizer.ipynb 85
 def radam_step(p, lr, mom, step, sqr_mom, grad_avg, sqr_avg, eps, beta, **kwargs):
@@ -270,12 +294,13 @@ def RAdam(
     eps:float=1e-5, # Added for numerical stability
     wd:Real=0., # Optional weight decay (true or L2)
     beta:float=0., # Set to enable SAdam
-    decouple_wd:bool=True # Apply true weight decay (RAdamW) or L2 regularization (RAdam)
+    decouple_wd:bool=True, # Apply true weight decay (RAdamW) or L2 regularization (RAdam)
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A RAdam/RAdamW `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     cbs += [partial(average_grad, dampening=True), average_sqr_grad, step_stat, radam_step]
-    return Optimizer(params, cbs, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd, beta=beta)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd, beta=beta)
 
 # %% ../nbs/12_optimizer.ipynb 92
 def qhadam_step(p, lr, mom, sqr_mom, sqr_avg, nu_1, nu_2, step, grad_avg, eps, **kwargs):
@@ -299,11 +324,12 @@ def QHAdam(
     eps:float=1e-8, # Added for numerical stability
     wd:Real=0., # Optional weight decay (true or L2)
     decouple_wd:bool=True, # Apply true weight decay (QHAdamW) or L2 regularization (QHAdam)
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A QHAdam/QHAdamW `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     cbs += [partial(average_grad, dampening=True), partial(average_sqr_grad, dampening=True), step_stat, qhadam_step]
-    return Optimizer(params, cbs, lr=lr, nu_1=nu_1, nu_2=nu_2 ,
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, nu_1=nu_1, nu_2=nu_2 ,
                      mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd)
 
 # %% ../nbs/12_optimizer.ipynb 96
@@ -329,13 +355,14 @@ def Larc(
     trust_coeff:float=0.02, # Trust coeffiecnet for calculating layerwise LR
     eps:float=1e-8, # Added for numerical stability
     wd:Real=0., # Optional weight decay (true or L2)
-    decouple_wd:bool=True # Apply true weight decay or L2 regularization
+    decouple_wd:bool=True, # Apply true weight decay or L2 regularization
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A LARC/LARS `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     if mom!=0.: cbs.append(average_grad)
     cbs += [partial(larc_layer_lr, clip=clip), larc_step]
-    return Optimizer(params, cbs, lr=lr, mom=mom, trust_coeff=trust_coeff, eps=eps, wd=wd)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, trust_coeff=trust_coeff, eps=eps, wd=wd)
 
 # %% ../nbs/12_optimizer.ipynb 103
 def lamb_step(p, lr, mom, step, sqr_mom, grad_avg, sqr_avg, eps, **kwargs):
@@ -358,12 +385,164 @@ def Lamb(
     sqr_mom:float=0.99, # Gradient squared moving average (β2) coefficient
     eps:float=1e-5, # Added for numerical stability
     wd:Real=0., # Optional weight decay (true or L2)
-    decouple_wd:bool=True # Apply true weight decay or L2 regularization
+    decouple_wd:bool=True, # Apply true weight decay or L2 regularization
+    foreach:bool=False # Step with `torch._foreach_*` ops over lists of parameters
 ) -> Optimizer:
     "A LAMB `Optimizer`"
     cbs = [weight_decay] if decouple_wd else [l2_reg]
     cbs += [partial(average_grad, dampening=True), average_sqr_grad, step_stat, lamb_step]
-    return Optimizer(params, cbs, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd)
+    return Optimizer(params, cbs, foreach=foreach, lr=lr, mom=mom, sqr_mom=sqr_mom, eps=eps, wd=wd)
+
+def _foreach_cb(cb):
+    "The foreach version of the step callback `cb`, or `None` if it has none"
+    if isinstance(cb, partial):
+        f = _foreach_cb(cb.func)
+        return None if f is None else partial(f, *cb.args, **cb.keywords)
+    return getattr(cb, 'foreach', None)
+
+def _state_list(states, grads, k):
+    "Get `k` from each state, initializing it with zeros like the grads"
+    for s,g in zip(states, grads):
+        if s.get(k) is None: s[k] = torch.zeros_like(g)
+    return [s[k] for s in states]
+
+def _by_step(states):
+    "Indices of `states` grouped by their step count"
+    res = defaultdict(list)
+    for i,s in enumerate(states): res[s['step']].append(i)
+    return res.items()
+
+def _wd_lists(ps, grads, states):
+    "`ps` and `grads` of the parameters using weight decay"
+    idxs = [i for i,s in enumerate(states) if s.get('do_wd', True)]
+    return [ps[i] for i in idxs],[grads[i] for i in idxs]
+
+def foreach_sgd_step(ps, grads, states, lr, **kwargs):
+    "Foreach version of `sgd_step`"
+    torch._foreach_add_(ps, grads, alpha=-lr)
+
+def foreach_weight_decay(ps, grads, states, lr, wd, **kwargs):
+    "Foreach version of `weight_decay`"
+    ps,_ = _wd_lists(ps, grads, states)
+    if ps and wd!=0: torch._foreach_mul_(ps, 1 - lr*wd)
+
+def foreach_l2_reg(ps, grads, states, lr, wd, **kwargs):
+    "Foreach version of `l2_reg`"
+    ps,grads = _wd_lists(ps, grads, states)
+    if ps and wd!=0: torch._foreach_add_(grads, ps, alpha=wd)
+
+def foreach_average_grad(ps, grads, states, mom, dampening=False, **kwargs):
+    "Foreach version of `average_grad`"
+    grad_avgs = _state_list(states, grads, 'grad_avg')
+    torch._foreach_mul_(grad_avgs, mom)
+    torch._foreach_add_(grad_avgs, grads, alpha=1-mom if dampening else 1.)
+
+def foreach_average_sqr_grad(ps, grads, states, sqr_mom, dampening=True, **kwargs):
+    "Foreach version of `average_sqr_grad`"
+    sqr_avgs = _state_list(states, grads, 'sqr_avg')
+    torch._foreach_mul_(sqr_avgs, sqr_mom)
+    torch._foreach_addcmul_(sqr_avgs, grads, grads, value=1-sqr_mom if dampening else 1.)
+
+def foreach_momentum_step(ps, grads, states, lr, **kwargs):
+    "Foreach version of `momentum_step`"
+    torch._foreach_add_(ps, [s['grad_avg'] for s in states], alpha=-lr)
+
+def foreach_rms_prop_step(ps, grads, states, lr, eps, **kwargs):
+    "Foreach version of `rms_prop_step`"
+    denom = torch._foreach_sqrt([s['sqr_avg'] for s in states])
+    torch._foreach_add_(denom, eps)
+    torch._foreach_addcdiv_(ps, [s.get('grad_avg', g) for s,g in zip(states, grads)], denom, value=-lr)
+
+def foreach_step_stat(ps, grads, states, **kwargs):
+    "Foreach version of `step_stat`"
+    for s in states: s['step'] = s.get('step', 0) + 1
+
+def foreach_adam_step(ps, grads, states, lr, mom, sqr_mom, eps, **kwargs):
+    "Foreach version of `adam_step`"
+    for step,idxs in _by_step(states):
+        debias1 = debias(mom,     1-mom,     step)
+        debias2 = debias(sqr_mom, 1-sqr_mom, step)
+        denom = torch._foreach_div([states[i]['sqr_avg'] for i in idxs], debias2)
+        torch._foreach_sqrt_(denom)
+        torch._foreach_add_(denom, eps)
+        torch._foreach_addcdiv_([ps[i] for i in idxs], [states[i]['grad_avg'] for i in idxs], denom, value=-lr/debias1)
+
+def foreach_radam_step(ps, grads, states, lr, mom, sqr_mom, eps, beta, **kwargs):
+    "Foreach version of `radam_step`"
+    for step,idxs in _by_step(states):
+        debias1 = debias(mom,     1-mom,     step)
+        debias2 = debias(sqr_mom, 1-sqr_mom, step)
+        r_inf = 2/(1-sqr_mom) - 1
+        r = r_inf - 2*step*sqr_mom**step/(1-sqr_mom**step)
+        ps_,grad_avgs = [ps[i] for i in idxs],[states[i]['grad_avg'] for i in idxs]
+        if r > 5:
+            v = math.sqrt(((r-4) * (r-2) * r_inf)/((r_inf-4)*(r_inf-2)*r))
+            denom = torch._foreach_div([states[i]['sqr_avg'] for i in idxs], debias2)
+            torch._foreach_sqrt_(denom)
+            if eps: torch._foreach_add_(denom, eps)
+            if beta: denom = [F.softplus(d, beta) for d in denom]
+            torch._foreach_addcdiv_(ps_, grad_avgs, denom, value=-lr*v/debias1)
+        else: torch._foreach_add_(ps_, grad_avgs, alpha=-lr/debias1)
+
+def foreach_qhadam_step(ps, grads, states, lr, mom, sqr_mom, nu_1, nu_2, eps, **kwargs):
+    "Foreach version of `qhadam_step`"
+    for step,idxs in _by_step(states):
+        debias1 = debias(mom,     1-mom,     step)
+        debias2 = debias(sqr_mom, 1-sqr_mom, step)
+        grads_ = [grads[i] for i in idxs]
+        num = torch._foreach_mul(grads_, 1-nu_1)
+        torch._foreach_add_(num, torch._foreach_div([states[i]['grad_avg'] for i in idxs], debias1), alpha=nu_1)
+        denom = torch._foreach_mul(grads_, grads_)
+        torch._foreach_mul_(denom, 1-nu_2)
+        torch._foreach_add_(denom, torch._foreach_div([states[i]['sqr_avg'] for i in idxs], debias2), alpha=nu_2)
+        torch._foreach_sqrt_(denom)
+        torch._foreach_add_(denom, eps)
+        torch._foreach_addcdiv_([ps[i] for i in idxs], num, denom, value=-lr)
+
+def foreach_larc_layer_lr(ps, grads, states, lr, trust_coeff, wd, eps, clip=True, **kwargs):
+    "Foreach version of `larc_layer_lr`, computing the norms of the whole list without a device sync"
+    p_norm,g_norm = torch.stack(torch._foreach_norm(ps)),torch.stack(torch._foreach_norm(grads))
+    local_lr = lr*trust_coeff * (p_norm) / (g_norm + p_norm * wd + eps)
+    if clip: local_lr = local_lr.clamp(max=lr)
+    for s,l in zip(states, local_lr.unbind()): s['local_lr'] = l
+
+def foreach_larc_step(ps, grads, states, **kwargs):
+    "Foreach version of `larc_step`"
+    upd = torch._foreach_mul([s.get('grad_avg', g) for s,g in zip(states, grads)], [-s['local_lr'] for s in states])
+    torch._foreach_add_(ps, upd)
+
+def foreach_lamb_step(ps, grads, states, lr, mom, sqr_mom, eps, **kwargs):
+    "Foreach version of `lamb_step`, with a single device sync per step count"
+    for step,idxs in _by_step(states):
+        debias1 = debias(mom,     1-mom,     step)
+        debias2 = debias(sqr_mom, 1-sqr_mom, step)
+        ps_ = [ps[i] for i in idxs]
+        numels = torch.tensor([p.numel() for p in ps_], dtype=torch.float, device=ps_[0].device).sqrt()
+        r1 = torch.stack(torch._foreach_norm(ps_)).float() / numels
+        denom = torch._foreach_div([states[i]['sqr_avg'] for i in idxs], debias2)
+        torch._foreach_sqrt_(denom)
+        torch._foreach_add_(denom, eps)
+        upd = torch._foreach_div([states[i]['grad_avg'] for i in idxs], debias1)
+        torch._foreach_div_(upd, denom)
+        r2 = torch.stack(torch._foreach_norm(upd)).float() / numels
+        q = torch.where((r1 == 0) | (r2 == 0), torch.ones_like(r1), (r1/r2).clamp(max=10))
+        torch._foreach_mul_(upd, [-lr*q_ for q_ in q.tolist()])
+        torch._foreach_add_(ps_, upd)
+
+sgd_step.foreach = foreach_sgd_step
+weight_decay.foreach = foreach_weight_decay
+l2_reg.foreach = foreach_l2_reg
+average_grad.foreach = foreach_average_grad
+average_sqr_grad.foreach = foreach_average_sqr_grad
+momentum_step.foreach = foreach_momentum_step
+rms_prop_step.foreach = foreach_rms_prop_step
+step_stat.foreach = foreach_step_stat
+adam_step.foreach = foreach_adam_step
+radam_step.foreach = foreach_radam_step
+qhadam_step.foreach = foreach_qhadam_step
+larc_layer_lr.foreach = foreach_larc_layer_lr
+larc_step.foreach = foreach_larc_step
+lamb_step.foreach = foreach_lamb_step
 
 # %% ../nbs/12_optimizer.ipynb 109
 class Lookahead(Optimizer, GetAttr):
@@ -0,0 +1,45 @@
+"""Benchmark the foreach `Optimizer` step against the per-parameter step"""
+
+from __future__ import annotations
+from .torch_basics import *
+from .optimizer import *
+
+__all__ = ['benchmark_optimizers']
+
+def _params(n_tensors, size, device):
+    "`n_tensors` small parameters with random gradients"
+    ps = [nn.Parameter(torch.randn(size, device=device)) for _ in range(n_tensors)]
+    for p in ps: p.grad = torch.randn_like(p)
+    return ps
+
+def _time_steps(opt, n_steps, device):
+    opt.step()
+    if device.type=='cuda': torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(n_steps): opt.step()
+    if device.type=='cuda': torch.cuda.synchronize()
+    return (time.perf_counter()-start)/n_steps
+
+def benchmark_optimizers(
+    n_tensors:int=2000, # Number of parameter tensors
+    size:int=64, # Number of elements in each parameter
+    n_steps:int=20, # Number of timed steps
+    device=None, # Defaults to `default_device()`
+    opt_funcs:dict=None # Names and optimizer functions to compare, defaults to all foreach-able optimizers
+) -> pd.DataFrame:
+    "Time `Optimizer.step` per parameter and with `foreach=True`, and check both give the same weights"
+    device = torch.device(ifnone(device, default_device()))
+    opt_funcs = ifnone(opt_funcs, {'SGD': partial(SGD, mom=0.9, wd=1e-2), 'RMSProp': partial(RMSProp, mom=0.9),
+                                   'Adam': Adam, 'RAdam': RAdam, 'QHAdam': QHAdam, 'Larc': Larc, 'Lamb': Lamb})
+    res = []
+    for name,opt_func in opt_funcs.items():
+        ps1 = _params(n_tensors, size, device)
+        ps2 = [nn.Parameter(p.detach().clone()) for p in ps1]
+        for p1,p2 in zip(ps1,ps2): p2.grad = p1.grad.clone()
+        t1 = _time_steps(opt_func(ps1, lr=1e-3), n_steps, device)
+        t2 = _time_steps(opt_func(ps2, lr=1e-3, foreach=True), n_steps, device)
+        err = max((p1-p2).abs().max().item() for p1,p2 in zip(ps1,ps2))
+        res.append(dict(optimizer=name, per_param_ms=t1*1e3, foreach_ms=t2*1e3, speedup=t1/t2, max_abs_diff=err))
+    return pd.DataFrame(res)
+
+if __name__ == '__main__': print(benchmark_optimizers())
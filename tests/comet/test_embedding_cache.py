@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from comet.models.embedding_cache import (
+    DiskEmbeddingStore,
+    SentenceEmbeddingCache,
+    parse_cache_size,
+    sentence_digest,
+    sentence_keys,
+)
+
+
+class TestParseCacheSize(unittest.TestCase):
+    def test_entries_and_bytes(self):
+        self.assertEqual(parse_cache_size(1024), (1024, None))
+        self.assertEqual(parse_cache_size("1024"), (1024, None))
+        self.assertEqual(parse_cache_size("2KB"), (None, 2048))
+        self.assertEqual(parse_cache_size("1.5 GiB"), (None, int(1.5 * 1024**3)))
+        with self.assertRaises(ValueError):
+            parse_cache_size("12 parsecs")
+
+
+class TestSentenceKeys(unittest.TestCase):
+    def test_padding_is_ignored(self):
+        input_ids = torch.tensor(
+            [[0, 7, 8, 2, 1, 1], [0, 7, 8, 2, 1, 1], [0, 7, 2, 1, 1, 1]]
+        )
+        mask = (input_ids != 1).long()
+        keys = sentence_keys(input_ids, mask)
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        # Same sentence padded to a longer batch gives the same key.
+        longer = torch.tensor([[0, 7, 8, 2, 1, 1, 1, 1]])
+        self.assertEqual(sentence_keys(longer, (longer != 1).long())[0], keys[0])
+
+    def test_token_type_ids_are_part_of_the_key(self):
+        input_ids = torch.tensor([[0, 7, 8, 2], [0, 7, 8, 2]])
+        mask = torch.ones_like(input_ids)
+        token_type_ids = torch.tensor([[0, 0, 1, 1], [0, 1, 1, 1]])
+        keys = sentence_keys(input_ids, mask, token_type_ids)
+        self.assertNotEqual(keys[0], keys[1])
+
+
+class TestSentenceEmbeddingCache(unittest.TestCase):
+    def keys(self, n):
+        return sentence_keys(torch.arange(n).unsqueeze(1), torch.ones(n, 1))
+
+    def test_lru_eviction_by_entries(self):
+        cache = SentenceEmbeddingCache(max_entries=2)
+        k = self.keys(3)
+        cache.put(k[0], torch.zeros(4))
+        cache.put(k[1], torch.ones(4))
+        self.assertIsNotNone(cache.get(k[0]))  # k[1] is now least recently used
+        cache.put(k[2], torch.ones(4))
+        self.assertIsNone(cache.get(k[1]))
+        self.assertIsNotNone(cache.get(k[0]))
+        self.assertEqual(cache.cache_info().hits, 2)
+        self.assertEqual(cache.cache_info().misses, 1)
+
+    def test_lru_eviction_by_bytes(self):
+        cache = SentenceEmbeddingCache(max_bytes=3 * 16)
+        k = self.keys(5)
+        for key in k[:4]:
+            cache.put(key, torch.zeros(4))  # 16 bytes each
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3 * 16)
+        self.assertIsNone(cache.get(k[0]))
+        # Entries bigger than the whole budget are not stored.
+        cache.put(k[4], torch.zeros(100))
+        self.assertNotIn(k[4], cache)
+
+    def test_batched_inserts_respect_the_memory_budget(self):
+        batch_size, hidden = 64, 256
+        max_bytes = 10 * hidden * 4
+        cache = SentenceEmbeddingCache(max_bytes=max_bytes)
+        k = self.keys(batch_size)
+        computed = torch.randn(batch_size, hidden)
+        for key, embedding in zip(k, computed):
+            cache.put(key, embedding)
+
+        self.assertLessEqual(cache.nbytes, max_bytes)
+        stored = list(cache._store.values())
+        pinned = sum(e.untyped_storage().nbytes() for e in stored)
+        self.assertEqual(pinned, cache.nbytes)
+        self.assertTrue(torch.equal(cache.get(k[-1]), computed[-1]))
+
+    def test_cache_clear(self):
+        cache = SentenceEmbeddingCache()
+        key = self.keys(1)[0]
+        cache.put(key, torch.zeros(4))
+        cache.get(key)
+        cache.cache_clear()
+        self.assertEqual(tuple(cache.cache_info()), (0, 0, 0, 0, None))
+
+
+class TestDiskEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def store(self, **kwargs):
+        return DiskEmbeddingStore(self.tmp.name, "model-layer", hidden_size=8, **kwargs)
+
+    def digests(self, n):
+        keys = sentence_keys(torch.arange(n).unsqueeze(1), torch.ones(n, 1))
+        return [sentence_digest(key) for key in keys]
+
+    def test_put_and_get(self):
+        store = self.store()
+        digests = self.digests(3)
+        embeddings = torch.randn(2, 8)
+        store.put(digests[:2], embeddings)
+        found = store.get([digests[1], digests[2], digests[0]])
+        self.assertTrue(torch.equal(found[0], embeddings[1]))
+        self.assertIsNone(found[1])
+        self.assertTrue(torch.equal(found[2], embeddings[0]))
+
+    def test_duplicates_are_not_appended(self):
+        store = self.store()
+        digests = self.digests(2)
+        store.put(digests, torch.randn(2, 8))
+        nbytes = store.nbytes
+        store.put(digests, torch.randn(2, 8))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.nbytes, nbytes)
+
+    def test_store_is_shared_across_instances(self):
+        writer, reader = self.store(), self.store(read_only=True)
+        digests = self.digests(4)
+        embeddings = torch.randn(4, 8)
+        writer.put(digests[:2], embeddings[:2])
+        self.assertTrue(torch.equal(reader.get(digests[:1])[0], embeddings[0]))
+        # Records appended after the reader mapped the file are picked up lazily.
+        writer.put(digests[2:], embeddings[2:])
+        self.assertTrue(torch.equal(reader.get(digests[3:])[0], embeddings[3]))
+        # Read-only stores never write.
+        reader.put(self.digests(5)[4:], torch.randn(1, 8))
+        self.assertEqual(len(self.store()), 4)
+
+    def test_compaction_keeps_recently_used_records(self):
+        record_size = 16 + 8 * 4
+        store = self.store(max_bytes=4 * record_size)
+        digests = self.digests(5)
+        store.put(digests[:4], torch.randn(4, 8))
+        time.sleep(0.01)
+        store.get(digests[:1])
+        store.put(digests[4:], torch.randn(1, 8))  # goes over the cap
+        self.assertEqual(len(store), 3)
+        self.assertLessEqual(store.nbytes, store.max_bytes)
+        found = store.get(digests)
+        self.assertIsNotNone(found[0])
+        self.assertIsNotNone(found[4])
+        self.assertEqual(sum(e is None for e in found), 2)
+        self.assertFalse(any(f.endswith(".tmp") for f in os.listdir(store.folder)))
+
+    def test_stale_rows_are_not_touched(self):
+        record_size = 16 + 8 * 4
+        stale, other = self.store(), self.store(max_bytes=3 * record_size)
+        digests = self.digests(4)
+        stale.put(digests, torch.randn(4, 8))
+        # Another process drops the first two records: the last ones move up.
+        time.sleep(0.01)
+        other.get(digests[2:])
+        other.compact()
+        self.assertEqual(len(other), 2)
+        atime = np.fromfile(os.path.join(other.folder, "atime.bin"), dtype="<f8")
+        # Rows 0 and 1 of the stale index now hold other records.
+        stale.get(digests[:2])
+        after = np.fromfile(os.path.join(other.folder, "atime.bin"), dtype="<f8")
+        self.assertTrue(np.array_equal(after, atime))
+        # Once refreshed, access times are updated again.
+        time.sleep(0.01)
+        fresh = self.store()
+        fresh.get(digests[3:])
+        after = np.fromfile(os.path.join(other.folder, "atime.bin"), dtype="<f8")
+        self.assertGreater(after[1], atime[1])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+
+import torch
+
+from comet.models import InferenceEngine
+from comet.models.inference_engine import StageTimer
+from tiny_metric import TinyMetric, samples, save_tiny_bert
+
+
+class TestInferenceEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        cls.model = TinyMetric(save_tiny_bert(cls.tmp.name))
+        cls.data = samples(10)
+        cls.expected = cls.model.predict(
+            cls.data, batch_size=4, gpus=0, progress_bar=False
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def assertScoresEqual(self, scores, expected):
+        self.assertEqual(len(scores), len(expected))
+        for a, b in zip(scores, expected):
+            self.assertAlmostEqual(a, b, places=5)
+
+    def test_same_scores_as_predict(self):
+        for num_workers in (1, 3):
+            engine = InferenceEngine(self.model, num_workers=num_workers)
+            try:
+                output = engine.predict(self.data, batch_size=3)
+                self.assertScoresEqual(output.scores, self.expected.scores)
+                output = engine.predict(self.data, max_tokens=30)
+                self.assertScoresEqual(output.scores, self.expected.scores)
+            finally:
+                engine.close()
+
+    def test_timings(self):
+        engine = InferenceEngine(self.model)
+        try:
+            engine.predict(self.data)
+        finally:
+            engine.close()
+        for stage in ("tokenization", "encoding", "pooling", "estimation", "total"):
+            self.assertIn(stage, engine.timings)
+            self.assertGreaterEqual(engine.timings[stage], 0.0)
+
+    def test_close_restores_process_settings(self):
+        num_threads = torch.get_num_threads()
+        timer = StageTimer()
+        self.model.stage_timer = timer
+        try:
+            engine = InferenceEngine(self.model, num_workers=2, intra_op_threads=1)
+            self.assertEqual(torch.get_num_threads(), 1)
+            self.assertIs(self.model.stage_timer, engine.timer)
+            engine.close()
+            self.assertEqual(torch.get_num_threads(), num_threads)
+            self.assertIs(self.model.stage_timer, timer)
+            # Closing twice is a no-op.
+            torch.set_num_threads(max(1, num_threads // 2))
+            engine.close()
+            self.assertEqual(torch.get_num_threads(), max(1, num_threads // 2))
+        finally:
+            torch.set_num_threads(num_threads)
+            self.model.stage_timer = None
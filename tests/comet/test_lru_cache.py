@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import torch
+
+from comet.models.lru_cache import TensorKey, tensor_lru_cache
+
+
+class TestTensorKey(unittest.TestCase):
+    def test_equal_content_gives_equal_keys(self):
+        a = torch.tensor([0, 581, 20, 2])
+        self.assertEqual(TensorKey(a), TensorKey(a.clone()))
+        self.assertEqual(hash(TensorKey(a)), hash(TensorKey(a.clone())))
+
+    def test_dtype_and_shape_are_part_of_the_key(self):
+        a = torch.arange(6)
+        self.assertNotEqual(TensorKey(a), TensorKey(a.int()))
+        self.assertNotEqual(TensorKey(a), TensorKey(a.view(2, 3)))
+        self.assertNotEqual(TensorKey(a), TensorKey(a + 1))
+
+    def test_non_contiguous_tensor(self):
+        a = torch.arange(12).view(3, 4)
+        self.assertEqual(TensorKey(a.t()), TensorKey(a.t().contiguous()))
+
+    def test_usable_as_dict_key(self):
+        cache = {TensorKey(torch.tensor([1, 2, 3])): "x"}
+        self.assertIn(TensorKey(torch.tensor([1, 2, 3])), cache)
+        self.assertNotIn(TensorKey(torch.tensor([1, 2, 4])), cache)
+
+
+class TestTensorLRUCache(unittest.TestCase):
+    def test_tensor_arguments_hit_the_cache(self):
+        calls = []
+
+        @tensor_lru_cache(maxsize=2)
+        def f(x):
+            calls.append(x)
+            return x.sum()
+
+        f(torch.tensor([1, 2]))
+        f(torch.tensor([1, 2]))
+        f(torch.tensor([3, 4]))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(f.cache_info().hits, 1)
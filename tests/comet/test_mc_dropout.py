@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+
+import torch
+
+from comet.models.pooling_utils import masked_average_pooling
+from comet.models.utils import Prediction
+from tiny_metric import TinyMetric, samples, save_tiny_bert
+
+
+class DirectEncoderMetric(TinyMetric):
+    """Calls the encoder directly instead of going through `get_sentence_embedding`."""
+
+    def embed(self, input_ids, attention_mask):
+        out = self.encoder(input_ids, attention_mask)
+        return masked_average_pooling(input_ids, out["wordemb"], attention_mask, 0)
+
+    def forward(
+        self, src_input_ids, src_attention_mask, mt_input_ids, mt_attention_mask
+    ) -> Prediction:
+        src = self.embed(src_input_ids, src_attention_mask)
+        mt = self.embed(mt_input_ids, mt_attention_mask)
+        features = torch.cat([src, mt, src * mt], dim=1)
+        return Prediction(score=self.estimator(features).view(-1))
+
+
+class TestBatchedMCDropout(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        save_tiny_bert(cls.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def run_mcd(self, model, n_batches=2, batch_size=4, mc_dropout=3):
+        """Batched MCD predict steps recording the rows of every encoder pass."""
+        rows = []
+        hook = model.encoder.register_forward_hook(
+            lambda module, args, output: rows.append(args[0].size(0))
+        )
+        model.set_mc_dropout(mc_dropout, batched=True)
+        model.on_predict_start()
+        data = samples(n_batches * batch_size)
+        outputs = []
+        try:
+            with torch.no_grad():
+                for i in range(0, len(data), batch_size):
+                    batch = model.prepare_sample(data[i : i + batch_size], "predict")
+                    outputs.append(model.predict_step(batch))
+        finally:
+            hook.remove()
+        return outputs, rows
+
+    def assertMCDOutputs(self, outputs, batch_size):
+        for output in outputs:
+            self.assertEqual(output.scores.shape, (batch_size,))
+            self.assertEqual(output.metadata.mcd_scores.shape, (batch_size,))
+            self.assertEqual(output.metadata.mcd_std.shape, (batch_size,))
+            self.assertTrue((output.metadata.mcd_std > 0).all())
+
+    def test_encoder_runs_once_per_segment(self):
+        model = TinyMetric(self.tmp.name)
+        outputs, rows = self.run_mcd(model)
+        self.assertMCDOutputs(outputs, 4)
+        # src and mt are encoded once per batch, without the stacked copies.
+        self.assertEqual(rows, [4, 4, 4, 4])
+        self.assertTrue(model._mcd_shares_encoder)
+
+    def test_falls_back_for_models_calling_the_encoder(self):
+        model = DirectEncoderMetric(self.tmp.name)
+        with self.assertLogs("comet.models.base", level="WARNING"):
+            outputs, rows = self.run_mcd(model)
+        self.assertMCDOutputs(outputs, 4)
+        self.assertFalse(model._mcd_shares_encoder)
+        # First batch: stacked encoder passes. Then 1 + mc_dropout sequential runs.
+        self.assertEqual(rows, [16, 16] + [4] * 8)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import torch
+
+from comet.models.pooling_utils import (
+    average_pooling,
+    masked_average_pooling,
+    masked_max_pooling,
+    max_pooling,
+    scripted,
+)
+
+PAD = 1
+
+
+def padded_batch(dtype=torch.float32, batch_size=4, seq_length=7, hidden_size=8):
+    torch.manual_seed(0)
+    embeddings = torch.randn(batch_size, seq_length, hidden_size).to(dtype)
+    lengths = torch.tensor([7, 1, 4, 6])
+    mask = torch.arange(seq_length)[None, :] < lengths[:, None]
+    tokens = torch.where(mask, torch.randint(5, 50, mask.shape), PAD)
+    return tokens, embeddings, mask.long()
+
+
+class TestPooling(unittest.TestCase):
+    def test_masked_average_pooling(self):
+        tokens, embeddings, mask = padded_batch()
+        expected = average_pooling(tokens, embeddings, mask, PAD)
+        for fn in (masked_average_pooling, scripted(masked_average_pooling)):
+            output = fn(tokens, embeddings, mask, PAD)
+            self.assertTrue(torch.allclose(output, expected, atol=1e-6))
+        # Padded positions do not contribute.
+        self.assertTrue(torch.allclose(output[1], embeddings[1, 0], atol=1e-6))
+
+    def test_masked_max_pooling(self):
+        for dtype in (torch.float32, torch.bfloat16):
+            tokens, embeddings, _ = padded_batch(dtype)
+            expected = max_pooling(tokens, embeddings.clone(), PAD)
+            for fn in (masked_max_pooling, scripted(masked_max_pooling)):
+                output = fn(tokens, embeddings.clone(), PAD)
+                self.assertEqual(output.dtype, dtype)
+                self.assertTrue(torch.equal(output, expected))
+            self.assertTrue(torch.equal(output[1], embeddings[1, 0]))
+
+    def test_reduced_precision_embeddings_are_not_modified(self):
+        tokens, embeddings, _ = padded_batch(torch.bfloat16)
+        original = embeddings.clone()
+        masked_max_pooling(tokens, embeddings, PAD)
+        self.assertTrue(torch.equal(embeddings, original))
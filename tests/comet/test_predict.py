@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+
+import torch
+
+from tiny_metric import TinyMetric, samples, save_tiny_bert
+
+
+class TestPredict(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        cls.model = TinyMetric(save_tiny_bert(cls.tmp.name))
+        cls.data = samples(12)
+        cls.expected = cls.model.predict(
+            cls.data, batch_size=4, gpus=0, progress_bar=False, length_batching=False
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_token_lengths(self):
+        lengths = self.model.token_lengths(self.data[:2])
+        # [CLS] + words + [SEP] for both src and mt.
+        self.assertEqual(lengths, [2 + 3 + 2 + 2, 2 + 2 + 2 + 4])
+
+    def test_max_tokens_keeps_sample_order(self):
+        output = self.model.predict(
+            self.data, max_tokens=40, gpus=0, progress_bar=False
+        )
+        self.assertEqual(len(output.scores), len(self.data))
+        for a, b in zip(output.scores, self.expected.scores):
+            self.assertAlmostEqual(a, b, places=5)
+        self.assertAlmostEqual(
+            output.system_score, self.expected.system_score, places=5
+        )
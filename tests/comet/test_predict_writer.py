@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import torch
+
+from comet.models.predict_writer import CustomWriter
+from comet.models.utils import Prediction
+
+
+def rank_outputs(scores, indices):
+    """Batch predictions and indices of one rank as Lightning hands them over."""
+    predictions = [
+        Prediction(
+            scores=torch.tensor(s), metadata=Prediction(mcd_std=torch.tensor(s) / 10)
+        )
+        for s in scores
+    ]
+    return [predictions], [indices]
+
+
+class TestFileBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def save_rank(self, rank, scores, indices):
+        predictions, batch_indices = rank_outputs(scores, indices)
+        torch.save(predictions, os.path.join(self.tmp.name, f"pred_{rank}.pt"))
+        torch.save(
+            batch_indices, os.path.join(self.tmp.name, f"batch_indices_{rank}.pt")
+        )
+
+    def test_gather_restores_sample_order(self):
+        self.save_rank(0, [[0.0, 2.0], [4.0]], [[0, 2], [4]])
+        self.save_rank(1, [[1.0, 3.0]], [[1, 3]])
+        writer = CustomWriter()
+        writer.output_dir = self.tmp.name
+        output = writer.gather_all_predictions()
+        self.assertEqual(output.scores, [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertAlmostEqual(output.system_score, 2.0)
+        for a, b in zip(output.metadata.mcd_std, [0.0, 0.1, 0.2, 0.3, 0.4]):
+            self.assertAlmostEqual(a, b, places=6)
+
+    def test_batch_ids_map_batch_positions_to_samples(self):
+        # Token-budget batching: each dataset item is a batch of sample ids.
+        batch_ids = [[3, 0], [1], [4, 2]]
+        self.save_rank(0, [[3.0, 0.0], [4.0, 2.0]], [[0], [2]])
+        self.save_rank(1, [[1.0]], [[1]])
+        writer = CustomWriter(batch_ids=batch_ids)
+        writer.output_dir = self.tmp.name
+        output = writer.gather_all_predictions(return_numpy=True)
+        self.assertEqual(output.scores.tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+
+
+class TestSharedMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def writer(self, **kwargs):
+        writer = CustomWriter(**kwargs)
+        writer.output_dir = self.tmp.name
+        return writer
+
+    def write(self, writer, rank, scores, indices, tags=None):
+        """Simulates the batches scored by one rank."""
+        for i, (s, ids) in enumerate(zip(scores, indices)):
+            metadata = Prediction(mcd_std=torch.tensor(s) / 4)
+            if tags is not None:
+                metadata["tags"] = tags[i]
+            prediction = Prediction(scores=torch.tensor(s), metadata=metadata)
+            writer.write_on_batch_end(None, None, prediction, ids, None, i, 0)
+        writer.write_on_epoch_end(SimpleNamespace(global_rank=rank), None, None, None)
+
+    def test_backend_selection(self):
+        self.assertEqual(CustomWriter().backend, "file")
+        self.assertEqual(CustomWriter(num_samples=4).backend, "mmap")
+        with self.assertRaises(ValueError):
+            CustomWriter(backend="mmap")
+        with self.assertRaises(ValueError):
+            CustomWriter(backend="pickle")
+
+    def test_ranks_write_in_sample_order(self):
+        # One writer per rank, sharing the same folder.
+        self.write(self.writer(num_samples=5), 0, [[0.0, 2.0], [4.0]], [[0, 2], [4]])
+        self.write(self.writer(num_samples=5), 1, [[1.0, 3.0]], [[1, 3]])
+        output = self.writer(num_samples=5).gather_all_predictions()
+        self.assertEqual(output.scores, [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertAlmostEqual(output.system_score, 2.0)
+        self.assertEqual(output.metadata.mcd_std, [0.0, 0.25, 0.5, 0.75, 1.0])
+
+    def test_object_metadata_and_batch_ids(self):
+        batch_ids = [[2, 0], [1]]
+        tags = [[["ok"], ["bad", "ok"]], [["ok", "ok"]]]
+        writer = self.writer(num_samples=3, batch_ids=batch_ids)
+        self.write(writer, 0, [[2.0, 0.0], [1.0]], [[0], [1]], tags=tags)
+        output = self.writer(num_samples=3).gather_all_predictions(return_numpy=True)
+        self.assertEqual(output.scores.tolist(), [0.0, 1.0, 2.0])
+        self.assertEqual(output.metadata.tags, [["bad", "ok"], ["ok", "ok"], ["ok"]])
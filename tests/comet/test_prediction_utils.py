@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import torch
+
+from comet.models.utils import (
+    Prediction,
+    flatten_metadata,
+    gather_predictions,
+    restore_list_order,
+    to_output,
+    token_budget_batches,
+)
+
+
+class TestTokenBudgetBatches(unittest.TestCase):
+    def test_batches_fit_the_budget(self):
+        lengths = [5, 30, 12, 7, 30, 3, 18, 9]
+        batches = token_budget_batches(lengths, max_tokens=40)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(8)))
+        for batch in batches:
+            self.assertLessEqual(len(batch) * max(lengths[i] for i in batch), 40)
+
+    def test_samples_are_sorted_by_length(self):
+        lengths = [4, 1, 3, 2]
+        batches = token_budget_batches(lengths, max_tokens=4)
+        self.assertEqual(batches, [[1, 3], [2], [0]])
+
+    def test_long_samples_get_their_own_batch(self):
+        batches = token_budget_batches([2, 100, 2], max_tokens=10)
+        self.assertEqual(batches, [[0, 2], [1]])
+
+    def test_empty(self):
+        self.assertEqual(token_budget_batches([], max_tokens=10), [])
+
+
+class TestRestoreListOrder(unittest.TestCase):
+    def test_list(self):
+        unsorted = restore_list_order(["b", "c", "a"], [1, 2, 0])
+        self.assertEqual(unsorted, ["a", "b", "c"])
+
+    def test_tensor_and_array_keep_their_type(self):
+        sort_ids = [2, 0, 1]
+        scores = torch.tensor([[2.0, 20.0], [0.0, 0.0], [1.0, 10.0]])
+        unsorted = restore_list_order(scores, sort_ids)
+        self.assertTrue(torch.equal(unsorted[:, 0], torch.tensor([0.0, 1.0, 2.0])))
+        unsorted = restore_list_order(scores.numpy(), np.array(sort_ids))
+        self.assertIsInstance(unsorted, np.ndarray)
+        self.assertEqual(unsorted[:, 0].tolist(), [0.0, 1.0, 2.0])
+
+    def test_repeated_ids(self):
+        # Samples padded by a distributed sampler appear twice.
+        unsorted = restore_list_order(torch.tensor([1.0, 0.0, 1.0]), [1, 0, 1])
+        self.assertEqual(unsorted.tolist(), [0.0, 1.0])
+
+
+class TestGatherPredictions(unittest.TestCase):
+    def predictions(self):
+        return [
+            Prediction(
+                scores=torch.tensor([0.3, 0.1]),
+                metadata=Prediction(std=torch.tensor([3.0, 1.0]), tags=[["a"], ["b"]]),
+            ),
+            Prediction(
+                scores=torch.tensor([0.2]),
+                metadata=Prediction(std=torch.tensor([2.0]), tags=[["c"]]),
+            ),
+        ]
+
+    def test_flatten_metadata(self):
+        metadata = [pred.metadata for pred in self.predictions()]
+        self.assertEqual(flatten_metadata(metadata).std, [3.0, 1.0, 2.0])
+        flat = flatten_metadata(metadata, to_list=False)
+        self.assertTrue(torch.equal(flat.std, torch.tensor([3.0, 1.0, 2.0])))
+        self.assertEqual(flat.tags, [["a"], ["b"], ["c"]])
+
+    def test_to_output(self):
+        self.assertEqual(to_output(torch.tensor([1.0, 2.0])), [1.0, 2.0])
+        self.assertIsInstance(to_output(torch.tensor([1.0]), True), np.ndarray)
+        self.assertEqual(to_output(np.array([1.0])), [1.0])
+        self.assertEqual(to_output(["a"], True), ["a"])
+
+    def test_gather_restores_order(self):
+        output = gather_predictions(self.predictions(), sort_ids=[2, 0, 1])
+        self.assertEqual(len(output.scores), 3)
+        for a, b in zip(output.scores, [0.1, 0.2, 0.3]):
+            self.assertAlmostEqual(a, b, places=6)
+        self.assertAlmostEqual(output.system_score, 0.2, places=6)
+        self.assertEqual(output.metadata.std, [1.0, 2.0, 3.0])
+        self.assertEqual(output.metadata.tags, [["b"], ["c"], ["a"]])
+
+    def test_gather_numpy(self):
+        output = gather_predictions(self.predictions(), return_numpy=True)
+        self.assertIsInstance(output.scores, np.ndarray)
+        self.assertEqual(output.metadata.std.tolist(), [3.0, 1.0, 2.0])
+        self.assertEqual(output.metadata.tags, [["a"], ["b"], ["c"]])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import scipy.stats as stats
+import torch
+
+from comet.models.metrics import (
+    RegressionMetrics,
+    StreamingRegressionMetrics,
+    average_ranks,
+    count_inversions,
+    kendall_tau,
+    pearson_corrcoef,
+    spearman_corrcoef,
+)
+
+
+def scores(n, ties=False):
+    torch.manual_seed(n)
+    x = torch.randn(n)
+    y = x + torch.randn(n)
+    if ties:
+        x, y = x.round(decimals=1), (y * 2).round() / 2
+    return x, y
+
+
+class TestCorrelations(unittest.TestCase):
+    def test_count_inversions(self):
+        self.assertEqual(count_inversions(torch.tensor([3, 2, 1, 0])), 6)
+        for n in (1, 2, 7, 64, 150):
+            y = torch.randint(0, 10, (n,)).tolist()
+            expected = sum(y[i] > y[j] for i in range(n) for j in range(i + 1, n))
+            self.assertEqual(count_inversions(torch.tensor(y)), expected)
+
+    def test_average_ranks(self):
+        ranks = average_ranks(torch.tensor([10.0, 30.0, 20.0, 30.0]))
+        self.assertEqual(ranks.tolist(), [1.0, 3.5, 2.0, 3.5])
+
+    def test_match_scipy(self):
+        for n, ties in ((10, False), (500, False), (500, True)):
+            x, y = scores(n, ties)
+            self.assertAlmostEqual(
+                kendall_tau(x, y).item(), stats.kendalltau(x, y)[0], places=10
+            )
+            self.assertAlmostEqual(
+                spearman_corrcoef(x, y).item(), stats.spearmanr(x, y)[0], places=10
+            )
+            self.assertAlmostEqual(
+                pearson_corrcoef(x, y).item(), stats.pearsonr(x, y)[0], places=6
+            )
+
+    def test_constant_input(self):
+        self.assertTrue(kendall_tau(torch.ones(5), torch.arange(5.0)).isnan())
+
+
+class TestRegressionMetrics(unittest.TestCase):
+    def test_torch_backend_matches_scipy(self):
+        x, y = scores(300, ties=True)
+        results = []
+        for backend in ("scipy", "torch"):
+            metric = RegressionMetrics(prefix="val", backend=backend)
+            metric.update(x[:100], y[:100])
+            metric.update(x[100:], y[100:])
+            results.append(metric.compute())
+        for k in ("val_kendall", "val_spearman", "val_pearson"):
+            self.assertAlmostEqual(results[0][k], results[1][k], places=6)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            RegressionMetrics(backend="numpy")
+
+
+class TestStreamingRegressionMetrics(unittest.TestCase):
+    def test_exact_when_the_sample_holds_everything(self):
+        x, y = scores(200, ties=True)
+        metric = StreamingRegressionMetrics(prefix="val", sample_size=256)
+        for i in range(0, 200, 32):
+            metric.update(x[i : i + 32], y[i : i + 32])
+        output = metric.compute()
+        self.assertAlmostEqual(output["val_kendall"], stats.kendalltau(x, y)[0])
+        self.assertAlmostEqual(output["val_spearman"], stats.spearmanr(x, y)[0])
+        self.assertAlmostEqual(
+            output["val_pearson"], stats.pearsonr(x, y)[0], places=5
+        )
+
+    def test_bounded_sample(self):
+        x, y = scores(5000)
+        metric = StreamingRegressionMetrics(prefix="val", sample_size=1000)
+        for i in range(0, 5000, 500):
+            metric.update(x[i : i + 500], y[i : i + 500])
+        self.assertEqual(metric.sample.shape, (1000, 3))
+        output = metric.compute()
+        # Pearson is exact, rank correlations are estimated from the sample.
+        self.assertAlmostEqual(
+            output["val_pearson"], stats.pearsonr(x, y)[0], places=5
+        )
+        self.assertAlmostEqual(
+            output["val_kendall"], stats.kendalltau(x, y)[0], delta=0.05
+        )
+        self.assertAlmostEqual(
+            output["val_spearman"], stats.spearmanr(x, y)[0], delta=0.05
+        )
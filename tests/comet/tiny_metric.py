@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Small randomly initialized COMET model built from a local BERT config, so model
+tests run without downloading checkpoints.
+"""
+import os
+import string
+
+import torch
+from torch import nn
+from transformers import BertConfig, BertTokenizerFast
+
+from comet.models.base import CometModel
+from comet.models.utils import Prediction
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(string.ascii_lowercase)
+
+
+def save_tiny_bert(path: str) -> str:
+    """Writes the config and tokenizer of a 2 layer BERT with 16 hidden units."""
+    os.makedirs(path, exist_ok=True)
+    vocab_file = os.path.join(path, "vocab.txt")
+    with open(vocab_file, "w") as fh:
+        fh.write("\n".join(VOCAB))
+    BertTokenizerFast(vocab_file).save_pretrained(path)
+    BertConfig(
+        vocab_size=len(VOCAB),
+        hidden_size=16,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=32,
+        max_position_embeddings=64,
+    ).save_pretrained(path)
+    return path
+
+
+class TinyMetric(CometModel):
+    """Reference-free metric: [src; mt; src * mt] embeddings into a feed-forward."""
+
+    def __init__(self, pretrained_model: str, **kwargs) -> None:
+        super().__init__(
+            encoder_model="BERT",
+            pretrained_model=pretrained_model,
+            load_pretrained_weights=False,
+            nr_frozen_epochs=0,
+            **kwargs
+        )
+        self.estimator = nn.Sequential(
+            nn.Linear(3 * self.encoder.output_units, 8),
+            nn.Tanh(),
+            nn.Dropout(0.5),
+            nn.Linear(8, 1),
+        )
+
+    def read_training_data(self, path=None):
+        return []
+
+    def read_validation_data(self, path=None):
+        return []
+
+    def prepare_sample(self, sample, stage="fit", *args, **kwargs):
+        inputs = {}
+        for segment in ("src", "mt"):
+            tokens = self.encoder.prepare_sample([s[segment] for s in sample])
+            inputs[segment + "_input_ids"] = tokens["input_ids"]
+            inputs[segment + "_attention_mask"] = tokens["attention_mask"]
+        return inputs
+
+    def configure_optimizers(self):
+        return torch.optim.Adam(self.parameters())
+
+    def init_metrics(self) -> None:
+        pass
+
+    def requires_references(self) -> bool:
+        return False
+
+    def forward(
+        self, src_input_ids, src_attention_mask, mt_input_ids, mt_attention_mask
+    ) -> Prediction:
+        src = self.get_sentence_embedding(src_input_ids, src_attention_mask)
+        mt = self.get_sentence_embedding(mt_input_ids, mt_attention_mask)
+        features = torch.cat([src, mt, src * mt], dim=1)
+        return Prediction(score=self.estimator(features).view(-1))
+
+
+def samples(n: int = 12):
+    """`n` samples with sentences of different lengths (and some repetitions)."""
+    words = ["a b c", "d e", "f g h i j k", "l", "m n o p", "q r s t u v w x"]
+    return [
+        {"src": words[i % len(words)], "mt": words[(3 * i + 1) % len(words)]}
+        for i in range(n)
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import torch
+from torch import nn
+
+from fastai.data.all import CategoryBlock, DataBlock, IndexSplitter, TransformBlock
+from fastai.learner import Learner
+from fastai.losses import CrossEntropyLossFlat
+from fastai.torch_core import set_seed
+
+
+def get_x(o):
+    return torch.tensor([float(o % 3), float(o % 5)])
+
+
+def get_y(o):
+    return "abc"[o % 3]
+
+
+def classification_learner(**kwargs):
+    """A linear classifier on 30 training and 13 validation items of 3 classes."""
+    set_seed(0)
+    dblock = DataBlock(
+        blocks=(TransformBlock, CategoryBlock),
+        get_x=get_x,
+        get_y=get_y,
+        splitter=IndexSplitter(range(30, 43)),
+    )
+    dls = dblock.dataloaders(list(range(43)), bs=4)
+    return Learner(dls, nn.Linear(2, 3), loss_func=CrossEntropyLossFlat(), **kwargs)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from fastai.data.core import Datasets, TfmdDL, TfmdLists, _FusedAffine
+from fastai.data.transforms import Categorize, IntToFloatTensor, Normalize, ToTensor
+from fastai.torch_core import TensorBase, TensorImage, TensorMask
+from fastcore.transform import Transform
+
+
+class CountingReader(Transform):
+    deterministic = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def encodes(self, o):
+        self.calls += 1
+        return TensorBase(torch.full((3,), float(o)))
+
+
+class ReadPath(Transform):
+    deterministic = True
+
+    def encodes(self, o):
+        return f"item_{o}.jpg"
+
+
+class AddNoise(Transform):
+    def encodes(self, o):
+        return o + torch.rand(())
+
+
+class TestTfmdListsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.items = list(range(10))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ram_cache(self):
+        reader = CountingReader()
+        splits = [range(8), range(8, 10)]
+        tl = TfmdLists(self.items, [reader, AddNoise()], splits=splits)
+        # Setup already ran the pipeline on the first item.
+        reader.calls = 0
+        tl.materialize()
+        self.assertEqual(tl.n_cached, 1)
+        self.assertEqual(reader.calls, 10)
+        first, second = tl[3], tl[3]
+        self.assertEqual(reader.calls, 10)
+        # The random tail still runs on every access.
+        self.assertFalse(torch.equal(first, second))
+        self.assertTrue(((first - 3) >= 0).all() and ((first - 3) < 1).all())
+        self.assertEqual(tl.valid[1].floor().tolist(), [9.0] * 3)
+        self.assertEqual(reader.calls, 10)
+
+    def test_disk_cache_is_reused(self):
+        reader = CountingReader()
+        cache = Path(self.tmp.name)
+        tl = TfmdLists(self.items, [reader])
+        reader.calls = 0
+        tl.materialize(cache)
+        self.assertEqual(reader.calls, 10)
+        self.assertEqual(len(list(cache.glob("*.bin"))), 1)
+        expected = [TfmdLists(self.items, [CountingReader()])[i] for i in self.items]
+        for i in self.items:
+            self.assertIs(type(tl[i]), TensorBase)
+            self.assertTrue(torch.equal(tl[i], expected[i]))
+        other = CountingReader()
+        tl = TfmdLists(self.items, [other])
+        other.calls = 0
+        tl.materialize(cache)
+        # Only the first item is read, to check the type of the cached results.
+        self.assertEqual(other.calls, 1)
+        self.assertTrue(torch.equal(tl[4], expected[4]))
+
+    def test_non_array_prefix_is_not_cached_on_disk(self):
+        with self.assertWarnsRegex(UserWarning, "Only tensors or arrays"):
+            tl = TfmdLists(self.items, [ReadPath()], cache=self.tmp.name)
+        self.assertEqual(tl.n_cached, 0)
+        self.assertEqual(tl[2], "item_2.jpg")
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+        # In RAM, any object can be cached.
+        tl = TfmdLists(self.items, [ReadPath()], cache=True)
+        self.assertEqual(tl.n_cached, 1)
+        self.assertEqual(tl[2], "item_2.jpg")
+
+    def test_datasets(self):
+        labels = ["a", "b"] * 5
+        dsets = Datasets(
+            self.items,
+            [[CountingReader()], [lambda o: labels[o], Categorize()]],
+            splits=[range(8), range(8, 10)],
+            cache=True,
+        )
+        self.assertEqual(dsets.tls[1].n_cached, 0)
+        self.assertEqual(dsets.tls[0].n_cached, 1)
+        x, y = dsets.valid[0]
+        self.assertEqual(x.tolist(), [8.0] * 3)
+        self.assertEqual(dsets.vocab[y], "a")
+
+    def test_deterministic_transforms(self):
+        self.assertTrue(ToTensor.deterministic)
+        self.assertTrue(Categorize.deterministic)
+
+
+def image_items(n=6, dtype=torch.uint8):
+    torch.manual_seed(0)
+    return [
+        (
+            TensorImage(torch.randint(0, 256, (3, 4, 4)).to(dtype)),
+            TensorMask(torch.randint(0, 2, (4, 4))),
+        )
+        for _ in range(n)
+    ]
+
+
+def normalize():
+    return Normalize.from_stats([0.4, 0.5, 0.6], [0.2, 0.3, 0.1], cuda=False)
+
+
+class TestFuseTfms(unittest.TestCase):
+    def batches(self, items, after_batch, **kwargs):
+        return [
+            TfmdDL(items, bs=3, after_batch=after_batch(), fuse_tfms=fuse, **kwargs)
+            for fuse in (True, False)
+        ]
+
+    def test_same_batches_as_unfused(self):
+        after_batch = lambda: [IntToFloatTensor(), normalize()]
+        fused, unfused = self.batches(image_items(), after_batch)
+        for (x, y), (ex, ey) in zip(fused, unfused):
+            self.assertIs(type(x), TensorImage)
+            self.assertIs(type(y), TensorMask)
+            torch.testing.assert_close(x, ex)
+            self.assertTrue(torch.equal(y, ey))
+        self.assertIsInstance(fused.after_batch._fused[0], _FusedAffine)
+        b = fused.one_batch()
+        for a, e in zip(fused.decode(b), unfused.decode(b)):
+            self.assertTrue(torch.equal(a, e))
+
+    def test_float_inputs_are_not_modified(self):
+        items = image_items(dtype=torch.float32)
+        original = [x.clone() for x, _ in items]
+        fused, unfused = self.batches(items, lambda: [normalize(), normalize()])
+        torch.testing.assert_close(fused.one_batch()[0], unfused.one_batch()[0])
+        for (x, _), o in zip(items, original):
+            self.assertTrue(torch.equal(x, o))
+
+    def test_new_and_changed_tfms(self):
+        dl = TfmdDL(image_items(), bs=3, after_batch=[IntToFloatTensor(), normalize()])
+        self.assertTrue(dl.new().fuse_tfms)
+        self.assertFalse(dl.new(fuse_tfms=False).fuse_tfms)
+        x = dl.one_batch()[0]
+        dl.after_batch.add(normalize())
+        self.assertEqual(len(dl.after_batch._fused), 1)
+        self.assertEqual(len(dl.after_batch._fused[0].tfms), 2)
+        dl.one_batch()
+        self.assertEqual(len(dl.after_batch._fused[0].tfms), 3)
+        torch.testing.assert_close(dl.one_batch()[0], normalize()(x), atol=1e-5, rtol=0)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from fastai.learner import load_learner
+from classification_data import classification_learner
+
+
+class TiedModel(nn.Module):
+    """Encodes and decodes with the same weight, and has a buffer."""
+
+    def __init__(self):
+        super().__init__()
+        self.enc = nn.Linear(2, 3)
+        self.dec = nn.Linear(3, 2)
+        self.dec.weight = nn.Parameter(torch.randn(2, 3))
+        self.enc.weight = self.dec.weight
+        self.register_buffer("scale", torch.full((3,), 2.0))
+        self.head = nn.Linear(2, 3)
+
+    def forward(self, x):
+        return self.head(self.dec(self.enc.weight.t().mm(x.t()).t() * self.scale))
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.learn = classification_learner(path=self.tmp.name)
+        self.learn.model = TiedModel()
+        self.x = torch.randn(5, 2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_default_export_is_unchanged(self):
+        self.learn.export("export.pkl")
+        self.assertEqual(
+            sorted(p.name for p in Path(self.tmp.name).iterdir()), ["export.pkl"]
+        )
+        learn = load_learner(Path(self.tmp.name) / "export.pkl")
+        self.assertTrue(torch.equal(learn.model(self.x), self.learn.model(self.x)))
+
+    def test_separate_weights(self):
+        expected = self.learn.model(self.x)
+        self.learn.export("small.pkl", separate_weights=True)
+        self.learn.export("full.pkl")
+        path = Path(self.tmp.name)
+        self.assertTrue((path / "small.weights").exists())
+        size = lambda name: (path / name).stat().st_size
+        self.assertLess(size("small.pkl"), size("full.pkl"))
+        # The exported learner keeps its own weights.
+        self.assertTrue(torch.equal(self.learn.model(self.x), expected))
+        self.assertFalse(hasattr(self.learn, "_weights_fname"))
+        for mmap in (True, False):
+            with self.subTest(mmap=mmap):
+                learn = load_learner(path / "small.pkl", mmap=mmap)
+                model = learn.model
+                self.assertTrue(torch.equal(model(self.x), expected))
+                self.assertIs(model.enc.weight, model.dec.weight)
+                self.assertIsInstance(model.head.weight, nn.Parameter)
+                self.assertTrue(model.head.weight.requires_grad)
+                self.assertEqual(model.scale.tolist(), [2.0] * 3)
+                self.assertFalse(hasattr(learn, "_weights_fname"))
+
+    def test_mapped_weights_are_private(self):
+        self.learn.export("export.pkl", separate_weights=True)
+        fname = Path(self.tmp.name) / "export.pkl"
+        learn = load_learner(fname)
+        with torch.no_grad():
+            learn.model.head.weight.zero_()
+        learn = load_learner(fname)
+        weight = learn.model.head.weight
+        self.assertTrue(torch.equal(weight, self.learn.model.head.weight))
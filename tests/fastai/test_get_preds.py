@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest
+
+import numpy as np
+
+from fastai.test_utils import synth_learner
+from fastai.torch_core import set_seed
+
+
+class TestMemmapPreds(unittest.TestCase):
+    def setUp(self):
+        set_seed(0)
+        self.learn = synth_learner(n_trn=2, n_val=3)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertArraysEqual(self, arrays, tensors):
+        self.assertEqual(len(arrays), len(tensors))
+        for a, t in zip(arrays, tensors):
+            if t is None:
+                self.assertIsNone(a)
+                continue
+            self.assertIsInstance(a, np.memmap)
+            np.testing.assert_allclose(a, t.numpy(), rtol=1e-6)
+
+    def test_matches_in_memory_results(self):
+        for dl in (self.learn.dls.valid, self.learn.dls.train):
+            kwargs = dict(dl=dl, with_input=True, with_loss=True)
+            expected = self.learn.get_preds(**kwargs)
+            arrays = self.learn.get_preds(memmap_dir=self.tmp.name, **kwargs)
+            self.assertArraysEqual(arrays, expected)
+
+    def test_with_preds_and_with_targs(self):
+        for kwargs in (
+            dict(with_preds=False),
+            dict(with_targs=False),
+            dict(with_preds=False, with_decoded=True),
+            dict(with_targs=False, with_decoded=True, with_loss=True),
+        ):
+            with self.subTest(**kwargs):
+                expected = self.learn.get_preds(**kwargs)
+                arrays = self.learn.get_preds(memmap_dir=self.tmp.name, **kwargs)
+                self.assertArraysEqual(arrays, expected)
+
+    def test_unsupported_kwargs(self):
+        self.learn.get_preds(memmap_dir=self.tmp.name, concat_dim=0)
+        for kwargs in (dict(concat_dim=1), dict(save_preds=self.tmp.name)):
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    self.learn.get_preds(memmap_dir=self.tmp.name, **kwargs)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+import unittest
+
+import numpy as np
+import torch
+
+from fastai.callback.core import Callback
+from fastai.interpret import ClassificationInterpretation
+from classification_data import classification_learner
+
+
+class CountValidations(Callback):
+    def __init__(self):
+        self.count = 0
+
+    def before_validate(self):
+        self.count += 1
+
+
+class TestClassificationInterpretation(unittest.TestCase):
+    def setUp(self):
+        self.learn = classification_learner()
+        self.counter = CountValidations()
+        self.interp = ClassificationInterpretation.from_learner(self.learn)
+        self.learn.add_cb(self.counter)
+
+    def test_confusion_matrix(self):
+        _, targs, decoded = self.learn.get_preds(dl=self.interp.dl, with_decoded=True)
+        x = torch.arange(3)
+        expected = ((decoded == x[:, None]) & (targs == x[:, None, None])).sum(2)
+        np.testing.assert_array_equal(self.interp.confusion_matrix(), expected.numpy())
+        self.assertEqual(self.interp.confusion_matrix().sum(), 13)
+
+    def test_single_inference_pass(self):
+        self.interp.confusion_matrix()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.interp.print_classification_report()
+        self.interp[[0, 1]]
+        self.assertEqual(self.counter.count, 0)
+
+    def test_getitem_matches_test_dl(self):
+        idxs = [5, 0, 12]
+        items = [self.interp.dl.items[i] for i in idxs]
+        tmp_dl = self.learn.dls.test_dl(items, with_labels=True)
+        expected = self.learn.get_preds(
+            dl=tmp_dl, with_input=True, with_decoded=True, reorder=False
+        )
+        res = self.interp[idxs]
+        self.assertEqual(len(res), 5)
+        for a, b in zip(res[:4], expected):
+            torch.testing.assert_close(a, b, check_dtype=False)
+        torch.testing.assert_close(res[4], self.interp.losses[idxs])
+
+    def test_direct_interpretation_fills_the_cache(self):
+        interp = ClassificationInterpretation(
+            self.learn, self.interp.dl, self.interp.losses
+        )
+        np.testing.assert_array_equal(
+            interp.confusion_matrix(), self.interp.confusion_matrix()
+        )
+        interp.confusion_matrix()
+        self.assertEqual(self.counter.count, 1)
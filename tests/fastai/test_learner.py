@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import torch
+
+from fastai.callback.core import Callback, CancelBatchException
+from fastai.metrics import mae
+from fastai.test_utils import synth_learner
+from fastai.torch_core import TensorCategory, set_seed
+from classification_data import classification_learner
+
+
+class RecordEvents(Callback):
+    def __init__(self, events, tag, order=0):
+        self.events, self.tag, self.order = events, tag, order
+
+    def before_fit(self):
+        self.events.append((self.tag, "before_fit"))
+
+    def before_validate(self):
+        self.events.append((self.tag, "before_validate"))
+
+    def after_batch(self):
+        self.events.append((self.tag, "after_batch"))
+
+
+class CallEverything(Callback):
+    def __init__(self, events):
+        self.events = events
+
+    def __call__(self, event_name):
+        self.events.append(("call", event_name))
+
+
+class SkipTraining(Callback):
+    run_train = False
+
+    def after_batch(self):
+        self.learn.valid_batches += 1
+
+
+class Failing(Callback):
+    def after_batch(self):
+        raise ValueError("boom")
+
+
+class CancelBatch(Callback):
+    def after_pred(self):
+        raise CancelBatchException()
+
+
+class TestEventDispatch(unittest.TestCase):
+    def test_callbacks_run_in_order(self):
+        events = []
+        learn = synth_learner(n_trn=2, n_val=1)
+        learn.add_cbs([RecordEvents(events, "b", order=1), RecordEvents(events, "a")])
+        learn.fit(1)
+        self.assertEqual(events[:2], [("a", "before_fit"), ("b", "before_fit")])
+        self.assertEqual(events.count(("a", "after_batch")), 3)
+        self.assertEqual(events.count(("b", "after_batch")), 3)
+
+    def test_table_is_rebuilt_when_callbacks_change(self):
+        events = []
+        learn = synth_learner(n_trn=1, n_val=1)
+        learn.fit(1)
+        cb = RecordEvents(events, "a")
+        learn.add_cb(cb)
+        learn.fit(1)
+        self.assertIn(("a", "after_batch"), events)
+        learn.remove_cb(cb)
+        events.clear()
+        learn.fit(1)
+        self.assertEqual(events, [])
+
+    def test_custom_call_gets_every_event(self):
+        events = []
+        learn = synth_learner(n_trn=1, n_val=1, cbs=CallEverything(events))
+        learn.fit(1)
+        names = [name for _, name in events]
+        self.assertEqual(names[:2], ["after_create", "before_fit"])
+        self.assertEqual(names[-1], "after_fit")
+        self.assertIn("after_pred", names)
+
+    def test_run_train_and_run_flags(self):
+        learn = synth_learner(n_trn=2, n_val=1, cbs=SkipTraining())
+        learn.valid_batches = 0
+        learn.fit(1)
+        self.assertEqual(learn.valid_batches, 1)
+        learn.skip_training.run = False
+        learn.fit(1)
+        self.assertEqual(learn.valid_batches, 1)
+        # `run` is reset after fit.
+        self.assertTrue(learn.skip_training.run)
+
+    def test_exceptions(self):
+        learn = synth_learner(n_trn=1, n_val=1, cbs=Failing())
+        with self.assertRaisesRegex(ValueError, "`Failing` when calling event"):
+            learn.fit(1)
+        learn = synth_learner(n_trn=2, n_val=1, cbs=CancelBatch())
+        weights = [p.clone() for p in learn.model.parameters()]
+        learn.fit(1)
+        for p, w in zip(learn.model.parameters(), weights):
+            self.assertTrue(p.equal(w))
+
+    def test_profiled_cbs(self):
+        learn = synth_learner(n_trn=1, n_val=1)
+        with learn.profiled_cbs() as times:
+            learn.fit(1)
+        self.assertIn(("recorder", "after_batch"), times)
+        self.assertTrue(all(t >= 0 for t in times.values()))
+        self.assertIsNone(learn.cb_times)
+
+
+class TestDeviceMetrics(unittest.TestCase):
+    def fit(self, device_metrics):
+        set_seed(0)
+        learn = synth_learner(n_trn=3, n_val=1, metrics=mae)
+        learn.recorder.device_metrics, learn.recorder.flush_every = device_metrics, 2
+        learn.fit(2)
+        return learn.recorder
+
+    def test_same_records_and_types(self):
+        recorder, device_recorder = self.fit(False), self.fit(True)
+        self.assertEqual(len(device_recorder.losses), len(recorder.losses))
+        for a, b in zip(recorder.losses, device_recorder.losses):
+            self.assertIs(type(a), type(b))
+            self.assertEqual(a.shape, b.shape)
+            self.assertEqual(a.device, b.device)
+            torch.testing.assert_close(a, b)
+        for values, device_values in zip(recorder.values, device_recorder.values):
+            self.assertEqual(
+                [type(v) for v in values], [type(v) for v in device_values]
+            )
+            for a, b in zip(values, device_values):
+                self.assertAlmostEqual(a, b, places=5)
+
+
+class CheckBatchTypes(Callback):
+    def before_batch(self):
+        self.typed_y = type(self.learn.yb[0])
+
+    def after_pred(self):
+        self.plain_pred_y = type(self.learn.yb[0])
+
+    def after_batch(self):
+        self.after_batch_y = type(self.learn.yb[0])
+
+
+class TestPlainBatches(unittest.TestCase):
+    def test_model_and_loss_see_plain_tensors(self):
+        cb = CheckBatchTypes()
+        learn = classification_learner(cbs=cb)
+        # `CastToTensor` would already cast the batch to `Tensor` in `before_batch`.
+        learn.remove_cb(learn.cast_to_tensor)
+        with learn.plain_batches():
+            learn.fit(1)
+        self.assertIs(cb.typed_y, TensorCategory)
+        self.assertIs(cb.plain_pred_y, torch.Tensor)
+        self.assertIs(cb.after_batch_y, TensorCategory)
+        self.assertFalse(learn.plain_batch)
+
+    def test_get_preds_keeps_types(self):
+        learn = classification_learner()
+        learn.remove_cb(learn.cast_to_tensor)
+        expected = learn.get_preds(with_input=True, with_decoded=True)
+        with learn.plain_batches():
+            res = learn.get_preds(with_input=True, with_decoded=True)
+        for a, b in zip(res, expected):
+            self.assertIs(type(a), type(b))
+            torch.testing.assert_close(a, b)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from fastai.metrics import CorpusBLEUMetric, DiceMulti, JaccardCoeffMulti
+
+
+def reference_counts(batches, n_classes):
+    """Per-class intersections and unions, counted class by class."""
+    inter, union = np.zeros(n_classes), np.zeros(n_classes)
+    for pred, targ in batches:
+        pred = pred.argmax(dim=1).flatten()
+        targ = targ.flatten()
+        for c in range(n_classes):
+            p, t = (pred == c).long(), (targ == c).long()
+            inter[c] += (p * t).sum().item()
+            union[c] += (p + t).sum().item()
+    return inter, union
+
+
+def segmentation_batches(n_classes, n_batches=3, ignore_index=None):
+    torch.manual_seed(n_classes)
+    batches = []
+    for _ in range(n_batches):
+        pred = torch.randn(2, n_classes, 5, 6)
+        targ = torch.randint(0, n_classes, (2, 5, 6))
+        if ignore_index is not None:
+            targ[0, 0] = ignore_index
+        batches.append((pred, targ))
+    return batches
+
+
+def run_metric(metric, batches):
+    metric.reset()
+    for pred, targ in batches:
+        metric.accumulate(SimpleNamespace(pred=pred, y=targ))
+    return metric.value
+
+
+class TestSegmentationMetrics(unittest.TestCase):
+    def test_match_per_class_loop(self):
+        for n_classes, ignore_index in ((2, None), (5, None), (5, 255), (5, -1)):
+            with self.subTest(n_classes=n_classes, ignore_index=ignore_index):
+                batches = segmentation_batches(n_classes, ignore_index=ignore_index)
+                inter, union = reference_counts(batches, n_classes)
+                with np.errstate(invalid="ignore"):
+                    dice = np.nanmean(2 * inter / union)
+                    jaccard = np.nanmean(inter / (union - inter))
+                self.assertAlmostEqual(run_metric(DiceMulti(), batches), dice)
+                self.assertAlmostEqual(
+                    run_metric(JaccardCoeffMulti(), batches), jaccard
+                )
+
+    def test_missing_classes_are_ignored(self):
+        pred = torch.zeros(1, 3, 2, 2)
+        pred[:, 0] = 1
+        targ = torch.zeros(1, 2, 2, dtype=torch.long)
+        # Class 0 is perfect, classes 1 and 2 never appear.
+        self.assertEqual(run_metric(DiceMulti(), [(pred, targ)]), 1.0)
+        self.assertEqual(run_metric(JaccardCoeffMulti(), [(pred, targ)]), 1.0)
+
+    def test_counts_stay_on_the_prediction_device(self):
+        metric = DiceMulti()
+        run_metric(metric, segmentation_batches(3))
+        self.assertIsInstance(metric.inter, torch.Tensor)
+        self.assertEqual(metric.inter.dtype, torch.int64)
+
+
+def reference_bleu_totals(metric, batches):
+    """Corrects and counts of the per-sentence, per-n-gram implementation."""
+    corrects, counts = [0] * 4, [0] * 4
+    for pred, targ in batches:
+        for p, t in zip(pred.argmax(dim=-1).numpy(), targ.numpy()):
+            smooth_mteval = 1
+            for i in range(4):
+                c, n = metric.get_correct_ngrams(p, t, i + 1, max_n=metric.vocab_sz)
+                if c == 0:
+                    smooth_mteval *= 2
+                    c = 1 / smooth_mteval
+                corrects[i] += c
+                counts[i] += n
+    return corrects, counts
+
+
+def translation_batches(vocab_sz, pred_len, targ_len, n_batches=3):
+    torch.manual_seed(pred_len * targ_len)
+    batches = []
+    for _ in range(n_batches):
+        targ = torch.randint(0, vocab_sz, (4, targ_len))
+        pred = torch.randn(4, pred_len, vocab_sz)
+        # Copy part of the target so that longer n-grams match too.
+        n = min(pred_len, targ_len) // 2
+        pred[:, :n].scatter_(2, targ[:, :n, None], 10.0)
+        batches.append((pred, targ))
+    return batches
+
+
+class TestCorpusBLEUMetric(unittest.TestCase):
+    def run_bleu(self, metric, batches):
+        metric.reset()
+        for pred, targ in batches:
+            metric.accumulate(SimpleNamespace(training=False, pred=pred, y=targ))
+        return metric
+
+    def test_match_per_sentence_counts(self):
+        for vocab_sz, pred_len, targ_len in (
+            (5, 12, 10),
+            (30, 8, 14),
+            (30, 6, 3),
+            (70000, 9, 9),
+        ):
+            with self.subTest(vocab_sz=vocab_sz, pred_len=pred_len, targ_len=targ_len):
+                batches = translation_batches(vocab_sz, pred_len, targ_len)
+                metric = self.run_bleu(CorpusBLEUMetric(vocab_sz=vocab_sz), batches)
+                corrects, counts = reference_bleu_totals(metric, batches)
+                self.assertEqual(metric.corrects, corrects)
+                self.assertEqual(metric.counts, counts)
+                self.assertEqual(metric.pred_len, 12 * pred_len)
+                self.assertEqual(metric.targ_len, 12 * targ_len)
+                self.assertGreater(metric.value, 0)
+
+    def test_perfect_prediction(self):
+        targ = torch.randint(0, 10, (2, 8))
+        pred = torch.nn.functional.one_hot(targ, 10).float()
+        metric = self.run_bleu(CorpusBLEUMetric(vocab_sz=10), [(pred, targ)])
+        self.assertAlmostEqual(metric.value, 1.0)
+
+    def test_training_batches_are_skipped(self):
+        metric = CorpusBLEUMetric(vocab_sz=10)
+        metric.reset()
+        pred, targ = translation_batches(10, 5, 5, n_batches=1)[0]
+        metric.accumulate(SimpleNamespace(training=True, pred=pred, y=targ))
+        self.assertEqual(metric.counts, [0] * 4)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import torch
+from torch import nn
+
+from fastai.optimizer import SGD, Adam, Lamb, Larc, QHAdam, RAdam, RMSProp
+
+
+def params(n=3):
+    torch.manual_seed(0)
+    ps = [nn.Parameter(torch.randn(4, i + 2)) for i in range(n)]
+    for p in ps:
+        p.grad = torch.randn_like(p)
+    return ps
+
+
+def run_steps(opt_func, foreach, n_steps=3, **kwargs):
+    ps = params()
+    opt = opt_func(ps, lr=0.1, foreach=foreach, **kwargs)
+    for _ in range(n_steps):
+        opt.step()
+    return ps, opt
+
+
+class TestForeachOptimizer(unittest.TestCase):
+    def test_matches_per_param_step(self):
+        for opt_func, kwargs in (
+            (SGD, dict(mom=0.9)),
+            (RMSProp, dict(mom=0.9)),
+            (Adam, {}),
+            (Adam, dict(wd=0.1, decouple_wd=False)),
+            (RAdam, {}),
+            (QHAdam, {}),
+            (Larc, {}),
+            (Larc, dict(clip=False)),
+            (Lamb, {}),
+        ):
+            with self.subTest(opt=opt_func.__name__, **kwargs):
+                ps, _ = run_steps(opt_func, False, **kwargs)
+                ps_foreach, _ = run_steps(opt_func, True, **kwargs)
+                for p, q in zip(ps, ps_foreach):
+                    torch.testing.assert_close(p, q)
+
+    def test_larc_state_types(self):
+        ps, opt = run_steps(Larc, False, clip=False)
+        ps_foreach, opt_foreach = run_steps(Larc, True, clip=False)
+        for p, q in zip(ps, ps_foreach):
+            state, state_foreach = opt.state[p], opt_foreach.state[q]
+            self.assertEqual(state.keys(), state_foreach.keys())
+            self.assertIsInstance(state_foreach["local_lr"], torch.Tensor)
+            self.assertEqual(state_foreach["local_lr"].shape, state["local_lr"].shape)
+            torch.testing.assert_close(state["local_lr"], state_foreach["local_lr"])
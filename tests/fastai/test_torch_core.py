@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from fastai.torch_core import (
+    ArrayStore,
+    L,
+    ChunkedTensor,
+    RaggedTensor,
+    TensorBase,
+    TensorCategory,
+    TensorImage,
+    nested_reorder,
+    restore_types,
+    strip_types,
+    tensor,
+    to_concat,
+)
+
+
+class TestStripTypes(unittest.TestCase):
+    def test_round_trip(self):
+        img = TensorImage(torch.randn(2, 3))
+        img.img_size = (3, 2)
+        cat = TensorCategory(torch.tensor([0, 1]))
+        b = ((img, torch.ones(2)), (cat,), 3)
+        plain, typs = strip_types(b)
+        self.assertIs(type(plain[0][0]), torch.Tensor)
+        self.assertIs(type(plain[1][0]), torch.Tensor)
+        self.assertIs(plain[0][1], b[0][1])
+        self.assertEqual(plain[2], 3)
+        # No copy is made.
+        self.assertEqual(plain[0][0].data_ptr(), img.data_ptr())
+        restored = restore_types(plain, typs)
+        self.assertIs(type(restored[0][0]), TensorImage)
+        self.assertEqual(restored[0][0].img_size, (3, 2))
+        self.assertIs(type(restored[1][0]), TensorCategory)
+        self.assertIs(type(restored[0][1]), torch.Tensor)
+        self.assertTrue(torch.equal(restored[0][0], img))
+
+    def test_plain_tensors_are_unchanged(self):
+        t = torch.ones(2)
+        self.assertEqual(strip_types(t), (t, None))
+        self.assertIs(restore_types(t, None), t)
+        self.assertIs(type(strip_types(TensorBase(t))[0]), torch.Tensor)
+
+
+def batches(dim=0):
+    torch.manual_seed(0)
+    shape = [2, 3, 4]
+    res = []
+    for n in (3, 5, 2):
+        shape[dim] = n
+        res.append(TensorImage(torch.randn(*shape)))
+    return res
+
+
+def ragged_batches():
+    # Rows of a text classifier: each batch is padded to its own length.
+    return [TensorBase(torch.arange(n * 4).view(n, 4) + n) for n in (2, 3)] + [
+        TensorBase(torch.arange(6).view(3, 2))
+    ]
+
+
+class TestToConcat(unittest.TestCase):
+    def test_ragged_defaults_to_list(self):
+        xs = ragged_batches()
+        res = to_concat(xs)
+        self.assertIsInstance(res, L)
+        self.assertEqual(len(res), 8)
+        self.assertTrue(torch.equal(res[5], xs[2][0]))
+        self.assertIsInstance(res[0], TensorBase)
+
+    def test_ragged_tensor(self):
+        xs = ragged_batches()
+        expected = to_concat(xs)
+        res = to_concat(xs, ragged=True)
+        self.assertIsInstance(res, RaggedTensor)
+        self.assertEqual(len(res), 8)
+        for a, b in zip(res, expected):
+            self.assertTrue(torch.equal(a, b))
+        idxs = [7, 0, 3, 5]
+        for a, b in zip(nested_reorder(res, tensor(idxs)), expected[idxs]):
+            self.assertTrue(torch.equal(a, b))
+        for a, b in zip(res[1:6], expected[1:6]):
+            self.assertTrue(torch.equal(a, b))
+        self.assertTrue(torch.equal(res[-1], expected[-1]))
+
+    def test_nested_ragged(self):
+        xs = [(x, torch.ones(len(x))) for x in ragged_batches()]
+        res = to_concat(xs, ragged=True)
+        self.assertIsInstance(res[0], RaggedTensor)
+        self.assertEqual(res[1].shape, (8,))
+
+    def test_chunked_tensor(self):
+        for dim in (0, 1, -1):
+            with self.subTest(dim=dim):
+                xs = batches(dim)
+                expected = to_concat(xs, dim=dim)
+                res = to_concat(xs, dim=dim, lazy=True)
+                self.assertIsInstance(res, ChunkedTensor)
+                self.assertEqual(res.shape, expected.shape)
+                self.assertTrue(torch.equal(res[4], expected.select(dim, 4)))
+                materialized = res.materialize()
+                self.assertIsInstance(materialized, TensorImage)
+                self.assertTrue(torch.equal(materialized, expected))
+                idxs = torch.tensor([9, 0, 4, 3])
+                reordered = nested_reorder(res, idxs).materialize()
+                self.assertEqual(nested_reorder(res, idxs).shape, reordered.shape)
+                expected = expected.index_select(dim, idxs)
+                self.assertTrue(torch.equal(reordered, expected))
+
+    def test_lazy_falls_back_when_rows_differ(self):
+        res = to_concat(ragged_batches(), lazy=True)
+        self.assertIsInstance(res, L)
+
+
+try:
+    import tables
+except ImportError:
+    tables = None
+
+
+class TestArrayStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rows = np.arange(60, dtype=np.float32).reshape(20, 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def new_store(self, compress):
+        store = ArrayStore(Path(self.tmp.name) / "store", compress=compress)
+        store.append(self.rows[:12]).append(torch.from_numpy(self.rows[12:]))
+        return store
+
+    def check_reads(self, store):
+        self.assertEqual(len(store), 20)
+        self.assertEqual(store.shape, (20, 3))
+        self.assertEqual(store.dtype, np.float32)
+        np.testing.assert_array_equal(store[3], self.rows[3])
+        np.testing.assert_array_equal(store[-1], self.rows[-1])
+        np.testing.assert_array_equal(store[4:9], self.rows[4:9])
+        idxs = [7, 2, 7, 15]
+        np.testing.assert_array_equal(store[idxs], self.rows[idxs])
+        np.testing.assert_array_equal(store[torch.tensor(idxs)], self.rows[idxs])
+        mask = self.rows[:, 0] % 2 == 0
+        np.testing.assert_array_equal(store[mask], self.rows[mask])
+        np.testing.assert_array_equal(np.stack(list(store)), self.rows)
+
+    def test_uncompressed(self):
+        with self.new_store(compress=False) as store:
+            self.check_reads(store)
+            # Rows are writable, but the file is never changed.
+            store[0][0] = -1
+        # An existing uncompressed store is reopened as such.
+        self.assertFalse(ArrayStore(store.path).compress)
+        self.check_reads(ArrayStore(store.path))
+
+    @unittest.skipIf(tables is None, "pytables is not installed")
+    def test_compressed(self):
+        with self.new_store(compress=None) as store:
+            self.assertTrue(store.compress)
+            self.check_reads(store)
+            view = store.view([15, 2, 9])
+            np.testing.assert_array_equal(view[[2, 0, 2]], self.rows[[9, 15, 9]])
+        # Index-array and mask reads of 2-column rows.
+        rows = self.rows.reshape(30, 2)
+        with ArrayStore(Path(self.tmp.name) / "pairs").append(rows) as store:
+            np.testing.assert_array_equal(store[[2, 7]], rows[[2, 7]])
+            np.testing.assert_array_equal(store[[29, 0, 29]], rows[[29, 0, 29]])
+            mask = rows[:, 1] % 3 == 0
+            np.testing.assert_array_equal(store[mask], rows[mask])
+        with ArrayStore(Path(self.tmp.name) / "scalars").append(rows[:, 0]) as store:
+            np.testing.assert_array_equal(store[[29, 0, 29]], rows[[29, 0, 29], 0])
+
+    def test_views(self):
+        store = self.new_store(compress=False)
+        view = store.view(slice(5, 15))
+        self.assertEqual(len(view), 10)
+        np.testing.assert_array_equal(view[[0, -1]], self.rows[[5, 14]])
+        subview = L(view, use_list=None).iloc[[9, 0, 1]]
+        self.assertIsInstance(subview, ArrayStore)
+        np.testing.assert_array_equal(subview[:], self.rows[[14, 5, 6]])
+        np.testing.assert_array_equal(L(view, use_list=None).iloc[2], self.rows[7])
+        with self.assertRaises(AssertionError):
+            view.append(self.rows)
+
+    def test_pickle(self):
+        store = self.new_store(compress=False)
+        store[0]
+        restored = pickle.loads(pickle.dumps(store.view([3, 1])))
+        np.testing.assert_array_equal(restored[:], self.rows[[3, 1]])
+
+    def test_row_shape_mismatch(self):
+        store = self.new_store(compress=False)
+        with self.assertRaises(AssertionError):
+            store.append(np.zeros((2, 4), dtype=np.float32))
+        self.assertEqual(len(store), 20)
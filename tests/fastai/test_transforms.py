@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from fastai.data.transforms import (
+    Categorize,
+    CategoryMap,
+    MultiCategorize,
+    get_files,
+)
+from fastai.torch_core import TensorCategory, TensorMultiCategory
+
+
+def walk_files(path, extensions=None, folders=None, followlinks=True):
+    """Files found by `os.walk`, as `get_files` listed them before the parallel scan."""
+    folders = folders or []
+    extensions = {e.lower() for e in extensions or []}
+    res = []
+    for i, (p, d, f) in enumerate(os.walk(path, followlinks=followlinks)):
+        if folders and i == 0:
+            d[:] = [o for o in d if o in folders]
+        else:
+            d[:] = [o for o in d if not o.startswith(".")]
+        if folders and i == 0 and "." not in folders:
+            continue
+        res += [
+            Path(p) / o
+            for o in f
+            if not o.startswith(".")
+            and (not extensions or f'.{o.split(".")[-1].lower()}' in extensions)
+        ]
+    return res
+
+
+class TestGetFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "data"
+        self.outside = Path(self.tmp.name) / "outside"
+        for f in (
+            "a.jpg",
+            "b.TXT",
+            ".hidden.jpg",
+            "train/c.jpg",
+            "train/d.png",
+            "train/sub/e.jpg",
+            "valid/f.jpg",
+            ".git/g.jpg",
+        ):
+            self.touch(self.root / f)
+        self.touch(self.outside / "h.jpg")
+        os.symlink(self.outside, self.root / "linked")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    def test_matches_os_walk(self):
+        for kwargs in (
+            {},
+            dict(extensions=[".jpg"]),
+            dict(extensions=[".TXT"]),
+            dict(folders=["train", "linked"]),
+            dict(folders=["train", "."]),
+            dict(followlinks=False),
+        ):
+            for n_workers in (None, 0, 3):
+                with self.subTest(n_workers=n_workers, **kwargs):
+                    res = get_files(self.root, n_workers=n_workers, **kwargs)
+                    self.assertEqual(list(res), walk_files(self.root, **kwargs))
+
+    def test_no_recurse_and_as_str(self):
+        self.assertEqual(
+            sorted(get_files(self.root, recurse=False)),
+            [self.root / "a.jpg", self.root / "b.TXT"],
+        )
+        res = get_files(self.root, extensions=".jpg", as_str=True)
+        self.assertTrue(all(isinstance(o, str) for o in res))
+        self.assertEqual([Path(o) for o in res], walk_files(self.root, [".jpg"]))
+
+    def test_cache(self):
+        cache = Path(self.tmp.name) / "index.pkl"
+        expected = walk_files(self.root)
+        self.assertEqual(list(get_files(self.root, cache=cache)), expected)
+        self.assertTrue(cache.exists())
+        self.assertEqual(list(get_files(self.root, cache=cache)), expected)
+        # A changed directory is listed again.
+        self.touch(self.root / "train" / "new.jpg")
+        os.utime(self.root / "train", ns=(0, 0))
+        res = get_files(self.root, cache=cache)
+        self.assertIn(self.root / "train" / "new.jpg", res)
+        self.assertEqual(list(res), walk_files(self.root))
+
+
+class TestCategorize(unittest.TestCase):
+    def test_category_map_encode(self):
+        labels = ["cat", "dog", "bird", "dog"]
+        vocab = CategoryMap(labels)
+        ids = vocab.encode(labels + ["cat"])
+        self.assertIsInstance(ids, np.ndarray)
+        self.assertEqual(ids.tolist(), [vocab.o2i[o] for o in labels + ["cat"]])
+        self.assertEqual(list(vocab.map_objs(labels)), ids[:4].tolist())
+        with self.assertRaisesRegex(KeyError, "'fish', 'ant' were not included"):
+            vocab.encode(["fish", "cat", "ant", "fish"])
+
+    def test_category_map_add_na(self):
+        vocab = CategoryMap(["a", "b"], add_na=True)
+        self.assertEqual(vocab.encode(["b", "z", "a"]).tolist(), [2, 0, 1])
+        with self.assertRaises(KeyError):
+            vocab.encode(["z"], strict=True)
+
+    def test_categorize(self):
+        labels = ["b", "a", "c", "a"]
+        tfm = Categorize()
+        tfm.setup(labels)
+        for o in labels:
+            res = tfm(o)
+            self.assertIs(type(res), TensorCategory)
+            self.assertEqual(res.dtype, torch.long)
+            self.assertEqual(res.item(), tfm.vocab.o2i[o])
+            self.assertEqual(tfm.decode(res), o)
+        col = tfm.encode_col(labels)
+        self.assertIs(type(col), TensorCategory)
+        self.assertEqual(col.tolist(), [tfm(o).item() for o in labels])
+        with self.assertRaisesRegex(KeyError, "Label 'z' was not included"):
+            tfm("z")
+
+    def test_multi_categorize(self):
+        rows = [["b", "a"], [], ["c"], ["a", "c", "b"]]
+        tfm = MultiCategorize()
+        tfm.setup(rows)
+        self.assertEqual(list(tfm.vocab), ["a", "b", "c"])
+        res = tfm(rows[3])
+        self.assertIs(type(res), TensorMultiCategory)
+        self.assertEqual(res.tolist(), [0, 2, 1])
+        self.assertEqual(tfm(rows[1]).tolist(), [])
+        self.assertEqual(list(tfm.decode(res)), rows[3])
+        ids, offsets = tfm.encode_col(rows)
+        self.assertIs(type(ids), TensorMultiCategory)
+        self.assertEqual(offsets.tolist(), [0, 2, 2, 3, 6])
+        for i, row in enumerate(rows):
+            row_ids = ids[offsets[i] : offsets[i + 1]]
+            self.assertEqual(row_ids.tolist(), tfm(row).tolist())
+        with self.assertRaisesRegex(KeyError, "Labels 'x', 'y' were not included"):
+            tfm(["a", "x", "y"])
+        with self.assertRaises(KeyError):
+            tfm.encode_col([["a"], ["x"]])
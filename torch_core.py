@@ -14,11 +14,11 @@ __all__ = ['norm_types', 'setup_cuda', 'subplots', 'show_image', 'show_titled_im
            'set_random_states', 'no_random', 'unsqueeze', 'unsqueeze_', 'apply', 'maybe_gather', 'to_detach', 'to_half',
            'to_float', 'default_device', 'to_device', 'to_cpu', 'to_np', 'to_concat', 'TensorBase', 'TensorImageBase',
            'TensorImage', 'TensorImageBW', 'TensorMask', 'TensorFlowField', 'TensorCategory', 'TensorMultiCategory',
-           'TitledTensorScalar', 'concat', 'Chunks', 'show_title', 'ShowTitle', 'TitledInt', 'TitledFloat', 'TitledStr',
+           'TitledTensorScalar', 'strip_types', 'restore_types', 'concat', 'Chunks', 'ChunkedTensor', 'RaggedTensor', 'show_title', 'ShowTitle', 'TitledInt', 'TitledFloat', 'TitledStr',
            'TitledTuple', 'get_empty_df', 'display_df', 'get_first', 'one_param', 'item_find', 'find_device', 'find_bs',
            'np_func', 'Module', 'get_model', 'one_hot', 'one_hot_decode', 'params', 'trainable_params',
            'norm_bias_params', 'batch_to_samples', 'logit', 'num_distrib', 'rank_distrib', 'distrib_barrier',
-           'base_doc', 'doc', 'nested_reorder', 'flatten_check', 'make_cross_image', 'show_image_batch',
+           'base_doc', 'doc', 'nested_reorder', 'ArrayStore', 'flatten_check', 'make_cross_image', 'show_image_batch',
            'requires_grad', 'init_default', 'cond_init', 'apply_leaf', 'apply_init', 'script_use_ctx',
            'script_save_ctx', 'script_fwd', 'script_bwd', 'grad_module', 'ismin_torch', 'notmax_torch', 'progress_bar',
            'master_bar']
@@ -297,16 +297,26 @@ def to_np(x):
     return apply(lambda o: o.data.cpu().numpy(), x)
 
 # %% ../nbs/00_torch_core.ipynb 80
-def to_concat(xs, dim=0):
-    "Concat the element in `xs` (recursively if they are tuples/lists of tensors)"
+def _same_rows(shapes, dim):
+    "Whether all `shapes` are equal except along `dim`"
+    rest = lambda s: s[:dim%len(s)]+s[dim%len(s)+1:]
+    return all(len(s)==len(shapes[0])>0 and rest(s)==rest(shapes[0]) for s in shapes)
+
+def to_concat(xs, dim=0, lazy=False, ragged=False):
+    "Concat the element in `xs` (recursively if they are tuples/lists of tensors), as a `ChunkedTensor` view if `lazy`; rows that can't be concatenated go in an `L`, or a `RaggedTensor` if `ragged`"
     if not xs: return xs
-    if is_listy(xs[0]): return type(xs[0])([to_concat([x[i] for x in xs], dim=dim) for i in range_of(xs[0])])
-    if isinstance(xs[0],dict):  return {k: to_concat([x[k] for x in xs], dim=dim) for k in xs[0].keys()}
+    if is_listy(xs[0]): return type(xs[0])([to_concat([x[i] for x in xs], dim=dim, lazy=lazy, ragged=ragged) for i in range_of(xs[0])])
+    if isinstance(xs[0],dict):  return {k: to_concat([x[k] for x in xs], dim=dim, lazy=lazy, ragged=ragged) for k in xs[0].keys()}
+    if lazy and isinstance(xs[0],Tensor):
+        shapes = [x.shape for x in xs]
+        if _same_rows(shapes, dim): return ChunkedTensor(xs, dim=dim, lens=[s[dim] for s in shapes])
     #We may receive xs that are not concatenable (inputs of a text classifier for instance),
-    #   in this case we return a big list
+    #   in this case we return a big list, or a `RaggedTensor` of flat values and offsets if `ragged`
     try:    return retain_type(torch.cat(xs, dim=dim), xs[0])
-    except: return sum([L(retain_type(o_.index_select(dim, tensor(i)).squeeze(dim), xs[0])
-                          for i in range_of(o_)) for o_ in xs], L())
+    except:
+        if ragged: return RaggedTensor.from_tensors(xs, dim=dim)
+        return sum([L(retain_type(o_.index_select(dim, tensor(i)).squeeze(dim), xs[0])
+                      for i in range_of(o_)) for o_ in xs], L())
 
 # %% ../nbs/00_torch_core.ipynb 84
 # Parsed PyTorch versions for faster version checking
@@ -471,6 +481,23 @@ class TitledTensorScalar(TensorBase):
     "A tensor containing a scalar that has a `show` method"
     def show(self, **kwargs): show_title(self.item(), **kwargs)
 
+def strip_types(b):
+    "Recursively cast `TensorBase` subclasses in `b` to `Tensor`; also return their types and metadata for `restore_types`"
+    if isinstance(b, TensorBase): return torch.Tensor.as_subclass(b, Tensor),(type(b),b.__dict__)
+    if is_listy(b):
+        res = [strip_types(o) for o in b]
+        return type(b)(o for o,_ in res),tuple(t for _,t in res)
+    return b,None
+
+def restore_types(b, typs):
+    "Cast the tensors in `b` back to the types and metadata `typs` returned by `strip_types`"
+    if typs is None: return b
+    if isinstance(typs[0], type):
+        res = torch.Tensor.as_subclass(b, typs[0])
+        res.__dict__ = copy(typs[1])
+        return res
+    return type(b)(restore_types(o, t) for o,t in zip(b, typs))
+
 # %% ../nbs/00_torch_core.ipynb 124
 @patch
 def tensored(self:L):
@@ -526,6 +553,99 @@ class Chunks:
         cl = self.cumlens[docidx]
         return docidx,i-cl
 
+def _row_idxs(i, n):
+    "Integer row indices in `range(n)` selected by the slice, mask or array-like `i`"
+    if isinstance(i, slice): return np.arange(n)[i]
+    i = to_np(i) if isinstance(i, Tensor) else np.asarray(i)
+    if i.dtype==bool: return np.nonzero(i)[0]
+    return np.where(i<0, i+n, i).astype(np.int64)
+
+class ChunkedTensor(Chunks):
+    "Lazy concatenation of the tensors in `chunks` along `dim`, optionally viewed through the rows `idxs`"
+    def __init__(self, chunks, idxs=None, dim=0, lens=None):
+        self.dim = dim
+        super().__init__([c if dim==0 else c.movedim(dim, 0) for c in chunks], lens=lens)
+        self.idxs = None if idxs is None else _row_idxs(idxs, self.totlen)
+
+    def __len__(self): return self.totlen if self.idxs is None else len(self.idxs)
+    @property
+    def shape(self):
+        s = self.chunks[0].shape[1:]
+        dim = self.dim % (len(s)+1)
+        return s[:dim]+torch.Size([len(self)])+s[dim:]
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)) or (isinstance(i, Tensor) and i.ndim==0):
+            i = int(i)
+            return super().__getitem__(i if self.idxs is None else int(self.idxs[i]))
+        idxs = _row_idxs(i, len(self))
+        res = ChunkedTensor(self.chunks, idxs if self.idxs is None else self.idxs[idxs], lens=self.lens)
+        res.dim = self.dim
+        return res
+
+    def gather(self, idxs):
+        "Materialize the rows `idxs` of the full concatenation, only reading the chunks they come from"
+        c0 = self.chunks[0]
+        res = torch.empty((len(idxs),)+c0.shape[1:], dtype=c0.dtype, device=c0.device)
+        dis = np.searchsorted(self.cumlens, idxs+1)-1
+        for di in np.unique(dis):
+            pos = np.nonzero(dis==di)[0]
+            c = self.chunks[di]
+            res[torch.as_tensor(pos, device=c.device)] = torch.Tensor.as_subclass(
+                c[torch.as_tensor(idxs[pos]-self.cumlens[di], device=c.device)], Tensor)
+        return retain_type(res, c0)
+
+    def materialize(self):
+        "The concatenated tensor along `dim`"
+        res = retain_type(torch.cat(self.chunks), self.chunks[0]) if self.idxs is None else self.gather(self.idxs)
+        return res if self.dim==0 else res.movedim(0, self.dim)
+
+    def __iter__(self, bs=1024):
+        if self.idxs is None:
+            for c in self.chunks: yield from c
+        else:
+            for i in range(0, len(self), bs): yield from self.gather(self.idxs[i:i+bs])
+
+    def __repr__(self): return f'{self.__class__.__name__}(shape={tuple(self.shape)}, n_chunks={len(self.chunks)})'
+
+class RaggedTensor:
+    "Rows of different shapes stored as one flat `values` tensor with the `offsets` and `shapes` of each row"
+    def __init__(self, values, offsets, shapes): store_attr()
+
+    @classmethod
+    def from_tensors(cls, xs, dim=0):
+        "Store the rows along `dim` of all tensors in `xs`, which may differ in their other dims"
+        xs = [x if dim==0 else x.movedim(dim, 0) for x in xs]
+        values = retain_type(torch.cat([torch.Tensor.as_subclass(x, Tensor).reshape(-1) for x in xs]), xs[0])
+        shapes = np.concatenate([np.broadcast_to(np.array(x.shape[1:], dtype=np.int64), (len(x), x.ndim-1)) for x in xs])
+        sizes = np.concatenate([np.full(len(x), math.prod(x.shape[1:]), dtype=np.int64) for x in xs])
+        return cls(values, np.concatenate([[0], np.cumsum(sizes)]), shapes)
+
+    def __len__(self): return len(self.shapes)
+    @property
+    def lens(self): return self.offsets[1:]-self.offsets[:-1]
+
+    def __getitem__(self, i):
+        "Read row `i`, or the rows selected by a slice, mask or index array `i`"
+        if isinstance(i, (int, np.integer)) or (isinstance(i, Tensor) and i.ndim==0):
+            i = int(i)
+            if i<0: i += len(self)
+            return self.values[self.offsets[i]:self.offsets[i+1]].view(*self.shapes[i])
+        if isinstance(i, slice) and i.step in (None, 1):
+            st,en,_ = i.indices(len(self))
+            en = max(st, en)
+            return RaggedTensor(self.values[self.offsets[st]:self.offsets[en]], self.offsets[st:en+1]-self.offsets[st], self.shapes[st:en])
+        idxs = _row_idxs(i, len(self))
+        lens = self.offsets[idxs+1]-self.offsets[idxs]
+        offsets = np.concatenate([[0], np.cumsum(lens)]).astype(np.int64)
+        flat = np.repeat(self.offsets[idxs]-offsets[:-1], lens) + np.arange(offsets[-1])
+        return RaggedTensor(self.values[torch.as_tensor(flat, device=self.values.device)], offsets, self.shapes[idxs])
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+    def __repr__(self): return f'{self.__class__.__name__}(n={len(self)}, numel={len(self.values)})'
+
 # %% ../nbs/00_torch_core.ipynb 140
 def show_title(o, ax=None, ctx=None, label=None, color='black', **kwargs):
     "Set title of `ax` to `o`, or print `o` if `ax` is `None`"
@@ -777,11 +897,133 @@ def doc(elt):
 # %% ../nbs/00_torch_core.ipynb 198
 def nested_reorder(t, idxs):
     "Reorder all tensors in `t` using `idxs`"
-    if isinstance(t, (Tensor,L)): return t[idxs]
+    if isinstance(t, (Tensor,L,ChunkedTensor,RaggedTensor)): return t[idxs]
     elif is_listy(t): return type(t)(nested_reorder(t_, idxs) for t_ in t)
     if t is None: return t
     raise TypeError(f"Expected tensor, tuple, list or L but got {type(t)}")
 
+class _ArrayStoreIloc:
+    "Indexer used by `L`: rows for ints, `ArrayStore` views for anything else"
+    def __init__(self, store): self.store = store
+    def __getitem__(self, i):
+        return self.store[i] if isinstance(i, (int, np.integer)) else self.store.view(i)
+
+class ArrayStore:
+    "Rows of an array at `path`, in a Blosc-compressed chunked `pytables` file or an uncompressed memory-mapped one"
+    def __init__(self,
+        path:Path, # File of the store, an uncompressed store also has a `.json` file next to it
+        compress:bool=None, # Use a compressed `pytables` file, defaults to `True` unless an uncompressed store exists at `path`
+        complib:str='lz4', # Blosc compressor of a new compressed store
+        lvl:int=3, # Compression level of a new compressed store
+        chunk_rows:int=None, # Rows per compressed chunk, defaults to the choice of `pytables`
+        n_threads:int=None, # Number of Blosc threads, defaults to the number of CPUs
+        idxs=None # Rows of the store exposed by this view, all of them if `None`
+    ):
+        self.path = Path(path)
+        if compress is None: compress = not self._meta_path.exists()
+        store_attr('compress,complib,lvl,chunk_rows,n_threads')
+        self.idxs = None if idxs is None else np.asarray(idxs, dtype=np.int64)
+        self._f,self._data,self._pid,self._mode = None,None,None,None
+
+    @property
+    def _meta_path(self): return self.path.with_name(self.path.name+'.json')
+    def _meta(self): return json.loads(self._meta_path.read_text()) if self._meta_path.exists() else None
+
+    def _open(self, mode='r'):
+        "The underlying array, (re)opened in this process in `mode`"
+        if (self._data is not None and self._pid==os.getpid() and (mode=='r' or self._mode=='a')
+            and (self._f is None or self._f.isopen)): return self._data
+        self.close()
+        self._pid,self._mode = os.getpid(),mode
+        if self.compress:
+            if mode=='r' and not self.path.exists(): return None
+            tables.set_blosc_max_threads(ifnone(self.n_threads, num_cpus()))
+            self._f = tables.open_file(self.path, mode)
+            self._data = getattr(self._f.root, 'data', None)
+        else:
+            meta = self._meta()
+            if meta is None: return None
+            shape,dtype = (meta['n'],*meta['shape']),np.dtype(meta['dtype'])
+            # Copy-on-write so that rows are writable numpy arrays, without ever changing the file
+            self._data = np.memmap(self.path, dtype=dtype, mode='c', shape=shape) if meta['n'] else np.empty(shape, dtype)
+        return self._data
+
+    def close(self):
+        "Close the underlying file, it is reopened on the next read"
+        if self._f is not None and self._pid==os.getpid() and self._f.isopen: self._f.close()
+        self._f,self._data = None,None
+
+    def append(self, o):
+        "Add the rows of `o` at the end of the store"
+        assert self.idxs is None, "Can't append to a view of an `ArrayStore`"
+        o = np.ascontiguousarray(to_np(o) if isinstance(o,Tensor) else o)
+        if self.compress:
+            data = self._open('a')
+            if data is None:
+                chunkshape = None if self.chunk_rows is None else (self.chunk_rows,*o.shape[1:])
+                data = self._data = self._f.create_earray('/', 'data', atom=tables.Atom.from_dtype(o.dtype), shape=(0,*o.shape[1:]),
+                                                          filters=_comp_filter(lib=self.complib,lvl=self.lvl), chunkshape=chunkshape)
+            data.append(o)
+            self._f.flush()
+        else:
+            meta = ifnone(self._meta(), dict(dtype=o.dtype.str, shape=list(o.shape[1:]), n=0))
+            assert list(o.shape[1:])==meta['shape'], f"Expected rows of shape {tuple(meta['shape'])} but got {o.shape[1:]}"
+            with open(self.path, 'ab') as f: f.write(o.astype(meta['dtype'], copy=False).tobytes())
+            meta['n'] += len(o)
+            self._meta_path.write_text(json.dumps(meta))
+            self.close()
+        return self
+
+    def __len__(self):
+        if self.idxs is not None: return len(self.idxs)
+        data = self._open()
+        return 0 if data is None else len(data)
+    @property
+    def shape(self): return (len(self),*self._open().shape[1:])
+    @property
+    def dtype(self): return self._open().dtype
+
+    def _read(self, idxs):
+        "Rows `idxs` of the underlying array, as one slice if they are contiguous or else as sorted unique rows"
+        data = self._open()
+        if not len(idxs): return np.empty((0,*data.shape[1:]), dtype=data.dtype)
+        if idxs[-1]-idxs[0]+1==len(idxs) and (np.diff(idxs)==1).all(): return data[idxs[0]:idxs[-1]+1]
+        uniq,inv = np.unique(idxs, return_inverse=True)
+        # `pytables` reads an index array alone as point coordinates, with `...` it selects whole rows
+        return data[uniq if data.ndim==1 else (uniq,...)][inv]
+
+    def __getitem__(self, i):
+        "Read row `i`, or the rows selected by a slice, mask or index array `i`"
+        if isinstance(i, (int, np.integer)) or (isinstance(i, Tensor) and i.ndim==0):
+            i = int(i)
+            if i<0: i += len(self)
+            return self._open()[i if self.idxs is None else self.idxs[i]]
+        idxs = _row_idxs(i, len(self))
+        return self._read(idxs if self.idxs is None else self.idxs[idxs])
+
+    def view(self, i):
+        "An `ArrayStore` over the rows selected by `i`, without reading them"
+        idxs = _row_idxs(i, len(self))
+        res = copy(self)
+        # Share the open file, `pytables` can't open it again for reading while it is open for appending
+        res._f,res._data = self._f,self._data
+        res.idxs = idxs if self.idxs is None else self.idxs[idxs]
+        return res
+
+    @property
+    def iloc(self):
+        "Indexer used by `L`, so that the splits and subsets of `TfmdLists` and `Datasets` are views instead of reads"
+        return _ArrayStoreIloc(self)
+
+    def __iter__(self, bs=1024):
+        for i in range(0, len(self), bs): yield from self[i:i+bs]
+
+    def __getstate__(self): return {k:v for k,v in self.__dict__.items() if k not in ('_f','_data')}
+    def __setstate__(self, d): self.__dict__.update(d); self._f,self._data = None,None
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
+    def __repr__(self): return f'{self.__class__.__name__}({self.path}, n={len(self)}, compress={self.compress})'
+
 # %% ../nbs/00_torch_core.ipynb 200
 def flatten_check(inp, targ):
     "Check that `inp` and `targ` have the same number of elements and flatten them."
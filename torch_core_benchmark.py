@@ -0,0 +1,91 @@
+"""Benchmark the per-op overhead of `TensorBase` subclasses against plain tensors, `Learner.plain_batches` and `to_concat`"""
+
+from __future__ import annotations
+from .torch_basics import *
+from .data.all import *
+from .learner import *
+from .losses import *
+
+__all__ = ['benchmark_tensor_ops', 'benchmark_plain_batches', 'benchmark_to_concat']
+
+def _time_ops(f, b, n_iters):
+    for _ in range(3): f(*b)
+    start = time.perf_counter()
+    for _ in range(n_iters): f(*b)
+    return (time.perf_counter()-start)/n_iters
+
+_ops = {'add': lambda x,y,p,t: x+y, 'mul_add': lambda x,y,p,t: x*2+y, 'mean': lambda x,y,p,t: x.mean(),
+        'index': lambda x,y,p,t: x[0], 'normalize': lambda x,y,p,t: (x-y.mean())/(y.std()+1),
+        'cross_entropy': lambda x,y,p,t: F.cross_entropy(p, t)}
+
+def benchmark_tensor_ops(
+    size:tuple=(8,10), # Shape of the tensors, small so that the dispatch overhead dominates
+    n_iters:int=2000, # Number of timed calls of each op
+    typs:tuple=(TensorImage, TensorCategory) # Subclasses of the inputs and of the targets, predictions are `TensorBase`
+) -> pd.DataFrame:
+    "Time a few ops on `TensorBase` subclasses, as in batch transforms and losses, and on the same tensors after `strip_types`"
+    b = (typs[0](torch.randn(*size)),typs[0](torch.rand(*size)),TensorBase(torch.randn(*size)),typs[1](torch.randint(0, size[-1], size[:1])))
+    pb,_ = strip_types(b)
+    res = []
+    for name,f in _ops.items():
+        t_sub,t_plain = _time_ops(f, b, n_iters),_time_ops(f, pb, n_iters)
+        res.append(dict(op=name, subclass_us=t_sub*1e6, plain_us=t_plain*1e6, overhead_us=(t_sub-t_plain)*1e6))
+    return pd.DataFrame(res)
+
+def _typed_learner(n_items, bs, size):
+    "A linear `Learner` on `TensorImage` inputs and `TensorCategory` targets, without `CastToTensor`"
+    ds = [(TensorImage(torch.randn(size)),TensorCategory(i%2)) for i in range(n_items)]
+    dls = DataLoaders.from_dsets(ds, ds[:bs], bs=bs, device='cpu')
+    learn = Learner(dls, nn.Linear(size, 2), loss_func=CrossEntropyLossFlat())
+    learn.remove_cb(CastToTensor)
+    return learn
+
+def _time_fit(learn, n_epochs):
+    with learn.no_logging():
+        learn.fit(1)
+        start = time.perf_counter()
+        learn.fit(n_epochs)
+    return (time.perf_counter()-start)/(n_epochs*len(learn.dls.train))
+
+def benchmark_plain_batches(
+    n_items:int=2048, # Number of training items
+    bs:int=8, # Batch size, small so that the dispatch overhead dominates
+    size:int=16, # Number of features of each input
+    n_epochs:int=2 # Number of timed epochs
+) -> pd.DataFrame:
+    "Time a training batch going through the `TensorBase` `__torch_function__` path and with `Learner.plain_batches`"
+    learn = _typed_learner(n_items, bs, size)
+    t_sub = _time_fit(learn, n_epochs)
+    with learn.plain_batches(): t_plain = _time_fit(learn, n_epochs)
+    return pd.DataFrame([dict(subclass_us=t_sub*1e6, plain_us=t_plain*1e6, overhead_us=(t_sub-t_plain)*1e6)])
+
+def _rowwise_concat(xs, dim=0):
+    "The former `to_concat` fallback for tensors that cannot be concatenated: one tensor per row in an `L`"
+    return sum([L(retain_type(o_.index_select(dim, tensor(i)).squeeze(dim), xs[0]) for i in range_of(o_)) for o_ in xs], L())
+
+def _timeit(f, n_iters=3):
+    f()
+    start = time.perf_counter()
+    for _ in range(n_iters): f()
+    return (time.perf_counter()-start)/n_iters
+
+def benchmark_to_concat(
+    n_batches:int=200, # Number of batches to concatenate
+    bs:int=64, # Rows in each batch
+    seq_len:int=72 # Longest sequence length, ragged batches use a random length up to it
+) -> pd.DataFrame:
+    "Time gathering and reordering `get_preds`-like outputs with the row-wise fallback, eager `torch.cat` `to_concat(ragged=True)` and `to_concat(lazy=True)`"
+    lens = np.random.randint(seq_len//2, seq_len+1, n_batches)
+    ragged = [TensorBase(torch.randint(0, 100, (bs,int(l)))) for l in lens]
+    dense = [TensorBase(torch.randn(bs,seq_len)) for _ in range(n_batches)]
+    idxs = torch.randperm(n_batches*bs)
+    res = [dict(case='ragged', method='rowwise', ms=_timeit(lambda: nested_reorder(_rowwise_concat(ragged), idxs))*1e3),
+           dict(case='ragged', method='ragged', ms=_timeit(lambda: nested_reorder(to_concat(ragged, ragged=True), idxs))*1e3),
+           dict(case='dense', method='eager', ms=_timeit(lambda: nested_reorder(to_concat(dense), idxs)[:bs])*1e3),
+           dict(case='dense', method='lazy', ms=_timeit(lambda: nested_reorder(to_concat(dense, lazy=True), idxs)[:bs].materialize())*1e3)]
+    return pd.DataFrame(res)
+
+if __name__ == '__main__':
+    print(benchmark_tensor_ops())
+    print(benchmark_plain_batches())
+    print(benchmark_to_concat())
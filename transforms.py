@@ -22,68 +22,135 @@ __all__ = ['image_extensions', 'get_files', 'FileGetter', 'get_image_files', 'Im
            'broadcast_vec', 'Normalize']
 
 # %% ../../nbs/05_data.transforms.ipynb 10
+def _filter_files(fs, extensions=None):
+    "Names in `fs` that are not hidden and have one of `extensions`, if specified"
+    return [f for f in fs if not f.startswith('.')
+            and ((not extensions) or f'.{f.split(".")[-1].lower()}' in extensions)]
+
 def _get_files(p, fs, extensions=None):
     p = Path(p)
-    res = [p/f for f in fs if not f.startswith('.')
-           and ((not extensions) or f'.{f.split(".")[-1].lower()}' in extensions)]
+    res = [p/f for f in _filter_files(fs, extensions)]
     return res
 
 # %% ../../nbs/05_data.transforms.ipynb 11
-def get_files(path, extensions=None, recurse=True, folders=None, followlinks=True):
+def _scan_dir(p, index=None):
+    "Modification time of `p`, names of its files, of its subdirectories and of the symlinked ones, reused from `index` if unchanged"
+    files,dirs,links = [],[],[]
+    # Like `os.walk`, directories that can't be read are skipped
+    try: mtime = os.stat(p).st_mtime_ns
+    except OSError: return None,files,dirs,links
+    key = os.path.abspath(p)
+    if index is not None and key in index and index[key][0]==mtime: return index[key]
+    try:
+        with os.scandir(p) as it:
+            for e in it:
+                try:    is_dir = e.is_dir()
+                except OSError: is_dir = False
+                if not is_dir: files.append(e.name)
+                else:
+                    dirs.append(e.name)
+                    if e.is_symlink(): links.append(e.name)
+    except OSError: return None,[],[],[]
+    return mtime,files,dirs,links
+
+def _files_index_path(path):
+    "Default location of the on-disk index of the directories under `path`"
+    key = hashlib.md5(os.path.abspath(path).encode()).hexdigest()
+    return fastai_path('storage')/'files_index'/f'{key}.pkl'
+
+def _walk(path, folders, followlinks=True, n_workers=None, cache=None):
+    "Directories under `path` in `os.walk` order, with the names of their files, scanned level by level in a thread pool"
+    if cache is True: cache = _files_index_path(path)
+    index = {}
+    if cache is not None and Path(cache).exists():
+        try: index = pickle.loads(Path(cache).read_bytes())
+        except Exception: index = {}
+    scans,children,level,root = {},{},[str(path)],True
+    with concurrent.futures.ThreadPoolExecutor(n_workers or None) as ex:
+        while level:
+            res = ex.map(partial(_scan_dir, index=index), level) if n_workers!=0 else map(partial(_scan_dir, index=index), level)
+            nxt = []
+            for p,r in zip(level, res):
+                scans[p] = r
+                _,_,dirs,links = r
+                ds = dirs if followlinks or not links else [o for o in dirs if o not in links]
+                if root and len(folders)!=0: ds = [o for o in ds if o in folders]
+                else:                        ds = [o for o in ds if not o.startswith('.')]
+                children[p] = [os.path.join(p, o) for o in ds]
+                nxt += children[p]
+            level,root = nxt,False
+    if cache is not None:
+        new = {os.path.abspath(p):r for p,r in scans.items()}
+        if any(index.get(k)!=v for k,v in new.items()):
+            index.update(new)
+            cache = Path(cache)
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache.with_name(f'{cache.name}.{os.getpid()}.tmp')
+            tmp.write_bytes(pickle.dumps(index))
+            os.replace(tmp, cache)
+    # Depth-first, top-down, as `os.walk` would yield the directories
+    stack,res = [str(path)],[]
+    while stack:
+        p = stack.pop()
+        res.append((p, scans[p][1]))
+        stack += reversed(children[p])
+    return res
+
+def get_files(path, extensions=None, recurse=True, folders=None, followlinks=True, n_workers=None, cache=None, as_str=False):
     "Get all the files in `path` with optional `extensions`, optionally with `recurse`, only in `folders`, if specified."
+    # Directories are scanned by `n_workers` threads, and `cache` (`True` or a file) is an index of them reused when unchanged
     path = Path(path)
     folders=L(folders)
     extensions = setify(extensions)
     extensions = {e.lower() for e in extensions}
+    _get = (lambda p,f: [os.path.join(p, o) for o in _filter_files(f, extensions)]) if as_str else partial(_get_files, extensions=extensions)
     if recurse:
         res = []
-        for i,(p,d,f) in enumerate(os.walk(path, followlinks=followlinks)): # returns (dirpath, dirnames, filenames)
-            if len(folders) !=0 and i==0: d[:] = [o for o in d if o in folders]
-            else:                         d[:] = [o for o in d if not o.startswith('.')]
+        for i,(p,f) in enumerate(_walk(path, folders, followlinks=followlinks, n_workers=n_workers, cache=cache)):
             if len(folders) !=0 and i==0 and '.' not in folders: continue
-            res += _get_files(p, f, extensions)
+            res += _get(p, f)
     else:
         f = [o.name for o in os.scandir(path) if o.is_file()]
-        res = _get_files(path, f, extensions)
+        res = _get(str(path), f)
     return L(res)
 
 # %% ../../nbs/05_data.transforms.ipynb 16
-def FileGetter(suf='', extensions=None, recurse=True, folders=None):
+def FileGetter(suf='', extensions=None, recurse=True, folders=None, **kwargs):
     "Create `get_files` partial function that searches path suffix `suf`, only in `folders`, if specified, and passes along args"
     def _inner(o, extensions=extensions, recurse=recurse, folders=folders):
-        return get_files(o/suf, extensions, recurse, folders)
+        return get_files(o/suf, extensions, recurse, folders, **kwargs)
     return _inner
 
 # %% ../../nbs/05_data.transforms.ipynb 18
 image_extensions = set(k for k,v in mimetypes.types_map.items() if v.startswith('image/'))
 
 # %% ../../nbs/05_data.transforms.ipynb 19
-def get_image_files(path, recurse=True, folders=None):
+def get_image_files(path, recurse=True, folders=None, **kwargs):
     "Get image files in `path` recursively, only in `folders`, if specified."
-    return get_files(path, extensions=image_extensions, recurse=recurse, folders=folders)
+    return get_files(path, extensions=image_extensions, recurse=recurse, folders=folders, **kwargs)
 
 # %% ../../nbs/05_data.transforms.ipynb 22
-def ImageGetter(suf='', recurse=True, folders=None):
+def ImageGetter(suf='', recurse=True, folders=None, **kwargs):
     "Create `get_image_files` partial that searches suffix `suf` and passes along `kwargs`, only in `folders`, if specified"
-    def _inner(o, recurse=recurse, folders=folders): return get_image_files(o/suf, recurse, folders)
+    def _inner(o, recurse=recurse, folders=folders): return get_image_files(o/suf, recurse, folders, **kwargs)
     return _inner
 
 # %% ../../nbs/05_data.transforms.ipynb 25
-def get_text_files(path, recurse=True, folders=None):
+def get_text_files(path, recurse=True, folders=None, **kwargs):
     "Get text files in `path` recursively, only in `folders`, if specified."
-    return get_files(path, extensions=['.txt'], recurse=recurse, folders=folders)
+    return get_files(path, extensions=['.txt'], recurse=recurse, folders=folders, **kwargs)
 
 # %% ../../nbs/05_data.transforms.ipynb 26
 class ItemGetter(ItemTransform):
     "Creates a proper transform that applies `itemgetter(i)` (even on a tuple)"
-    _retain = False
+    _retain,deterministic = False,True
     def __init__(self, i): self.i = i
     def encodes(self, x): return x[self.i]
 
 # %% ../../nbs/05_data.transforms.ipynb 28
 class AttrGetter(ItemTransform):
     "Creates a proper transform that applies `attrgetter(nm)` (even on a tuple)"
-    _retain = False
+    _retain,deterministic = False,True
     def __init__(self, nm, default=None): store_attr()
     def encodes(self, x): return getattr(x, self.nm, self.default)
 
@@ -189,9 +256,12 @@ def parent_label(o):
     "Label `item` with the parent folder name."
     return Path(o).parent.name
 
+parent_label.deterministic = True
+
 # %% ../../nbs/05_data.transforms.ipynb 63
 class RegexLabeller():
     "Label `item` with regex `pat`."
+    deterministic = True
     def __init__(self, pat, match=False):
         self.pat = re.compile(pat)
         self.matcher = self.pat.match if match else self.pat.search
@@ -205,6 +275,7 @@ class RegexLabeller():
 # %% ../../nbs/05_data.transforms.ipynb 68
 class ColReader(DisplayedTransform):
     "Read `cols` in `row` with potential `pref` and `suff`"
+    deterministic = True
     def __init__(self, cols, pref='', suff='', label_delim=None):
         store_attr()
         self.pref = str(pref) + os.path.sep if isinstance(pref, Path) else pref
@@ -236,9 +307,18 @@ class CategoryMap(CollBase):
         self.items = '#na#' + items if add_na else items
         self.o2i = defaultdict(int, self.items.val2idx()) if add_na else dict(self.items.val2idx())
 
+    def encode(self, objs, strict=None):
+        "Map all `objs` to an array of IDs at once, unknown objects map to `#na#` if it is in the vocab and not `strict`"
+        if getattr(self, '_index', None) is None: self._index = pd.Index(list(self.items), dtype=object)
+        ids = self._index.get_indexer(list(objs) if not hasattr(objs, 'dtype') else objs)
+        if ifnone(strict, not isinstance(self.o2i, defaultdict)) and (ids<0).any():
+            diff = "', '".join(map(str, pd.unique(np.asarray(objs, dtype=object)[ids<0])))
+            raise KeyError(f"Labels '{diff}' were not included in the training dataset")
+        return np.where(ids<0, 0, ids)
+
     def map_objs(self,objs):
         "Map `objs` to IDs"
-        return L(self.o2i[o] for o in objs)
+        return L(self.encode(objs).tolist())
 
     def map_ids(self,ids):
         "Map `ids` to objects in vocab"
@@ -249,7 +329,7 @@ class CategoryMap(CollBase):
 # %% ../../nbs/05_data.transforms.ipynb 78
 class Categorize(DisplayedTransform):
     "Reversible transform of category string to `vocab` id"
-    loss_func,order=CrossEntropyLossFlat(),1
+    loss_func,order,deterministic=CrossEntropyLossFlat(),1,True
     def __init__(self, vocab=None, sort=True, add_na=False):
         if vocab is not None: vocab = CategoryMap(vocab, sort=sort, add_na=add_na)
         store_attr()
@@ -259,12 +339,17 @@ class Categorize(DisplayedTransform):
         self.c = len(self.vocab)
 
     def encodes(self, o):
+        # `as_subclass` skips the conversions of `TensorBase.__new__`, which would dominate the cost of a dict lookup
         try:
-            return TensorCategory(self.vocab.o2i[o])
+            return torch.tensor(self.vocab.o2i[o]).as_subclass(TensorCategory)
         except KeyError as e:
             raise KeyError(f"Label '{o}' was not included in the training dataset") from e
     def decodes(self, o): return Category      (self.vocab    [o])
 
+    def encode_col(self, col):
+        "Encode a whole column of labels at once, as a `TensorCategory` of ids"
+        return TensorCategory(self.vocab.encode(col))
+
 # %% ../../nbs/05_data.transforms.ipynb 79
 class Category(str, ShowTitle): _show_args = {'label': 'category'}
 
@@ -277,18 +362,23 @@ class MultiCategorize(Categorize):
     def setups(self, dsets):
         if not dsets: return
         if self.vocab is None:
-            vals = set()
-            for b in dsets: vals = vals.union(set(b))
+            vals = set(itertools.chain.from_iterable(dsets))
             self.vocab = CategoryMap(list(vals), add_na=self.add_na)
 
     def encodes(self, o):
-        if not all(elem in self.vocab.o2i.keys() for elem in o):
-            diff = [elem for elem in o if elem not in self.vocab.o2i.keys()]
-            diff_str = "', '".join(diff)
+        ids = [self.vocab.o2i.get(o_, -1) for o_ in o]
+        if -1 in ids:
+            diff_str = "', '".join(o_ for o_,i in zip(o,ids) if i==-1)
             raise KeyError(f"Labels '{diff_str}' were not included in the training dataset")
-        return TensorMultiCategory([self.vocab.o2i[o_] for o_ in o])
+        return torch.tensor(ids, dtype=torch.long).as_subclass(TensorMultiCategory)
     def decodes(self, o): return MultiCategory      ([self.vocab    [o_] for o_ in o])
 
+    def encode_col(self, col):
+        "Encode a whole column of label lists at once, as flat `TensorMultiCategory` ids and the CSR-style offsets of each row"
+        lens = np.fromiter(map(len, col), dtype=np.int64, count=len(col))
+        ids = self.vocab.encode(list(itertools.chain.from_iterable(col)), strict=True)
+        return TensorMultiCategory(ids),tensor(np.concatenate([[0], lens.cumsum()]))
+
 # %% ../../nbs/05_data.transforms.ipynb 85
 class MultiCategory(L):
     def show(self, ctx=None, sep=';', color='black', **kwargs):
@@ -297,7 +387,7 @@ class MultiCategory(L):
 # %% ../../nbs/05_data.transforms.ipynb 87
 class OneHotEncode(DisplayedTransform):
     "One-hot encodes targets"
-    order=2
+    order,deterministic=2,True
     def __init__(self, c=None): store_attr()
 
     def setups(self, dsets):
@@ -320,7 +410,7 @@ class EncodedMultiCategorize(Categorize):
 # %% ../../nbs/05_data.transforms.ipynb 94
 class RegressionSetup(DisplayedTransform):
     "Transform that floatifies targets"
-    loss_func=MSELossFlat()
+    loss_func,deterministic=MSELossFlat(),True
     def __init__(self, c=None): store_attr()
 
     def encodes(self, o): return tensor(o).float()
@@ -342,7 +432,7 @@ def get_c(dls):
 # %% ../../nbs/05_data.transforms.ipynb 109
 class ToTensor(Transform):
     "Convert item to appropriate tensor class"
-    order = 5
+    order,deterministic = 5,True
 
 # %% ../../nbs/05_data.transforms.ipynb 111
 class IntToFloatTensor(DisplayedTransform):
@@ -352,6 +442,9 @@ class IntToFloatTensor(DisplayedTransform):
     def encodes(self, o:TensorImage): return o.float().div_(self.div)
     def encodes(self, o:TensorMask ): return (o.long() / self.div_mask).long()
     def decodes(self, o:TensorImage): return ((o.clamp(0., 1.) * self.div).long()) if self.div else o
+    def affine(self):
+        "`(scale, shift)` of `encodes` on a `TensorImage`, so that `TfmdDL` can fuse it with the next affine transforms"
+        return (1./self.div, 0.) if self.div else None
 
 # %% ../../nbs/05_data.transforms.ipynb 114
 def broadcast_vec(dim, ndim, *t, cuda=True):
@@ -380,5 +473,7 @@ class Normalize(DisplayedTransform):
     def decodes(self, x:TensorImage):
         f = to_cpu if x.device.type=='cpu' else noop
         return (x*f(self.std) + f(self.mean))
+    def affine(self): return None if self.mean is None or self.std is None else (1/self.std, -self.mean/self.std)
 
-    _docs=dict(encodes="Normalize batch", decodes="Denormalize batch")
+    _docs=dict(encodes="Normalize batch", decodes="Denormalize batch",
+               affine="`(scale, shift)` of `encodes`, so that `TfmdDL` can fuse it with the previous affine transforms")